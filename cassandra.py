@@ -12,13 +12,13 @@ import signal
 import time
 import json
 import requests
-import sys
 import traceback
 from copy import deepcopy
 
 # user imports
 from utils import *
 from constants import *
+from libjmxplan import mbean_properties
 
 #Cassandra metrics
 metrics = [
@@ -380,6 +380,19 @@ ks_metrics = [
 
 exclude_ks = ["system_auth", "system_distributed", "system_schema", "system_traces"]
 
+JOLOKIA_TIMEOUT = 10
+# one read returns the metrics of all keyspaces
+KEYSPACE_PATTERN = "org.apache.cassandra.metrics:type=Keyspace,keyspace=*,name=*"
+KEYSPACE_ATTRIBUTES = sorted(set(metric["metric_key"] for metric in ks_metrics if metric["jmx_type"] == "Keyspace"))
+TABLES_METRIC = [metric for metric in ks_metrics if metric["jmx_type"] == "Tables"][0]
+
+
+def mbean_name(metric, keyspace=""):
+    """Returns the MBean name of a metric, the object name part of its format_str."""
+    return metric["format_str"].split("/jolokia/read/", 1)[1].format(
+        jmx_domain=metric["jmx_domain"], jmx_type=metric["jmx_type"], jmx_scope=metric.get("jmx_scope"),
+        jmx_path=metric.get("jmx_path"), jmx_keyspace=keyspace, name=metric["metric_name"])
+
 class CassandraStats(object):
     """Plugin object will be created only once and collects cassandra statistics info every interval."""
 
@@ -392,6 +405,8 @@ class CassandraStats(object):
         self.port = 8778
         self.keyspaces = []
         self.previousData = {}
+        # keep-alive connection to the jolokia agent
+        self.session = requests.Session()
 
     def config(self, cfg):
         """Initializes variables from conf files."""
@@ -412,76 +427,71 @@ class CassandraStats(object):
         cassandra_dict[ACTUALPLUGINTYPE] = CASSANDRA
         cassandra_dict[PLUGINTYPE] = doc
 
-    def fetch_and_update(self,
-            name,
-            keyname,
-            jmx_domain,
-            jmx_type,
-            jmx_scope,
-            jmx_path,
-            format_str,
-            jmx_keyspace=""
-    ):
+    def read_bulk(self, reads):
         """
-        Fetch a metric from jolokia jmx agent.
-        The jolokia service has a get request made to it to read a metric that
-        is passed in as name and keyname from the server.
-        :param name: Name of the metric
-        :param keyname: Keyname of the metric
-        :param jmx_domain: Domain of the metric
-        :param jmx_type: Type of the metric
-        :param jmx_scope: Scope of the metric
-        :param jmx_path: Specified path of the metric
-        :param jmx_keyspace: keyspace name of cassandra
-        :param format_str: GET URL formed with the help of above params
-        :return: Metric value
+        Read MBeans from jolokia jmx agent with one bulk POST request on the keep-alive session.
+        :param reads: list of jolokia read requests
+        :return: list of values of the reads, None for the failed ones, None if the agent is not reachable
         """
-
-        auth = requests.auth.HTTPBasicAuth(self.user, self.password) \
+        url = "http://{host}:{port}/jolokia/".format(host=self.host, port=self.port)
+        self.session.auth = requests.auth.HTTPBasicAuth(self.user, self.password) \
             if self.user is not None and self.password is not None else None
-
         try:
-            resp = requests.get(
-                format_str.format(jmx_domain=jmx_domain, jmx_type=jmx_type, jmx_scope=jmx_scope, jmx_path=jmx_path,
-                                  jmx_keyspace=jmx_keyspace, host=self.host, name=name, port=self.port),
-                auth=auth
-            )
-        except requests.exceptions.ConnectionError:
-            collectd.error(
-                "The application recieved a connection error, failed to connect jolokia JVM agent"
-            )
-            sys.exit(1)
-        if resp.status_code >= 400 or resp.json().get("error"):
-            collectd.error("ERROR the jolokia agent returned an error trying to access the following metric")
-            collectd.error(format_str.format(jmx_domain=jmx_domain, jmx_type=jmx_type, jmx_scope=jmx_scope, jmx_path=jmx_path,
-                                    jmx_keyspace=jmx_keyspace, name=name, key=keyname, host=self.host, port=self.port))
-            return
-        else:
-            jmx_data = resp.json()["value"]
-            if (keyname == "TableName"):
-                metric = jmx_data.values()[0][keyname]
+            resp = self.session.post(url, data=json.dumps(reads), timeout=JOLOKIA_TIMEOUT)
+            resp.raise_for_status()
+            responses = resp.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            collectd.error("Plugin cassandra: failed to read metrics from jolokia JVM agent %s: %s" % (url, str(e)))
+            return None
+
+        values = []
+        for read, response in zip(reads, responses):
+            if response.get("status") != 200:
+                collectd.error("ERROR the jolokia agent returned an error trying to access %s %s: %s"
+                               % (read["mbean"], read.get("attribute", ""), response.get("error")))
+                values.append(None)
             else:
-                metric = jmx_data[keyname]
-            return (metric)
+                values.append(response["value"])
+        return values
 
-    def get_cassandra_details(self):
+    def fetch_metrics(self):
+        """
+        Fetch cassandra, JVM and keyspace metrics of a cycle with one bulk request.
+        :return: tuple of dicts of cassandra metrics, jvm metrics and keyspace -> keyspace metrics, None on failure
+        """
+        reads = [{"type": "read", "mbean": mbean_name(metric), "attribute": metric["metric_key"]}
+                 for metric in metrics + jvm_metrics]
+        reads.append({"type": "read", "mbean": KEYSPACE_PATTERN, "attribute": KEYSPACE_ATTRIBUTES})
+        reads.append({"type": "read", "mbean": mbean_name(TABLES_METRIC, "*"), "attribute": TABLES_METRIC["metric_key"]})
+        values = self.read_bulk(reads)
+        if values is None:
+            return None
+
+        cassandra_values = dict((metric["display_name"], value) for metric, value in zip(metrics, values))
+        jvm_values = dict((metric["display_name"], value) for metric, value in zip(jvm_metrics, values[len(metrics):]))
+        keyspace_mbeans, table_mbeans = values[-2] or {}, values[-1] or {}
+        ks_values = {}
+        for mbean, attributes in keyspace_mbeans.items():
+            props = mbean_properties(mbean)
+            for metric in ks_metrics:
+                if metric["metric_name"] == props.get("name") and metric["metric_key"] in attributes:
+                    ks_values.setdefault(props.get("keyspace"), {})[metric["display_name"]] = attributes[metric["metric_key"]]
+        for mbean, attributes in table_mbeans.items():
+            ks_values.setdefault(mbean_properties(mbean).get("keyspace"), {}).setdefault(
+                TABLES_METRIC["display_name"], attributes[TABLES_METRIC["metric_key"]])
+        return cassandra_values, jvm_values, ks_values
+
+    def get_cassandra_details(self, cassandra_values):
         """
         Get Cassandra stats from jolokia agent
+        :param cassandra_values: metric values read from jolokia agent
         :return: dict of cassandra stats
         """
         cassandra_results = {}
         cassandraMetrics = {}
         try:
             for metric in metrics:
-                value = self.fetch_and_update(
-                    name=metric["metric_name"],
-                    keyname=metric["metric_key"],
-                    jmx_domain=metric["jmx_domain"],
-                    jmx_type=metric["jmx_type"],
-                    jmx_scope=metric.get("jmx_scope"),
-                    jmx_path=metric.get("jmx_path"),
-                    format_str=metric["format_str"]
-                )
+                value = cassandra_values.get(metric["display_name"])
                 if value:
                     if metric["display_name"] in ["totalDiskSpaceUsed", "diskSpaceUsedLoad", "totalCompactedSize"]:
                         cassandra_results[metric["display_name"]] = round(value / (1024.0 * 1024.0), 2)
@@ -564,24 +574,17 @@ class CassandraStats(object):
 
         return cassandraMetrics
 
-    def get_jvm_details(self, cassandraMetrics):
+    def get_jvm_details(self, jvm_values, cassandraMetrics):
         """
         Get JVM stats from jolokia agent
+        :param jvm_values: metric values read from jolokia agent
         :param cassandraMetrics: collected cassandra stats dict
         :return: cassandraMetrics dict contains both cassandra stats and jvm stats
         """
         jvm_results = {}
         try:
             for metric in jvm_metrics:
-                value = self.fetch_and_update(
-                    name=metric["metric_name"],
-                    keyname=metric["metric_key"],
-                    jmx_domain=metric["jmx_domain"],
-                    jmx_type=metric["jmx_type"],
-                    jmx_scope=metric.get("jmx_scope"),
-                    jmx_path=metric.get("jmx_path"),
-                    format_str=metric["format_str"]
-                )
+                value = jvm_values.get(metric["display_name"])
                 if value:
                     if metric["metric_key"] == "NonSystemKeyspaces":
                         for ks in exclude_ks:
@@ -640,9 +643,10 @@ class CassandraStats(object):
             collectd.error("Error in collecting jmxStats due to %s " % str(e))
         return cassandraMetrics
 
-    def get_keyspace_details(self, cassandraMetrics):
+    def get_keyspace_details(self, ks_values, cassandraMetrics):
         """
         Get keyspace stats from jolokia agent
+        :param ks_values: dict of keyspace -> metric values read from jolokia agent
         :param cassandraMetrics: collected cassandra and jvm stats dict
         :return: CassandraMetrics dict contains cassandra stats, jvm stats and one or more keyspace stats
         """
@@ -651,16 +655,7 @@ class CassandraStats(object):
             for keyspace in self.keyspaces:
                 try:
                     for metric in ks_metrics:
-                        value = self.fetch_and_update(
-                            name=metric["metric_name"],
-                            keyname=metric["metric_key"],
-                            jmx_domain=metric["jmx_domain"],
-                            jmx_type=metric["jmx_type"],
-                            jmx_scope=metric.get("jmx_scope"),
-                            jmx_path=metric.get("jmx_path"),
-                            format_str=metric["format_str"],
-                            jmx_keyspace=keyspace
-                        )
+                        value = ks_values.get(keyspace, {}).get(metric["display_name"])
                         if value:
                             if metric["display_name"] == "diskSpaceUsed":
                                 ks_results[metric["display_name"]] = round(value / (1024.0 * 1024.0), 2)
@@ -721,9 +716,13 @@ class CassandraStats(object):
         Collect cassandrStats, jvmStats and keyspaceStats using jolokia JVM agent
         :return: Dict contains cassandra stats, jvm stats and keyspace stats
         """
-        cassandra_details = self.get_cassandra_details()
-        jvm_details = self.get_jvm_details(cassandra_details)
-        final_cassandra_details = self.get_keyspace_details(jvm_details)
+        fetched = self.fetch_metrics()
+        if fetched is None:
+            return {}
+        cassandra_values, jvm_values, ks_values = fetched
+        cassandra_details = self.get_cassandra_details(cassandra_values)
+        jvm_details = self.get_jvm_details(jvm_values, cassandra_details)
+        final_cassandra_details = self.get_keyspace_details(ks_values, jvm_details)
 
         #Adding common parameters to the collected stats
         if final_cassandra_details:
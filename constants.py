@@ -33,6 +33,12 @@ LINUX_DYNAMIC = "linux_dynamic"
 PLUGINTYPE = "_documentType"
 ACTUALPLUGINTYPE = "_actual_collectd_plugin_type"
 DOCUMENTSTYPES = "documentsTypes"
+# Columnar batch documents
+COLUMNAR = "columnar"
+BATCH_TYPE = "_batchType"
+BATCH_ROWS = "_rows"
+BATCH_COLUMNS = "_columns"
+BATCH_COMMON_FIELDS = (TIMESTAMP, PLUGIN, PLUGIN_INS, PLUGINTYPE, ACTUALPLUGINTYPE)
 
 # Interface Plugin Constants
 IF_STATS = "nic_stats"
@@ -110,6 +116,8 @@ CAPACITY = "capacity"
 READIOPS = "readIOPS"
 WRITEIOPS = "writeIOPS"
 AVGQUEUESIZE = "avgQuSize"
+DISKUTILIZATION = "utilization"
+AWAIT = "await"
 READTHROUGHPUT = "readThroughput"
 WRITETHROUGHPUT = "writeThroughput"
 READCOUNT = "readCount"
@@ -132,6 +140,29 @@ LOG_EXTENSION = ".txt"
 MAX_LOG_ENTRIES = "MaxEntries"
 PATH = "/opt/sfapm/collectd/var/lib/"
 WRITE_JSON_ENABLED = True
+# write_json asynchronous mode
+ASYNC_WRITE = "AsyncWrite"
+QUEUE_SIZE = "QueueSize"
+QUEUE_POLICY = "QueuePolicy"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+WRITE_JSON_ASYNC = False
+WRITE_JSON_QUEUE_SIZE = 100000
+WRITE_JSON_QUEUE_POLICY = DROP_OLDEST
+WRITE_JSON_STATS_INTERVAL = 60
+# seconds the queued documents may take to be written at shutdown
+WRITE_JSON_SHUTDOWN_TIMEOUT = 10
+WRITE_JSON = "write_json"
+WRITER_STATS = "writerStats"
+# self-metrics of the pids or targets collected by a plugin in its latest poll
+COLLECTOR_STATS = "collectorStats"
+# write_json storage modes
+STORAGE_MODE = "StorageMode"
+SEGMENT_SIZE = "SegmentSize"
+RING = "ring"
+SEGMENT = "segment"
+WRITE_JSON_STORAGE_MODE = RING
+WRITE_JSON_SEGMENT_SIZE = 4 * 1024 * 1024
 FACTOR = 1024
 BITFACTOR = 8
 
@@ -173,6 +204,15 @@ PROCESS_STATE = "_processState"
 JVM_STATS = "jvm"
 JVM_DATA_PATH = "/opt/sfapm/collectd/var/lib/data/jvm"
 
+# prometheus plugins targets and metric filter
+TARGETS = "Targets"
+SCRAPE_TIMEOUT = "Timeout"
+PROMETHEUS_TARGET = "_target"
+SUPPRESS_UNCHANGED = "SuppressUnchanged"
+INCLUDE_METRICS = "IncludeMetrics"
+EXCLUDE_METRICS = "ExcludeMetrics"
+LABEL_FILTER = "LabelFilter"
+
 # APACHE CONSTANTS
 DEFAULT_LOCATION = "server-status"
 LOCATION = "location"
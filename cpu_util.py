@@ -13,10 +13,10 @@ import json
 import time
 import psutil
 import collectd
-import re
 import sys
 # user imports
 import utils
+import libperf
 from utils import PlatformOS, PlatformVersion
 from constants import *
 
@@ -28,6 +28,7 @@ class CpuUtil(object):
         """Initializes interval and previous dictionary variable."""
         self.interval = DEFAULT_INTERVAL
         self.prev_data = {}
+        self.llc_sampler = None
 
     def config(self, cfg):
         """Initializes variables from conf files."""
@@ -36,47 +37,17 @@ class CpuUtil(object):
                 self.interval = children.values[0]
 
     def get_LLC_stats(self):
-        LLCStats, LLCerr = utils.get_cmd_output("perf stat -a -e LLC-loads,LLC-load-misses sleep 2")
-
-        sdlines = re.split("\n", LLCerr)
-        num_lines = len(sdlines)
-        index = 0
-        LLCLoads = 0
-        LLCLoadMisses = 0
-        LLC = False
-        while index < num_lines:
-            line = sdlines[index]
-            if line:
-                if "perf not found for kernel" in line:
-                    collectd.info(
-                        "Plugin cpu_static: Perf is not installed for the kernel.")
-                    return 0
-                elif "not supported" in line:
-                    collectd.info(
-                        "Plugin cpu_static: LLC Statistics is hidden from Virtual machines.")
-                    return 0
-                elif "LLC-loads" in line:
-                    try:
-                        LLCLoads = float(line.strip(" ").split(" ")[0].replace(",", ""))
-                        LLC = True
-                    except ValueError:
-                        collectd.info("Plugin cpu_util: LLCLoads value not found/not counted")
-
-                elif "LLC-load-misses" in line:
-                    try:
-                       LLCLoadMisses = float(line.strip(" ").split(" ")[0].replace(",", ""))
-                       LLC = True
-                    except ValueError:
-                        collectd.info("Plugin cpu_util: LLCLoadMisses value not found/not counted")
-
-                index += 1
-            else:
-                index += 1
-        if LLC and LLCLoads != 0:
-            return round(((LLCLoadMisses / LLCLoads) * 100), 2)
-
-        return 0
-
+        """Returns LLC miss rate of the latest interval sampled by the background
+        sampler, which is started on the first call."""
+        if self.llc_sampler is None:
+            self.llc_sampler = libperf.LLCSampler(self.interval)
+            self.llc_sampler.start()
+        return self.llc_sampler.latest()
+
+    def shutdown(self):
+        """Stops the LLC sampler."""
+        if self.llc_sampler is not None:
+            self.llc_sampler.stop()
 
     def add_cpu_data(self):
         """Returns dictionary with values of total,per core CPU utilization
@@ -199,3 +170,4 @@ def init():
 OBJ = CpuUtil()
 collectd.register_config(OBJ.config)
 collectd.register_read(OBJ.read_temp)
+collectd.register_shutdown(OBJ.shutdown)
@@ -9,7 +9,6 @@
 #!/usr/bin/python
 import signal
 import time
-import re
 import json
 from copy import deepcopy
 import collectd
@@ -28,6 +27,7 @@ class DiskStats(object):
         """Initializes interval and previous dictionary variable."""
         self.interval = DEFAULT_INTERVAL
         self.prev_data = {}
+        self.io_sampler = libdiskstat.DiskIoSampler()
 
     def read_config(self, cfg):
         """Initializes variables from conf files."""
@@ -35,81 +35,40 @@ class DiskStats(object):
             if children.key == INTERVAL:
                 self.interval = children.values[0]
 
-    def get_disk_info(self):
-        """Function to get name, type, size and mountpoint info of disk and partition."""
-        (lsblk, err) = utils.get_cmd_output(
-            'lsblk -bno  KNAME,TYPE,SIZE,MOUNTPOINT | grep \'disk\|part\'')
-        if err:
-            collectd.error('Plugin disk_stat: error in lsblk command')
-            return None
-
-        disk_info = re.split('\n', lsblk)
-        return disk_info
-
     def get_static_data(self):
         """Returns dictionary with values of NAME, TYPE, CAPACITY and MOUNTPOINT."""
         dict_disk = {}
-        list_disk = self.get_disk_info()
-        if not list_disk:
+        list_disk = libdiskstat.get_disk_info()
+        if list_disk == FAILURE or not list_disk:
             return None
 
-        index = 0
-        num_lines = len(list_disk)
-
-        while index < num_lines:
-            line = list_disk[index]
-            if line:
-                parts = re.split(r'\s+', line.strip())
-                disk = {DISK_TYPE: parts[1], CAPACITY: round(
-                    float(parts[2]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)}
-                if len(parts) == 4:
-                    disk[MOUNTPOINT] = parts[3]
-                else:
-                    disk[MOUNTPOINT] = ""
-                if disk[MOUNTPOINT] is "" or SWAP not in disk[MOUNTPOINT]:
-                    dict_disk[parts[0]] = disk
-                disk[USAGE] = 0
-                index += 1
-            else:
-                break
+        for name, disk_type, size, mountpoint in list_disk:
+            disk = {DISK_TYPE: disk_type, CAPACITY: round(
+                float(size) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)}
+            disk[MOUNTPOINT] = mountpoint if mountpoint else ""
+            if disk[MOUNTPOINT] is "" or SWAP not in disk[MOUNTPOINT]:
+                dict_disk[name] = disk
+            disk[USAGE] = 0
 
         return dict_disk
 
-    def get_iostat_data(self):
-        """Returns dictionary with values avgqu_sz  """
-        (iodata, err) = utils.get_cmd_output('iostat -d -x')
-        if err:
-            collectd.error('Plugin disk_stat: error in iostat command or sysstat is not installed')
-            return None
-
-        iodata_info = re.split('\n', iodata)
-        iodata = {}
-        for statline in iodata_info[3:]:
-            if statline:
-                iodata[statline.split()[0]] = statline.split()[8]
-        return iodata
-
     def get_dynamic_data(self):
-        """Returns dictionary with values of READBYTE, WRITEBYTE, READCOUNT, WRITECOUNT."""
+        """Returns dictionary with values of READBYTE, WRITEBYTE, READCOUNT, WRITECOUNT,
+        and AVGQUEUESIZE, DISKUTILIZATION, AWAIT over the last interval."""
         dict_disk = {}
-        dict_iostats = self.get_iostat_data()
-        if not dict_iostats:
-           collectd.error('Plugin disk_stat: error in iostat command or sysstat is not installed')
-           return None
         disk_part_io = libdiskstat.disk_io_counters()
         if disk_part_io == FAILURE:
             return None
+        disk_part_delta = self.io_sampler.poll(disk_part_io)
 
         for name, disk_ioinfo in disk_part_io.items():
-            avgqusizedata = dict_iostats.get(name)
-            if avgqusizedata:
-               avgqusizedata = float(avgqusizedata)
-            else:
-               avgqusizedata = 0.0
+            disk_iodelta = disk_part_delta[name]
             disk = {READBYTE: float(disk_ioinfo.read_bytes) / (FACTOR * FACTOR), WRITEBYTE: float(
                 disk_ioinfo.write_bytes) / (FACTOR * FACTOR), READCOUNT: disk_ioinfo.read_count,
                     WRITECOUNT: disk_ioinfo.write_count, READTIME: disk_ioinfo.read_time,
-                    WRITETIME: disk_ioinfo.write_time,USAGE: 0,AVGQUEUESIZE: avgqusizedata}
+                    WRITETIME: disk_ioinfo.write_time, USAGE: 0,
+                    AVGQUEUESIZE: disk_iodelta.avg_queue_size,
+                    DISKUTILIZATION: disk_iodelta.utilization, AWAIT: disk_iodelta.await_time}
             dict_disk[name] = disk
 
         return dict_disk
@@ -130,44 +89,15 @@ class DiskStats(object):
 
     def add_agg_capacity(self):
         """Function to get total capacity."""
-        lsblk, err = utils.get_cmd_output(
-            "lsblk -nbo KNAME,TYPE,SIZE | grep disk | grep -v fd | awk '{print $3}'")
-        if err:
-            collectd.error("Plugin disk_stat : error in lsblk command")
+        total_sum = libdiskstat.get_total_capacity()
+        if total_sum == FAILURE:
+            collectd.error("Plugin disk_stat : error in reading block devices")
             return None
-
-        sdlines = re.split("\n", lsblk)
-        num_lines = len(sdlines)
-        index = 0
-        total_sum = 0
-        while index < num_lines:
-            line = sdlines[index]
-            if line:
-                total_sum += int(line)
-                index += 1
-            else:
-                index += 1
         return round(float(total_sum) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)
 
     def add_agg_usage(self):
         """Function to get total usage."""
-        (df_out, err) = utils.get_cmd_output(
-            "df -kl |awk '/^\/dev\//' | awk '{print $3}'")
-        if err:
-            collectd.error('Plugin disk_stat: error in df command')
-            return None
-
-        splines = re.split('\n', df_out)
-        unum_lines = len(splines)
-        uindex = 0
-        usage_sum = 0
-        while uindex < unum_lines:
-            line = splines[uindex]
-            if line:
-                usage_sum += int(line)  # usage_sum is in Kb
-                uindex += 1
-            else:
-                uindex += 1
+        usage_sum = libdiskstat.get_total_usage_kb()  # usage_sum is in Kb
         return round(float((usage_sum * FACTOR)) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)
 
     def add_aggregate(self, dict_disks):
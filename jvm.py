@@ -10,8 +10,11 @@ heap size, heap usage, Process state]
 """
 
 import sys
-import subprocess
+import struct
 import collectd
+import libproctable
+from libhsperf import HsPerfCache, HsPerfError
+from libjvmregistry import REGISTRY
 from constants import *
 from utils import *
 import time
@@ -25,6 +28,7 @@ class JVM(object):
         self.interval = 0
         self.process = None
         self.py_version = sys.version_info
+        self.hsperf = HsPerfCache()
 
     def read_config(self, cfg):
         """Initializes variables from conf files."""
@@ -36,81 +40,36 @@ class JVM(object):
 
     def get_ramusage(self, pid):
         """Returns RAM usage in MB"""
-        if self.py_version < (2,7):
-            cmd = "ps aux | grep '{0}'".format(pid)
-            (inp, out, stderr) = os.popen3(cmd)
-            ramusage = out.read()
-            if stderr.read():
-                collectd.info("Error: %s" % stderr.read())
-                return -1
-        else:
-            call = subprocess.Popen("ps aux | grep '%s'" % pid, shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (ramusage, err) = call.communicate()
-            if err:
-                collectd.debug("Error: %s" % err)
-                return -1
-        usage = ramusage.split("\n")
-        ramusage = -1
-        for ram in usage:
-            if ram is not "":
-                ramusage = ram.split()
-                if ramusage[1] == pid:
-                    ramusage = (float(ramusage[5])) / 1024
-                    break
-        return ramusage
+        try:
+            with open('/proc/%d/status' % (int(pid))) as fileobj:
+                for line in fileobj:
+                    if line.startswith("VmRSS:"):
+                        return (float(line.split()[1])) / 1024
+        except IOError:
+            collectd.debug("Error: Unable to open /proc/%d/status" % (int(pid)))
+            return -1
+        # kernel thread or zombie
+        return 0.0
 
     def get_cpuusage(self, pid):
         """Returns cpu utilization, CLK_TCK, utime, and stime"""
-        if self.py_version < (2,7):
-            cmd = "ps aux | grep {0}".format(pid)
-            (inp, out, stderr) = os.popen3(cmd)
-            cpuusage = out.read()
-            if stderr.read():
-                collectd.info("Error: %s" % stderr.read())
-                return -1, -1, -1, -1
-        else:
-            call = subprocess.Popen("ps aux | grep %s" % pid, shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (cpuusage, err) = call.communicate()
-            if err:
-                collectd.debug("Error: %s" % err)
-                return -1, -1, -1, -1
-        usage = cpuusage.split("\n")
-        for cpu in usage:
-            if cpu is not "":
-                cpu = cpu.split()
-                if cpu[1] == pid:
-                    break
-
-        if self.py_version < (2,7):
-            cmd = "getconf -a | grep CLK_TCK"
-            (inp, out, stderr) = os.popen3(cmd)
-            clk_tick = out.read()
-            if stderr.read():
-                collectd.info("Error: %s" % stderr.read())
-                return -1, -1, -1, -1
-        else:
-            call = subprocess.Popen("getconf -a | grep CLK_TCK", shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (clk_tick, err) = call.communicate()
-            if err:
-                collectd.debug("Error: %s" % err)
-                return -1, -1, -1, -1
-
-        clk_tick = clk_tick.split()
         try:
-            fileobj = open('/proc/%d/stat' % (int(pid)))
-        except:
+            with open('/proc/%d/stat' % (int(pid))) as fileobj:
+                data = fileobj.read()
+            uptime = libproctable.read_uptime()
+        except (IOError, ValueError):
             collectd.debug("Error: Unable to open /proc/%d/stat" % (int(pid)))
             return -1, -1, -1, -1
-        lines = fileobj.readlines()
-        for line in lines:
-            line = line.split()
-            utime = line[13]
-            stime = line[14]
-            cpuval = cpu[2]
-            return cpuval, utime, stime, clk_tick[1]
+        line = data[data.rfind(")") + 2:].split()
+        utime = line[11]
+        stime = line[12]
+        # cpu time over the lifetime of the process, as the %CPU of ps
+        elapsed = uptime - float(line[19]) / libproctable.CLK_TCK
+        cpuval = 0.0
+        if elapsed > 0:
+            cpuval = round((int(utime) + int(stime)) * 100.0 / (elapsed * libproctable.CLK_TCK), 1)
+        return cpuval, utime, stime, libproctable.CLK_TCK
+
     def remove_inactive_pids(self,active_pids):
         for root, dirs, files in os.walk(JVM_DATA_PATH):
             for d in dirs:
@@ -119,34 +78,14 @@ class JVM(object):
     def get_pid(self, process_name):
         """Returns pid for JVM process"""
 	collectd.info("jvm: getting pids")
-        if sys.version_info < (2,7):
-           cmd = "jcmd | grep -E '{0}' |grep -v JCmd ".format(process_name)
-           (inp, out, stderr) = os.popen3(cmd)
-           pids = out.read()
-           collectd.info("pids: %s" % pids)
-           if stderr.read():
-               collectd.info("jvm Error: %s" % stderr.read())
-               return None
-        else:
-            call = subprocess.Popen("sudo jcmd | grep -E '%s'|grep -v JCmd " % (
-                process_name), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (pids, err) = call.communicate()
-            if err:
-                collectd.info("jvm Error: %s" % err)
-                return None
-
-        pids = pids.split("\n")
         pid_list = []
         pName_list = []
-        for pid in pids:
-            collectd.info("pids value : %s" % pid)
-            if pid is not "":
-                collectd.info("pids value indside: %s" % pid)
-                pidval = pid.split()
-                collectd.info("pidxs value indside: %s" % pidval[0])
-                collectd.info("pid names value indside: %s" % pidval[1])
-                pid_list.append(pidval[0])
-                pName_list.append(pidval[1])
+        for jvm in REGISTRY.search(process_name):
+            if jvm.main_class == "sun.tools.jcmd.JCmd":
+                continue
+            pid_list.append(str(jvm.pid))
+            pName_list.append(jvm.main_class)
+        collectd.info("pids: %s" % pid_list)
         return pid_list,pName_list
 
     def get_jvmstatistics(self, pid, state, process_name):
@@ -165,127 +104,24 @@ class JVM(object):
                 num_threads = num_threads[1]
                 break
 
-        numof_classloaded = "%s %s" % ('jstat -class', pid)
-        if self.py_version < (2,7):
-            (inp, out, stderr) = os.popen3(numof_classloaded)
-            classes = out.read()
-            if stderr.read():
-                collectd.info("Error: %s" % stderr.read())
-                return
-        else:
-            call = subprocess.Popen(numof_classloaded, shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (classes, err) = call.communicate()
-            if err:
-                collectd.info("Error: %s" % err)
-                return
-
-        classes = classes.split()
-
-        heapsize = 'java -XX:+PrintFlagsFinal -version | grep -iE MaxHeapSize'
-        if self.py_version < (2,7):
-            (inp, out, stderr) = os.popen3(heapsize)
-            heapsize = out.read()
-            if stderr.read() and not heapsize:
-                collectd.info("Error: %s" % stderr.read())
-                return
-        else:
-            call = subprocess.Popen("%s" % heapsize, shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (heapsize, err) = call.communicate()
-        #heapsize = heapsize.split("\n")
-        #heapsize = heapsize[0].split(":=")
-        #heapsize = heapsize[1].split(" ")
-        #heapsize = (float(heapsize[1])) / (1024 * 1024)
-
-        heapsize = heapsize.split()
-        heapsize = (float(heapsize[3])) / (1024 * 1024)
-
-        if self.py_version < (2,7):
-            cmd = "jstat -gc {0}".format(pid)
-            (inp, out, stderr) = os.popen3(cmd)
-            heapusage = out.read()
-            if stderr.read():
-                collectd.info("Error 3: %s" % stderr.read())
-                return
-        else:
-            call = subprocess.Popen("jstat -gc %s" % int(pid), shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-
-            (heapusage, err) = call.communicate()
-            if err:
-                collectd.debug("Error: Jstat does not give correct output ")
-                return
-
-        heapusage = heapusage.split("\n")
-        heapusage = str(heapusage[1]).split()
-
-        heapusageValue = 0
-        try:
-            collectd.debug("Calculating heapUsage by evaluating S0U.")
-            heapusageValue += float(heapusage[2])
-        except:
-            collectd.debug("Error calculating heapUsage by evaluating S0U.")
-
-        try:
-            collectd.debug("Calculating heapUsage by evaluating S1U.")
-            heapusageValue += float(heapusage[3])
-        except:
-            collectd.debug("Error calculating heapUsage by evaluating S1U.")
-
-        try:
-            collectd.debug("Calculating heapUsage by evaluating EU.")
-            heapusageValue += float(heapusage[5])
-        except:
-            collectd.debug("Error calculating heapUsage by evaluating EU.")
-
-        try:
-            collectd.debug("Calculating heapUsage by evaluating OU.")
-            heapusageValue += float(heapusage[7])
-        except:
-            collectd.debug("Error calculating heapUsage by evaluating OU.")
-
-        #try:
-        #    collectd.debug("Calculating heapUsage by evaluating MU.")
-        #    heapusageValue += float(heapusage[9])
-        #except:
-        #    collectd.debug("Error calculating heapUsage by evaluating MU.")
-
+        perf = self.hsperf.get(pid)
+        if perf is None:
+            collectd.info("jvm: hsperfdata of pid %s not found" % pid)
+            return
         try:
-            collectd.debug("Calculating heapUsage by evaluating CCSU.")
-            heapusageValue += float(heapusage[11])
-        except:
-            collectd.debug("Error calculating heapUsage by evaluating CCSU.")
+            gc_stats = perf.gc_stats()
+        except (HsPerfError, struct.error, ValueError) as err:
+            collectd.info("Error: %s" % err)
+            return
 
-        # heapusageValue = ((float(heapusage[2]) + float(heapusage[3]) + float(heapusage[
-        #     5]) + float(heapusage[7]) + float(heapusage[9]) + float(heapusage[11])) / 1024)
+        heapsize = (float(gc_stats["maxHeapSize"])) / (1024 * 1024)
+        heapusageValue = gc_stats["S0U"] + gc_stats["S1U"] + gc_stats["EU"] + gc_stats["OU"] + \
+            gc_stats["CCSU"]
 
         #Collect information about Garbage collection
-        try:
-            collectd.debug("Calculating GCT.")
-            gct = float(heapusage[16])
-        except:
-            collectd.debug("Error calculating GCT.")
-            gct = 0
-
-        try:
-            collectd.debug("Calculating YGC.")
-            ygc = float(heapusage[12])
-        except:
-            collectd.debug("Error calculating YGC.")
-            ygc = 0
-
-        try:
-            collectd.debug("Calculating FGC.")
-            fgc = int(heapusage[14])
-        except:
-            collectd.debug("Error calculating FGC.")
-            fgc = 0
-
-        # gct = float(heapusage[16])
-        # ygc = int(heapusage[12])
-        # fgc = int(heapusage[14])
+        gct = gc_stats["GCT"]
+        ygc = gc_stats["YGC"]
+        fgc = gc_stats["FGC"]
         tgc = ygc + fgc
 
         ram_usage = self.get_ramusage(pid)
@@ -297,8 +133,8 @@ class JVM(object):
             return
 
         jvm_res["numThreads"] = int(num_threads)
-        jvm_res["numLoadedClasses"] = int(classes[5])
-        jvm_res["numUnloadedClasses"] = int(classes[7])
+        jvm_res["numLoadedClasses"] = int(gc_stats["loadedClasses"])
+        jvm_res["numUnloadedClasses"] = int(gc_stats["unloadedClasses"])
         jvm_res["heapSize"] = float(heapsize)
         jvm_res["heapUsage"] = float(heapusageValue)/1024
         jvm_res["ramUsage"] = float(ram_usage)
@@ -308,12 +144,12 @@ class JVM(object):
         jvm_res["utime"] = float(utime)
         jvm_res["clockTick"] = int(clk_tick)
         jvm_res["gct"] = gct
-        jvm_res["survivor_0"] = float(heapusage[2])
-        jvm_res["survivor_1"] = float(heapusage[3])
-        jvm_res["eden"] = float(heapusage[5])
-        jvm_res["old"] = float(heapusage[7])
-        jvm_res["permanent"] = float(heapusage[9])
-        jvm_res["gc"] = int(heapusage[14])
+        jvm_res["survivor_0"] = float(gc_stats["S0U"])
+        jvm_res["survivor_1"] = float(gc_stats["S1U"])
+        jvm_res["eden"] = float(gc_stats["EU"])
+        jvm_res["old"] = float(gc_stats["OU"])
+        jvm_res["permanent"] = float(gc_stats["MU"])
+        jvm_res["gc"] = int(fgc)
       
         self.add_common_params(jvm_res, state, pid, process_name)
         self.dispatch_data(jvm_res)
@@ -340,11 +176,18 @@ class JVM(object):
     def get_jvmstate(self):
         """Get the state of jvm process"""
 	collectd.info("jvm: get the state of jvm")
+        process_pids = []
         for process_name in self.process.split(','):
             pids,pNames = self.get_pid(process_name)
             collectd.info( "pids +++ : %s" % pids)
             collectd.info( "pNames +++ : %s" % pNames)
-            self.remove_inactive_pids(pids)   
+            process_pids.append((pids, pNames))
+        # once for the pids of all process names, so that the data and the
+        # mapped hsperfdata of the other names are kept
+        all_pids = [pid for pids, _ in process_pids for pid in pids]
+        self.remove_inactive_pids(all_pids)
+        self.hsperf.retain(all_pids)
+        for pids, pNames in process_pids:
             if not pids:
                 collectd.info("No JAVA process are running")
                 return
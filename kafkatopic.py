@@ -12,20 +12,30 @@ import signal
 import json
 import time
 import collectd
-import Queue
-import multiprocessing
+import threading
 import kafka
 from copy import deepcopy
 import psutil
 import socket
-import subprocess
 from pyjolokia import Jolokia
 # user imports
 import utils
 from constants import *
 from libjolokia import JolokiaClient
+from libjmxplan import mbean_properties
+from libkafka import KafkaMetadata, KafkaProtocolClient, consumer_group_lag, is_internal_topic
+from libpidexecutor import PidExecutor
 
 KAFKA_DOCS = ["kafkaStats", "topicStats", "partitionStats", "consumerStats"]
+TOPIC_MBEAN_PATTERN = 'kafka.server:type=BrokerTopicMetrics,name=*,topic=*'
+PARTITION_MBEAN_PATTERN = 'kafka.log:type=Log,name=*,topic=*,partition=*'
+# BrokerTopicMetrics name -> topicStats key
+TOPIC_METRICS = {'MessagesInPerSec': 'messagesIn', 'BytesOutPerSec': 'bytesOut', 'BytesInPerSec': 'bytesIn',
+                 'TotalFetchRequestsPerSec': 'totalFetchRequests', 'TotalProduceRequestsPerSec': 'totalProduceRequests',
+                 'ProduceMessageConversionsPerSec': 'produceMessageConversions',
+                 'FailedProduceRequestsPerSec': 'failedProduceRequests',
+                 'FetchMessageConversionsPerSec': 'fetchMessageConversions',
+                 'FailedFetchRequestsPerSec': 'failedFetchRequests', 'BytesRejectedPerSec': 'bytesRejected'}
 BROKER_STATES = {0: "NotRunning", 1: "Starting", 2: "RecoveringFromUncleanShutdown", 3: "RunningAsBroker", \
                  6: "PendingControlledShutdown", 7: "BrokerShuttingDown"}
 
@@ -41,6 +51,12 @@ class JmxStat(object):
         self.prev_data = {}
         self.port = None
         self.documentsTypes = []
+        self.metadata = None
+        self.protocol_client = None
+        # guard the kafka clients shared by the workers collecting the pids
+        self.metadata_lock = threading.Lock()
+        self.consumer_lock = threading.Lock()
+        self.executor = PidExecutor(KAFKA_TOPIC)
         self.jclient = JolokiaClient(os.path.basename(__file__)[:-3], self.process)
 
     def config(self, cfg):
@@ -248,112 +264,76 @@ class JmxStat(object):
         else:
             dict_jmx['brokerState'] = "NotAvailable"
 
+    def get_metadata(self):
+        """Returns the topic and partition metadata cache of the broker."""
+        with self.metadata_lock:
+            if self.metadata is None:
+                self.metadata = KafkaMetadata(KAFKA_TOPIC, self.listenerip+':'+self.port)
+            return self.metadata
+
     def add_topic_parameters(self, jolokiaclient, dict_jmx, flag="topic"):
         """JMX stats specific to topic and partition"""
-        def get_partitions(topic):
-            client = kafka.KafkaClient(self.listenerip+':'+self.port)
-            topic_partition_ids = client.get_partition_ids_for_topic(topic)
-            return len(topic_partition_ids)
-
-        def get_topics():
-            consumer = kafka.KafkaConsumer(bootstrap_servers=self.listenerip+':'+self.port)
-            return consumer.topics()
-
-        parti_list = []
-        topics = get_topics()
-        for topic in topics:
-            partitions = get_partitions(topic)
-            if flag == "topic":
-                dict_topic = {}
-                msgIn = jolokiaclient.request(type='read', mbean='kafka.server:name=MessagesInPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                bytesOut = jolokiaclient.request(type='read', mbean='kafka.server:name=BytesOutPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                bytesIn = jolokiaclient.request(type='read', mbean='kafka.server:name=BytesInPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                totalFetch = jolokiaclient.request(type='read', mbean='kafka.server:name=TotalFetchRequestsPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                totalProduce = jolokiaclient.request(type='read', mbean='kafka.server:name=TotalProduceRequestsPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                produceMsg = jolokiaclient.request(type='read', mbean='kafka.server:name=ProduceMessageConversionsPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                failedProduce = jolokiaclient.request(type='read', mbean='kafka.server:name=FailedProduceRequestsPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                fetchMsg = jolokiaclient.request(type='read', mbean='kafka.server:name=FetchMessageConversionsPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                failedFetch = jolokiaclient.request(type='read', mbean='kafka.server:name=FailedFetchRequestsPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                bytesReject = jolokiaclient.request(type='read', mbean='kafka.server:name=BytesRejectedPerSec,topic=%s,type=BrokerTopicMetrics'%topic, attribute='Count')
-                if msgIn['status'] == 200:
-                    dict_topic['messagesIn'] = msgIn['value']
-                if bytesOut['status'] == 200:
-                    dict_topic['bytesOut'] = bytesOut['value']
-                if bytesIn['status'] == 200:
-                    dict_topic['bytesIn'] = bytesIn['value']
-                if totalFetch['status'] == 200:
-                    dict_topic['totalFetchRequests'] = totalFetch['value']
-                if totalProduce['status'] == 200:
-                    dict_topic['totalProduceRequests'] = totalProduce['value']
-                if produceMsg['status'] == 200:
-                    dict_topic['produceMessageConversions'] = produceMsg['value']
-                if failedProduce['status'] == 200:
-                    dict_topic['failedProduceRequests'] = failedProduce['value']
-                if fetchMsg['status'] == 200:
-                    dict_topic['fetchMessageConversions'] = fetchMsg['value']
-                if failedFetch['status'] == 200:
-                    dict_topic['failedFetchRequests'] = failedFetch['value']
-                if bytesReject['status'] == 200:
-                    dict_topic['bytesRejected'] = bytesReject['value']
-                if dict_topic:
-                    dict_topic['_topicName'] = topic
-                    dict_topic['partitionCount'] = partitions
-                    dict_jmx[topic] = {}
-                    dict_jmx[topic].update(dict_topic)
-            else:
-                for partition in range(0, partitions):
-                    dict_parti = {}
-                    numLogSegments = jolokiaclient.request(type='read', mbean='kafka.log:name=NumLogSegments,partition=%s,topic=%s,type=Log'%(partition, topic), attribute='Value')
-                    logSize = jolokiaclient.request(type='read', mbean='kafka.log:name=Size,partition=%s,topic=%s,type=Log'%(partition, topic), attribute='Value')
-                    if numLogSegments['status'] == 200:
-                        dict_parti['_topicName'] = topic
-                        dict_parti['_partitionNum'] = partition
-                        dict_parti['partitionLogSegments'] = numLogSegments['value']
-                        try:
-                            dict_parti['partitionLogSize'] = round(logSize['value'] / 1024.0/1024.0, 2)
-                        except:
-                            dict_parti['partitionLogSize'] = 0
-                    if dict_parti:
-                        parti_list.append(dict_parti)
-
-        if flag == "partition":
+        if flag == "topic":
+            # one pattern read returns the metrics of all topics
+            topic_json = jolokiaclient.request(type='read', mbean=TOPIC_MBEAN_PATTERN, attribute='Count')
+            if topic_json['status'] != 200:
+                return
+            topic_metrics = [(mbean_properties(mbean), value) for mbean, value in topic_json['value'].items()]
+            partitions = self.get_metadata().get_partitions(set(props.get('topic') for props, _ in topic_metrics
+                                                                if not is_internal_topic(props.get('topic'))))
+            for props, value in topic_metrics:
+                topic = props.get('topic')
+                key = TOPIC_METRICS.get(props.get('name'))
+                if key is None or topic not in partitions:
+                    continue
+                dict_jmx.setdefault(topic, {})[key] = value['Count']
+            for topic, dict_topic in dict_jmx.items():
+                dict_topic['_topicName'] = topic
+                dict_topic['partitionCount'] = len(partitions[topic])
+        else:
+            logs = {}
+            log_json = jolokiaclient.request(type='read', mbean=PARTITION_MBEAN_PATTERN, attribute='Value')
+            if log_json['status'] == 200:
+                for mbean, value in log_json['value'].items():
+                    props = mbean_properties(mbean)
+                    if props.get('name') not in ('NumLogSegments', 'Size'):
+                        continue
+                    partition = (props['topic'], int(props['partition']))
+                    logs.setdefault(partition, {})[props['name']] = value['Value']
+            partitions = self.get_metadata().get_partitions(set(topic for topic, _ in logs
+                                                                if not is_internal_topic(topic)))
+            parti_list = []
+            for (topic, partition), log in sorted(logs.items()):
+                if 'NumLogSegments' not in log or topic not in partitions:
+                    continue
+                dict_parti = {}
+                dict_parti['_topicName'] = topic
+                dict_parti['_partitionNum'] = partition
+                dict_parti['partitionLogSegments'] = log['NumLogSegments']
+                try:
+                    dict_parti['partitionLogSize'] = round(log['Size'] / 1024.0/1024.0, 2)
+                except (KeyError, TypeError):
+                    dict_parti['partitionLogSize'] = 0
+                parti_list.append(dict_parti)
             dict_jmx["partitionStats"] = parti_list
 
     def add_consumer_parameters(self, dict_jmx):
         """
-        Collect console consumer group stats
-        :param jolokiaclient:
+        Collect consumer group offsets and lag with the kafka protocol
         :param dict_jmx:
         :return:
         """
-        grp_list = []
-        with open(os.devnull, 'w') as devnull:
-            cmd = "sudo /opt/kafka/kafka_2.12-1.0.0/bin/kafka-consumer-groups.sh --list --bootstrap-server {0}:{1}".format(self.listenerip, self.port)
-            consumerGrp, err = utils.get_cmd_output(cmd, stdout_value=subprocess.PIPE, stderr_value=devnull)
-        if consumerGrp:
-            consumerGrp_list = consumerGrp.splitlines()
-            for consGrp in consumerGrp_list:
-                with open(os.devnull, 'w') as devnull:
-                    cmd = "sudo /opt/kafka/kafka_2.12-1.0.0/bin/kafka-consumer-groups.sh --describe --group {0} --bootstrap-server {0}:{1}".format(consGrp, self.listenerip, self.port)
-                    grp_detail, err = utils.get_cmd_output(cmd, stdout_value=subprocess.PIPE, stderr_value=devnull)
-                    dict_grp = {}
-                    if grp_detail:
-                        grp_detail_list = grp_detail.splitlines()
-                        for group in grp_detail_list[2:]:
-                            cons_details = group.split()
-                            if cons_details[6] == '-':
-                                #consumer without client id is considered as inactive consumer
-                                continue
-                            dict_grp["_groupName"] = consGrp
-                            dict_grp["_topicName"] = cons_details[0]
-                            dict_grp["partition"] = int(cons_details[1])
-                            dict_grp["currentOffset"] = long(cons_details[2])
-                            dict_grp["logEndOffset"] = long(cons_details[3])
-                            dict_grp["lag"] = long(cons_details[4])
-                            dict_grp["custId"] = cons_details[5]
-                            dict_grp["clientId"] = cons_details[6]
-                            grp_list.append(dict_grp.copy())
-            dict_jmx["consumerStats"] = grp_list
+        with self.consumer_lock:
+            if self.protocol_client is None:
+                self.protocol_client = KafkaProtocolClient(self.listenerip+':'+self.port)
+            try:
+                grp_list = consumer_group_lag(self.protocol_client)
+            except Exception:
+                # connect again on the next poll
+                self.protocol_client.close()
+                self.protocol_client = None
+                raise
+        dict_jmx["consumerStats"] = grp_list
 
     def add_common_params(self, doc, dict_jmx):
         """Adds TIMESTAMP, PLUGIN, PLUGITYPE to dictionary."""
@@ -419,23 +399,19 @@ class JmxStat(object):
             except Exception as err:
                 collectd.error("Plugin kafkatopic: Error in collecting stats of %s doctype: %s" % (doc, str(err)))
 
+    def collect_pid(self, pid):
+        """Returns list of the documents of a pid, empty if its jolokia agent is not available."""
+        output = []
+        port = self.jclient.get_jolokia_port(pid)
+        if port and self.jclient.connection_available(port):
+            self.get_pid_jmx_stats(pid, port, output)
+        return output
+
     def run_pid_process(self, list_pid):
-        """Spawn process for each pid"""
-        #procs = []
-        #output = multiprocessing.Queue()
+        """Collect pids concurrently, pids late for the deadline are dropped"""
         output = []
-        for pid in list_pid:
-            port = self.jclient.get_jolokia_port(pid)
-            if port and self.jclient.connection_available(port):
-                self.get_pid_jmx_stats(pid, port, output)
-                #proc = multiprocessing.Process(target=self.get_pid_jmx_stats, args=(pid, port, output))
-                #procs.append(proc)
-                #proc.start()
-
-        #for proc in procs:
-            #proc.join()
-#       for p in procs:
-#          collectd.debug("%s, %s" % (p, p.is_alive()))
+        for _, pid_output in self.executor.run(self.collect_pid, list_pid, float(self.interval)):
+            output.extend(pid_output)
         return output
 
     def collect_jmx_data(self):
@@ -455,26 +431,8 @@ class JmxStat(object):
                         self.add_rate_dispatch_kafka(pid, doc_name, doc_result)
                     else:
                         self.dispatch_stats(doc_name, doc_result)
-        
-        '''
-        procs, output = self.run_pid_process(list_pid)
-        for _ in procs:
-            for _ in KAFKA_DOCS:
-                try:
-                    pid, doc_name, doc_result = output.get_nowait()
-                except Queue.Empty:
-                    collectd.error("Failed to send one or more doctype document to collectd")
-                    continue
-                # Dispatching documentsTypes which are requetsed alone
-                if doc_name in self.documentsTypes:
-                    if doc_name == "topicStats":
-                        self.add_rate_dispatch_topic(pid, doc_name, doc_result)
-                    elif doc_name == "kafkaStats":
-                        self.add_rate_dispatch_kafka(pid, doc_name, doc_result)
-                    else:
-                        self.dispatch_stats(doc_name, doc_result)
-        output.close()
-        '''
+        for stats in self.executor.get_stats():
+            utils.dispatch(stats)
 
     def dispatch_data(self, doc_name, result):
         """Dispatch data to collectd."""
@@ -522,3 +480,4 @@ OBJ = JmxStat()
 collectd.register_init(init)
 collectd.register_config(OBJ.config)
 collectd.register_read(OBJ.read_temp)
+collectd.register_shutdown(OBJ.executor.shutdown)
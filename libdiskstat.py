@@ -8,53 +8,205 @@
 python script to return disk I/O statistics as a dict of raw tuples
 """
 
-import re
+import os
+import time
 from collections import namedtuple
 import collectd
-import utils
 from constants import *
 
 IoTuple = namedtuple(
-    'io', 'read_count write_count read_bytes write_bytes read_mb write_mb read_time write_time')
+    'io', 'read_count write_count read_bytes write_bytes read_mb write_mb read_time write_time '
+          'busy_time weighted_time')
+IoDeltaTuple = namedtuple('io_delta', 'avg_queue_size utilization await_time')
 
 
-def get_part_to_disk():
-    """Function to get disk and partitions from lsblk command."""
-    dict_disk_part = {}
-    (lsblk, err) = utils.get_cmd_output('lsblk -bno  KNAME,TYPE | grep \'disk\|part\'')
-    if err:
-        collectd.error(
-            'Plugin disk_stat in libdiskstat: error in lsblk command')
-        return FAILURE
-    disk_info = re.split('\n', lsblk)
-    index = 0
-    num_lines = len(disk_info)
-    dname = None
-    while index < num_lines:
-        line = disk_info[index]
-        if line:
-            parts = re.split(r'\s+', line.strip())
-            if parts[1] == 'disk':
-                dname = parts[0]
-            dict_disk_part[parts[0]] = dname
-            index += 1
+SYS_CLASS_BLOCK = "/sys/class/block"
+SYS_BLOCK = "/sys/block"
+# sizes in /sys/class/block/<name>/size are always in 512 bytes sectors
+SYSFS_SECTOR_SIZE = 512
+# block device majors of ram, loop, md and scsi cdrom devices
+NON_DISK_MAJORS = (1, 7, 9, 11)
+BlockDevice = namedtuple('block_device', 'name type disk size sector_size')
+
+
+def read_sysfs(path, default=None):
+    try:
+        with open(path) as sysfs_file:
+            return sysfs_file.read().strip()
+    except IOError:
+        return default
+
+
+class BlockTopology(object):
+    """Disks and partitions read from /sys/block, equivalent to the disk and
+    part lines of lsblk. The topology is rebuilt only when the listing of
+    /sys/class/block changes, the sizes are read again on every check since
+    disks and partitions can be resized online."""
+
+    def __init__(self):
+        self.listing = None
+        self.devices = {}
+
+    @staticmethod
+    def is_disk(name):
+        """lsblk reports loop, ram, md, dm and rom devices with their own type."""
+        disk_path = os.path.join(SYS_BLOCK, name)
+        if os.path.exists(os.path.join(disk_path, "dm")):
+            return False
+        dev = read_sysfs(os.path.join(disk_path, "dev"), "0:0")
+        return int(dev.split(":")[0]) not in NON_DISK_MAJORS
+
+    def build(self):
+        devices = {}
+        for disk in sorted(os.listdir(SYS_BLOCK)):
+            if not self.is_disk(disk):
+                continue
+            disk_path = os.path.join(SYS_BLOCK, disk)
+            sector_size = int(read_sysfs(os.path.join(disk_path, "queue", "hw_sector_size"), 512))
+            size = int(read_sysfs(os.path.join(disk_path, "size"), 0)) * SYSFS_SECTOR_SIZE
+            devices[disk] = BlockDevice(disk, DISK, disk, size, sector_size)
+            for part in sorted(os.listdir(disk_path)):
+                part_path = os.path.join(disk_path, part)
+                if os.path.exists(os.path.join(part_path, "partition")):
+                    size = int(read_sysfs(os.path.join(part_path, "size"), 0)) * SYSFS_SECTOR_SIZE
+                    devices[part] = BlockDevice(part, "part", disk, size, sector_size)
+        return devices
+
+    def refresh_sizes(self):
+        for name, device in self.devices.items():
+            size = read_sysfs(os.path.join(SYS_CLASS_BLOCK, name, "size"))
+            if size is not None and int(size) * SYSFS_SECTOR_SIZE != device.size:
+                self.devices[name] = device._replace(size=int(size) * SYSFS_SECTOR_SIZE)
+
+    def get_devices(self):
+        """Returns dictionary of name -> BlockDevice of all disks and partitions."""
+        listing = os.listdir(SYS_CLASS_BLOCK)
+        listing.sort()
+        if listing != self.listing:
+            self.devices = self.build()
+            self.listing = listing
         else:
-            break
+            self.refresh_sizes()
+        return self.devices
+
 
-    if not dict_disk_part:
+TOPOLOGY = BlockTopology()
+
+
+def get_block_devices():
+    """Returns dictionary of name -> BlockDevice, FAILURE if sysfs can not be read."""
+    try:
+        devices = TOPOLOGY.get_devices()
+    except (OSError, ValueError) as err:
+        collectd.error('Plugin disk_stat in libdiskstat: error in reading %s: %s' % (SYS_BLOCK, err))
         return FAILURE
+    if not devices:
+        return FAILURE
+    return devices
+
 
-    return dict_disk_part
+def get_part_to_disk():
+    """Function to get disk and partitions from the cached block topology."""
+    devices = get_block_devices()
+    if devices == FAILURE:
+        return FAILURE
+    return dict((name, device.disk) for name, device in devices.items())
 
 
 def get_sector_size(disk):
     """Function to get sector size of disk."""
-    try:
-        with open(b"/sys/block/%s/queue/hw_sector_size" % disk) as size_file:
-            return int(size_file.read())
-    except (IOError, ValueError):
+    devices = get_block_devices()
+    if devices == FAILURE or disk not in devices:
         # default
         return 512
+    return devices[disk].sector_size
+
+
+def get_mounts():
+    """Returns list of (device, mountpoint) of the local block device
+    filesystems in /proc/self/mounts, i.e. what df -l lists under /dev/."""
+    mounts = []
+    try:
+        with open("/proc/self/mounts") as mounts_file:
+            for line in mounts_file:
+                fields = line.split()
+                if len(fields) > 1 and fields[0].startswith("/dev/"):
+                    # mount points escape spaces as octal
+                    mounts.append((fields[0], fields[1].replace("\\040", " ")))
+    except IOError:
+        collectd.error("libdiskstat library: Could not read file '/proc/self/mounts'")
+    return mounts
+
+
+def get_swaps():
+    """Returns set of names of the block devices used as swap."""
+    swaps = set()
+    try:
+        with open("/proc/swaps") as swaps_file:
+            swaps_file.readline()
+            for line in swaps_file:
+                fields = line.split()
+                if fields and fields[0].startswith("/dev/"):
+                    swaps.add(os.path.basename(os.path.realpath(fields[0])))
+    except IOError:
+        pass
+    return swaps
+
+
+def get_mountpoints():
+    """Returns dictionary of block device name -> mountpoint, SWAP for swap devices."""
+    mountpoints = {}
+    for device, mountpoint in get_mounts():
+        name = os.path.basename(os.path.realpath(device))
+        mountpoints.setdefault(name, mountpoint)
+    for name in get_swaps():
+        mountpoints[name] = "[%s]" % SWAP
+    return mountpoints
+
+
+def get_disk_info():
+    """Returns list of (name, type, size in bytes, mountpoint) of disks and
+    partitions like lsblk -bno KNAME,TYPE,SIZE,MOUNTPOINT, FAILURE if sysfs
+    can not be read. mountpoint is None for devices which are not mounted."""
+    devices = get_block_devices()
+    if devices == FAILURE:
+        return FAILURE
+    mountpoints = get_mountpoints()
+    return [(name, device.type, device.size, mountpoints.get(name))
+            for name, device in sorted(devices.items())]
+
+
+def get_used_kb(mountpoint):
+    """Returns used space of a mounted filesystem in KB, like df."""
+    try:
+        st = os.statvfs(mountpoint)
+    except OSError:
+        return None
+    return (st.f_blocks - st.f_bfree) * st.f_frsize / FACTOR
+
+
+def get_total_usage_kb():
+    """Returns used space in KB of all local block device filesystems,
+    each device counted once."""
+    usage_sum = 0
+    seen = set()
+    for device, mountpoint in get_mounts():
+        if device in seen:
+            continue
+        used = get_used_kb(mountpoint)
+        if used is not None:
+            seen.add(device)
+            usage_sum += used
+    return usage_sum
+
+
+def get_total_capacity():
+    """Returns sum of the sizes in bytes of all disks, floppies excluded."""
+    devices = get_block_devices()
+    if devices == FAILURE:
+        return FAILURE
+    return sum(device.size for device in devices.values()
+               if device.type == DISK and not device.name.startswith("fd"))
 
 
 def disk_io_counters():
@@ -62,8 +214,9 @@ def disk_io_counters():
     system as a dict of raw tuples.
     """
     retdict = {}
-    disk_part = get_part_to_disk()
-    if disk_part == FAILURE:
+    # read once per poll, partitions carry the sector size of their disk
+    devices = get_block_devices()
+    if devices == FAILURE:
         return FAILURE
 
     try:
@@ -82,26 +235,62 @@ def disk_io_counters():
             name = fields[3]
             reads = int(fields[2])
             (reads_merged, rsector, rtime, writes, writes_merged,
-             wsector, wtime, _, busy_time, _) = map(int, fields[4:14])
-        elif fields_len == 14:
-            # Linux 2.6+, line referring to a disk
+             wsector, wtime, _, busy_time, weighted_time) = map(int, fields[4:14])
+        elif fields_len in (14, 18, 20):
+            # Linux 2.6+, line referring to a disk; 4.18+ adds 4 discard
+            # fields and 5.5+ 2 flush fields after the weighted time
             name = fields[2]
             (reads, reads_merged, rsector, rtime, writes, writes_merged,
-             wsector, wtime, _, busy_time, _) = map(int, fields[3:14])
+             wsector, wtime, _, busy_time, weighted_time) = map(int, fields[3:14])
         elif fields_len == 7:
             # Linux 2.6+, line referring to a partition
             name = fields[2]
             reads, rsector, writes, wsector = map(int, fields[3:])
-            rtime = wtime = reads_merged = writes_merged = busy_time = 0
+            rtime = wtime = reads_merged = writes_merged = busy_time = weighted_time = 0
         else:
             raise ValueError(
                 "libdiskstat library: not sure how to interpret line %r in /proc/diskstats" % line)
 
-        if name in disk_part:
-            sector_size = get_sector_size(disk_part[name])
+        if name in devices:
+            sector_size = devices[name].sector_size
             rbytes = rsector * sector_size
             wbytes = wsector * sector_size
             rmb = rbytes * float(0.000001)
             wmb = wbytes * float(0.000001)
-            retdict[name] = IoTuple(reads, writes, rbytes, wbytes, rmb, wmb, rtime, wtime)
+            retdict[name] = IoTuple(reads, writes, rbytes, wbytes, rmb, wmb, rtime, wtime,
+                                    busy_time, weighted_time)
     return retdict
+
+
+class DiskIoSampler(object):
+    """Keeps the disk counters of the previous poll to compute, per disk and
+    per interval, the average queue size, utilization (%) and await (ms)
+    like iostat -x does from /proc/diskstats."""
+
+    def __init__(self):
+        self.prev_counters = None
+        self.prev_time = None
+
+    def poll(self, counters):
+        """Returns dictionary of IoDeltaTuple per disk for the counters of
+        disk_io_counters(), values are 0 on the first poll."""
+        now = time.time()
+        retdict = {}
+        prev_counters = self.prev_counters
+        interval_ms = (now - self.prev_time) * 1000 if self.prev_time else 0
+        for name, io in counters.items():
+            prev = prev_counters.get(name) if prev_counters else None
+            if prev is None or interval_ms <= 0:
+                retdict[name] = IoDeltaTuple(0.0, 0.0, 0.0)
+                continue
+            ios = (io.read_count - prev.read_count) + (io.write_count - prev.write_count)
+            io_time = (io.read_time - prev.read_time) + (io.write_time - prev.write_time)
+            avg_queue_size = max(io.weighted_time - prev.weighted_time, 0) / interval_ms
+            utilization = min(max(io.busy_time - prev.busy_time, 0) * 100.0 / interval_ms, 100.0)
+            await_time = float(io_time) / ios if ios > 0 else 0.0
+            retdict[name] = IoDeltaTuple(round(avg_queue_size, FLOATING_FACTOR),
+                                         round(utilization, FLOATING_FACTOR),
+                                         round(await_time, FLOATING_FACTOR))
+        self.prev_counters = counters
+        self.prev_time = now
+        return retdict
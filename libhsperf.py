@@ -0,0 +1,180 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to read the hsperfdata file a HotSpot JVM exports its
+performance counters in (/tmp/hsperfdata_<user>/<pid>), the file jstat reads.
+
+Layout of the file:
+    prologue : magic, byte order, version, accessible, used, overflow,
+               modification time, entry offset, number of entries
+    entries  : entry length, name offset, vector length, data type, flags,
+               units, variability, data offset, followed by the name and data
+"""
+
+import os
+import glob
+import mmap
+import struct
+
+HSPERFDATA_PATTERN = "/tmp/hsperfdata_*/%s"
+PERFDATA_MAGIC = b"\xca\xfe\xc0\xc0"
+PROLOGUE_FORMAT = "4sBBBBiiqii"
+ENTRY_FORMAT = "iiiBBBBi"
+BIG_ENDIAN = 0
+TYPE_LONG = ord("J")
+TYPE_BYTE = ord("B")
+
+
+class HsPerfError(Exception):
+    """Raised when a hsperfdata file can not be used."""
+    pass
+
+
+def hsperfdata_path(pid):
+    """Returns path of the hsperfdata file of a pid, None if not found."""
+    paths = glob.glob(HSPERFDATA_PATTERN % pid)
+    return paths[0] if paths else None
+
+
+class HsPerfData(object):
+    """A hsperfdata file mapped read-only. The entry index is built once and
+    rebuilt only when the JVM adds entries, values are read from the mapping
+    on every call."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self.inode = os.fstat(fh.fileno()).st_ino
+        if self.mm[:4] != PERFDATA_MAGIC:
+            self.mm.close()
+            raise HsPerfError("%s is not a hsperfdata file" % filename)
+        self.order = ">" if ord(self.mm[4:5]) == BIG_ENDIAN else "<"
+        self.entries = {}
+        self.num_entries = 0
+
+    def close(self):
+        self.mm.close()
+
+    def refresh_index(self):
+        (_, _, _, _, accessible, _, _, _, entry_offset,
+         num_entries) = struct.unpack_from(self.order + PROLOGUE_FORMAT, self.mm, 0)
+        if not accessible:
+            raise HsPerfError("%s is not accessible yet" % self.filename)
+        if num_entries == self.num_entries:
+            return
+        entries = {}
+        offset = entry_offset
+        for _ in range(num_entries):
+            (entry_length, name_offset, vector_length, data_type, _, _, _,
+             data_offset) = struct.unpack_from(self.order + ENTRY_FORMAT, self.mm, offset)
+            if entry_length <= 0:
+                break
+            name_start = offset + name_offset
+            name = self.mm[name_start:self.mm.find(b"\0", name_start)].decode("ascii")
+            entries[name] = (data_type, vector_length, offset + data_offset)
+            offset += entry_length
+        self.entries = entries
+        self.num_entries = num_entries
+
+    def get(self, name, default=None):
+        """Returns the value of a counter, default if the JVM does not export it."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return default
+        data_type, vector_length, offset = entry
+        if data_type == TYPE_LONG and vector_length == 0:
+            return struct.unpack_from(self.order + "q", self.mm, offset)[0]
+        if data_type == TYPE_BYTE and vector_length > 0:
+            data = self.mm[offset:offset + vector_length]
+            return data.split(b"\0", 1)[0].decode("utf-8", "replace")
+        return default
+
+    def counters(self):
+        """Returns dictionary of all counters."""
+        self.refresh_index()
+        return dict((name, self.get(name)) for name in self.entries)
+
+    def gc_stats(self):
+        """Returns the values of jstat -class and jstat -gc, capacities and
+        usage in KB, times in seconds, and the maximum heap size in bytes."""
+        self.refresh_index()
+        get = self.get
+        frequency = float(get("sun.os.hrt.frequency", 0)) or 1e9
+
+        def kb(name):
+            return get(name, 0) / 1024.0
+
+        young_time = get("sun.gc.collector.0.time", 0) / frequency
+        full_time = get("sun.gc.collector.1.time", 0) / frequency
+        stats = {
+            "loadedClasses": get("java.cls.loadedClasses", 0) + get("java.cls.sharedLoadedClasses", 0),
+            "unloadedClasses": get("java.cls.unloadedClasses", 0) +
+                               get("java.cls.sharedUnloadedClasses", 0),
+            "S0C": kb("sun.gc.generation.0.space.1.capacity"),
+            "S1C": kb("sun.gc.generation.0.space.2.capacity"),
+            "S0U": kb("sun.gc.generation.0.space.1.used"),
+            "S1U": kb("sun.gc.generation.0.space.2.used"),
+            "EC": kb("sun.gc.generation.0.space.0.capacity"),
+            "EU": kb("sun.gc.generation.0.space.0.used"),
+            "OC": kb("sun.gc.generation.1.space.0.capacity"),
+            "OU": kb("sun.gc.generation.1.space.0.used"),
+            "CCSC": kb("sun.gc.compressedclassspace.capacity"),
+            "CCSU": kb("sun.gc.compressedclassspace.used"),
+            "YGC": get("sun.gc.collector.0.invocations", 0),
+            "YGCT": young_time,
+            "FGC": get("sun.gc.collector.1.invocations", 0),
+            "FGCT": full_time,
+            "GCT": young_time + full_time,
+            "maxHeapSize": get("sun.gc.generation.0.maxCapacity", 0) +
+                           get("sun.gc.generation.1.maxCapacity", 0)
+        }
+        if "sun.gc.metaspace.used" in self.entries:
+            stats["MC"] = kb("sun.gc.metaspace.capacity")
+            stats["MU"] = kb("sun.gc.metaspace.used")
+        else:
+            # permanent generation before java 8
+            stats["MC"] = kb("sun.gc.generation.2.space.0.capacity")
+            stats["MU"] = kb("sun.gc.generation.2.space.0.used")
+        return stats
+
+
+class HsPerfCache(object):
+    """Keeps the hsperfdata file of every pid mapped between polls."""
+
+    def __init__(self):
+        self.files = {}
+
+    def get(self, pid):
+        """Returns HsPerfData of a pid, None if the JVM does not export one."""
+        pid = str(pid)
+        perf = self.files.get(pid)
+        if perf is not None:
+            try:
+                # the file is recreated when the pid is reused by another JVM
+                if os.stat(perf.filename).st_ino == perf.inode:
+                    return perf
+            except OSError:
+                pass
+            perf.close()
+            del self.files[pid]
+        filename = hsperfdata_path(pid)
+        if filename is None:
+            return None
+        try:
+            perf = HsPerfData(filename)
+        except (IOError, OSError, ValueError, mmap.error, HsPerfError):
+            return None
+        self.files[pid] = perf
+        return perf
+
+    def retain(self, pids):
+        """Unmaps the files of the pids not in pids."""
+        pids = set(str(pid) for pid in pids)
+        for pid in list(self.files):
+            if pid not in pids:
+                self.files.pop(pid).close()
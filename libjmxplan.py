@@ -0,0 +1,428 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+Read plans of the generic JVM documents of the jolokia based plugins. All
+MBean reads of a document are compiled into a single bulk request and the
+results are mapped back to the fields of the document. GC, memory pool and
+buffer pool names are discovered once per JVM and cached. The reads are
+shared by all plugins in the collectd process: the documents every plugin
+subscribed to for a JVM are read together once per poll, so the load on a
+JVM does not grow with the number of plugins watching it.
+"""
+
+import time
+import threading
+import collectd
+
+JVM_DOCS = ["jmxStats", "memoryPoolStats", "memoryStats", "threadStats", "gcStats",
+            "classLoadingStats", "compilationStats", "nioStats", "operatingSysStats"]
+# memory pools whose usage before and after the last GC is reported in gcStats
+GC_MEMORY_POOLS = ['G1 Eden Space', 'G1 Old Gen']
+MB = 1024.0 * 1024.0
+# documents whose plans depend on the GC, memory pool and buffer pool names of a JVM
+NAMED_DOCS = ["memoryPoolStats", "gcStats", "nioStats"]
+# error of a read whose MBean is not registered, a GC, memory pool or buffer
+# pool of a named doc went away
+INSTANCE_NOT_FOUND = "javax.management.InstanceNotFoundException"
+# seconds the results of a JVM are reused, plugins polling the same JVM in the
+# same interval share them
+RESULT_AGE = 5
+
+
+class ReadPlan(object):
+    """MBean reads compiled into one bulk request of pyjolokia."""
+
+    def __init__(self):
+        self.reads = []
+        # keys of the reads of the last execute whose MBean was not found
+        self.not_found = []
+
+    def add(self, key, mbean, attribute=None):
+        request = {'mbean': mbean}
+        if attribute:
+            request['attribute'] = attribute
+        self.reads.append((key, request))
+
+    def execute(self, jolokiaclient):
+        """Returns dictionary of key -> value of the reads which succeeded."""
+        self.not_found = []
+        if not self.reads:
+            return {}
+        for _, request in self.reads:
+            jolokiaclient.add_request(type='read', **request)
+        bulkdata = jolokiaclient.getRequests()
+        results = {}
+        for (key, _), response in zip(self.reads, bulkdata):
+            if response.get('status') == 200:
+                results[key] = response['value']
+            elif response.get('error_type') == INSTANCE_NOT_FOUND:
+                self.not_found.append(key)
+        return results
+
+
+def pattern_values(value):
+    """Returns attribute dictionaries of the MBeans matched by a wildcard read."""
+    if not value:
+        return []
+    return [attributes for attributes in value.values() if isinstance(attributes, dict)]
+
+
+def mbean_properties(name):
+    """Returns dictionary of the key properties of an MBean name."""
+    _, _, properties = name.partition(':')
+    return dict(prop.split('=', 1) for prop in properties.split(',') if '=' in prop)
+
+
+def no_spaces(name):
+    return ''.join(name.split())
+
+
+def to_mb(value):
+    return round(value / MB, 2)
+
+
+def neg_bytes(value):
+    """Byte values may be -1 if not supported."""
+    if value == -1:
+        return value
+    return to_mb(value)
+
+
+def add_usage(dict_jmx, prefix, usage, keys=('init', 'max', 'used', 'committed')):
+    for key in keys:
+        field = prefix + key.capitalize()
+        if key in ('init', 'max'):
+            dict_jmx[field] = neg_bytes(usage[key])
+        else:
+            dict_jmx[field] = to_mb(usage[key])
+
+
+class JvmDocCollector(object):
+    """Reads the generic JVM documents of every pid with one bulk request per
+    poll and shares the results with all plugins subscribed to the pid."""
+
+    def __init__(self, result_age=RESULT_AGE):
+        self.result_age = result_age
+        # guards the dictionaries below, never held during a request to a JVM
+        self.lock = threading.Lock()
+        # pid -> lock serializing the reads of a JVM
+        self.pid_locks = {}
+        # pid -> number of fetches in progress, their lock and results are kept
+        self.fetching = {}
+        # plugin name -> pid -> set of docs
+        self.subscriptions = {}
+        # pid -> discovered names
+        self.names = {}
+        # (doc, pid) -> ReadPlan
+        self.plans = {}
+        # pid -> doc -> (read time, results)
+        self.results = {}
+
+    def discover(self, jolokiaclient):
+        """Returns GC, memory pool and buffer pool names of a JVM, read with
+        one bulk request of wildcard reads."""
+        plan = ReadPlan()
+        plan.add('gc', 'java.lang:type=GarbageCollector,*', 'Name')
+        plan.add('pool', 'java.lang:type=MemoryPool,*',
+                 ['Name', 'UsageThresholdSupported', 'CollectionUsageThresholdSupported'])
+        plan.add('buffer', 'java.nio:type=BufferPool,*', 'Name')
+        results = plan.execute(jolokiaclient)
+        gc_names = [value['Name'] for value in pattern_values(results.get('gc'))]
+        pools = [(value['Name'], bool(value.get('UsageThresholdSupported')),
+                  bool(value.get('CollectionUsageThresholdSupported')))
+                 for value in pattern_values(results.get('pool'))]
+        buffers = [value['Name'] for value in pattern_values(results.get('buffer'))]
+        return {'gc': sorted(gc_names), 'pool': sorted(pools), 'buffer': sorted(buffers)}
+
+    def prepare(self, jolokiaclient, pid):
+        """Returns the names of a JVM, discovered if they are not cached."""
+        with self.lock:
+            names = self.names.get(pid)
+        if names is None:
+            names = self.discover(jolokiaclient)
+            with self.lock:
+                self.names[pid] = names
+        return names
+
+    def forget(self, pid):
+        """Drops cached names and plans of a pid, they are rediscovered on the
+        next poll. The caller holds self.lock."""
+        self.names.pop(pid, None)
+        for key in [key for key in self.plans if key[1] == pid]:
+            del self.plans[key]
+
+    def subscribe(self, plugin_name, pids, docs):
+        """Sets the pids a plugin collects docs of, the cache of the pids no
+        plugin is subscribed to any more is dropped."""
+        with self.lock:
+            self.subscriptions[plugin_name] = dict((str(pid), set(docs)) for pid in pids)
+            subscribed = set()
+            for plugin_pids in self.subscriptions.values():
+                subscribed.update(plugin_pids)
+            # a pid being fetched keeps its lock and results until the next call
+            for pid in [pid for pid in self.pid_locks if pid not in subscribed and pid not in self.fetching]:
+                del self.pid_locks[pid]
+                self.results.pop(pid, None)
+                self.forget(pid)
+
+    def compile(self, doc, names):
+        plan = ReadPlan()
+        if doc == "jmxStats":
+            plan.add('classloading', 'java.lang:type=ClassLoading', ['UnloadedClassCount', 'LoadedClassCount'])
+            plan.add('threading', 'java.lang:type=Threading', 'ThreadCount')
+            plan.add('memory', 'java.lang:type=Memory', ['HeapMemoryUsage', 'NonHeapMemoryUsage'])
+            plan.add('gc', 'java.lang:type=GarbageCollector,*', ['Name', 'Valid', 'CollectionTime', 'CollectionCount'])
+            plan.add('pool', 'java.lang:type=MemoryPool,*', ['Name', 'Valid', 'Usage'])
+        elif doc == "memoryPoolStats":
+            for pool_name, usage_threshold, collection_threshold in names['pool']:
+                attributes = ['Valid', 'CollectionUsage', 'PeakUsage', 'Usage']
+                if collection_threshold:
+                    attributes.extend(['CollectionUsageThreshold', 'CollectionUsageThresholdCount',
+                                       'CollectionUsageThresholdExceeded'])
+                if usage_threshold:
+                    attributes.extend(['UsageThreshold', 'UsageThresholdCount', 'UsageThresholdExceeded'])
+                plan.add(pool_name, 'java.lang:type=MemoryPool,name=' + pool_name, attributes)
+        elif doc == "memoryStats":
+            plan.add('memory', 'java.lang:type=Memory')
+        elif doc == "threadStats":
+            plan.add('threading', 'java.lang:type=Threading')
+        elif doc == "gcStats":
+            for gc_name in names['gc']:
+                plan.add(gc_name, 'java.lang:type=GarbageCollector,name=' + gc_name,
+                         ['Valid', 'CollectionTime', 'CollectionCount', 'LastGcInfo'])
+        elif doc == "classLoadingStats":
+            plan.add('classloading', 'java.lang:type=ClassLoading')
+        elif doc == "compilationStats":
+            plan.add('compilation', 'java.lang:type=Compilation')
+        elif doc == "nioStats":
+            for buffer_name in names['buffer']:
+                plan.add(buffer_name, 'java.nio:type=BufferPool,name=' + buffer_name)
+        elif doc == "operatingSysStats":
+            plan.add('os', 'java.lang:type=OperatingSystem')
+        return plan
+
+    def read(self, jolokiaclient, pid, docs):
+        """Runs the read plans of docs for a JVM as one bulk request and caches
+        the results of every doc."""
+        with self.lock:
+            doc_plans = dict((doc, self.plans.get((doc, pid))) for doc in docs)
+        plan = ReadPlan()
+        for doc in docs:
+            doc_plan = doc_plans[doc]
+            if doc_plan is None:
+                names = self.prepare(jolokiaclient, pid) if doc in NAMED_DOCS else None
+                doc_plan = self.compile(doc, names)
+                with self.lock:
+                    self.plans[(doc, pid)] = doc_plan
+            plan.reads.extend(((doc, key), request) for key, request in doc_plan.reads)
+        results = plan.execute(jolokiaclient)
+        doc_results = dict((doc, {}) for doc in docs)
+        for (doc, key), value in results.items():
+            doc_results[doc][key] = value
+        now = time.time()
+        with self.lock:
+            if any(doc in NAMED_DOCS for doc, _ in plan.not_found):
+                # a GC, memory pool or buffer pool went away, other failed reads
+                # do not depend on the discovered names and are retried as they are
+                self.forget(pid)
+            cache = self.results.setdefault(pid, {})
+            for doc in docs:
+                cache[doc] = (now, doc_results[doc])
+
+    def fetch(self, jolokiaclient, pid, docs):
+        """Returns dictionary of doc -> results of docs for a JVM. When one of
+        them is older than result_age, all stale docs subscribed to the pid by
+        any plugin are read again in one bulk request."""
+        pid = str(pid)
+        with self.lock:
+            pid_lock = self.pid_locks.setdefault(pid, threading.Lock())
+            self.fetching[pid] = self.fetching.get(pid, 0) + 1
+            wanted = set(docs)
+            for plugin_pids in self.subscriptions.values():
+                wanted.update(plugin_pids.get(pid, ()))
+        try:
+            with pid_lock:
+                with self.lock:
+                    cache = dict(self.results.get(pid, {}))
+                now = time.time()
+                stale = sorted(doc for doc in wanted
+                               if doc not in cache or now - cache[doc][0] >= self.result_age)
+                if any(doc in stale for doc in docs):
+                    self.read(jolokiaclient, pid, stale)
+                    with self.lock:
+                        cache = dict(self.results[pid])
+                return dict((doc, cache[doc][1]) for doc in docs)
+        finally:
+            with self.lock:
+                self.fetching[pid] -= 1
+                if not self.fetching[pid]:
+                    del self.fetching[pid]
+
+
+COLLECTOR = JvmDocCollector()
+
+
+class JvmDocs(object):
+    """The generic JVM documents of a plugin, read through the shared collector
+    and mapped to the fields of the documents."""
+
+    def __init__(self, plugin_name, docs, gc_names, pool_names, collector=COLLECTOR):
+        self.plugin_name = plugin_name
+        self.docs = docs
+        self.supported_gc = gc_names
+        self.supported_pools = pool_names
+        self.collector = collector
+        # GC and memory pool names already logged as not supported
+        self.reported = set()
+
+    def is_supported(self, kind, name):
+        supported = self.supported_gc if kind == "GC" else self.supported_pools
+        if name in supported:
+            return True
+        if (kind, name) not in self.reported:
+            self.reported.add((kind, name))
+            collectd.error("Plugin %s: not supported for %s %s" % (self.plugin_name, kind, name))
+        return False
+
+    def retain(self, pids):
+        """Subscribes the plugin to the docs of pids, and only of pids."""
+        self.collector.subscribe(self.plugin_name, pids, self.docs)
+
+    def fetch(self, jolokiaclient, pid):
+        """Returns dictionary of doc -> read results of the docs of the plugin."""
+        return self.collector.fetch(jolokiaclient, pid, self.docs)
+
+    def collect(self, jolokiaclient, pid, doc, dict_jmx):
+        """Adds the fields of doc of a JVM to dict_jmx."""
+        results = self.collector.fetch(jolokiaclient, pid, [doc])[doc]
+        getattr(self, "map_" + doc)(results, dict_jmx)
+
+    def map_jmxStats(self, results, dict_jmx):
+        classloading = results.get('classloading')
+        if classloading:
+            dict_jmx['unloadedClass'] = classloading['UnloadedClassCount']
+            dict_jmx['loadedClass'] = classloading['LoadedClassCount']
+        threading = results.get('threading')
+        if threading is not None:
+            dict_jmx['threads'] = threading
+        memory = results.get('memory')
+        if memory:
+            add_usage(dict_jmx, 'heapMemoryUsage', memory['HeapMemoryUsage'], ('init', 'used', 'committed'))
+            add_usage(dict_jmx, 'nonHeapMemoryUsage', memory['NonHeapMemoryUsage'], ('init', 'used', 'committed'))
+
+        #initailize default values
+        param_list = ['G1OldGenerationCollectionTime', 'G1OldGenerationCollectionCount', 'G1YoungGenerationCollectionTime',
+                      'G1YoungGenerationCollectionCount', 'G1OldGenUsageUsed', 'G1SurvivorSpaceUsageUsed', 'MetaspaceUsageUsed',
+                      'CodeCacheUsageUsed', 'CompressedClassSpaceUsageUsed', 'G1EdenSpaceUsageUsed']
+        for param in param_list:
+            dict_jmx[param] = 0
+
+        for value in pattern_values(results.get('gc')):
+            if not self.is_supported("GC", value.get('Name')) or value.get('Valid') is not True:
+                continue
+            gc_name = no_spaces(value['Name'])
+            dict_jmx[gc_name + 'CollectionTime'] = round(value['CollectionTime'] * 0.001, 2)
+            dict_jmx[gc_name + 'CollectionCount'] = value['CollectionCount']
+        for value in pattern_values(results.get('pool')):
+            if not self.is_supported("memory pool", value.get('Name')) or value.get('Valid') is not True:
+                continue
+            dict_jmx[no_spaces(value['Name']) + 'UsageUsed'] = to_mb(value['Usage']['used'])
+
+    def map_memoryPoolStats(self, results, dict_jmx):
+        for pool_name, value in results.items():
+            if not self.is_supported("memory pool", pool_name) or value.get('Valid') is not True:
+                continue
+            prefix = no_spaces(pool_name)
+            if value['CollectionUsage']:
+                add_usage(dict_jmx, prefix + 'CollectionUsage', value['CollectionUsage'])
+            add_usage(dict_jmx, prefix + 'Usage', value['Usage'])
+            add_usage(dict_jmx, prefix + 'PeakUsage', value['PeakUsage'])
+            for threshold in ('CollectionUsageThreshold', 'UsageThreshold'):
+                if threshold in value:
+                    dict_jmx[prefix + threshold] = to_mb(value[threshold])
+                    dict_jmx[prefix + threshold + 'Count'] = value[threshold + 'Count']
+                    dict_jmx[prefix + threshold + 'Exceeded'] = value[threshold + 'Exceeded']
+
+    def map_memoryStats(self, results, dict_jmx):
+        memory = results.get('memory')
+        if memory:
+            add_usage(dict_jmx, 'heapMemoryUsage', memory['HeapMemoryUsage'])
+            add_usage(dict_jmx, 'nonHeapMemoryUsage', memory['NonHeapMemoryUsage'])
+            dict_jmx['objectPendingFinalization'] = memory['ObjectPendingFinalizationCount']
+
+    def map_threadStats(self, results, dict_jmx):
+        threading = results.get('threading')
+        if threading:
+            dict_jmx['threads'] = threading['ThreadCount']
+            dict_jmx['peakThreads'] = threading['PeakThreadCount']
+            dict_jmx['daemonThreads'] = threading['DaemonThreadCount']
+            dict_jmx['totalStartedThreads'] = threading['TotalStartedThreadCount']
+            if threading['CurrentThreadCpuTimeSupported']:
+                dict_jmx['currentThreadCpuTime'] = round(threading['CurrentThreadCpuTime'] / 1000000000.0, 2)
+                dict_jmx['currentThreadUserTime'] = round(threading['CurrentThreadUserTime'] / 1000000000.0, 2)
+
+    def map_gcStats(self, results, dict_jmx):
+        def memory_gc_usage(mempool_gc, key, gc_name):
+            for name, values in mempool_gc.items():
+                if name in GC_MEMORY_POOLS:
+                    add_usage(dict_jmx, gc_name + key + no_spaces(name), values)
+
+        for gc_name, value in results.items():
+            if not self.is_supported("GC", gc_name) or value.get('Valid') is not True:
+                continue
+            gc_name = no_spaces(gc_name)
+            dict_jmx[gc_name + 'CollectionTime'] = round(value['CollectionTime'] * 0.001, 2)
+            dict_jmx[gc_name + 'CollectionCount'] = value['CollectionCount']
+            last_gc = value['LastGcInfo']
+            if last_gc:
+                dict_jmx[gc_name + 'GcThreadCount'] = last_gc['GcThreadCount']
+                dict_jmx[gc_name + 'StartTime'] = round(last_gc['startTime'] * 0.001, 2)
+                dict_jmx[gc_name + 'EndTime'] = round(last_gc['endTime'] * 0.001, 2)
+                dict_jmx[gc_name + 'Duration'] = round(last_gc['duration'] * 0.001, 2)
+                memory_gc_usage(last_gc['memoryUsageAfterGc'], 'MemUsageAfGc', gc_name)
+                memory_gc_usage(last_gc['memoryUsageBeforeGc'], 'MemUsageBfGc', gc_name)
+
+    def map_classLoadingStats(self, results, dict_jmx):
+        classloading = results.get('classloading')
+        if classloading:
+            dict_jmx['unloadedClass'] = classloading['UnloadedClassCount']
+            dict_jmx['loadedClass'] = classloading['LoadedClassCount']
+            dict_jmx['totalLoadedClass'] = classloading['TotalLoadedClassCount']
+
+    def map_compilationStats(self, results, dict_jmx):
+        compilation = results.get('compilation')
+        if compilation:
+            dict_jmx['compilerName'] = compilation['Name']
+            dict_jmx['totalCompilationTime'] = round(compilation['TotalCompilationTime'] * 0.001, 2)
+
+    def map_nioStats(self, results, dict_jmx):
+        for pool_name, value in results.items():
+            dict_jmx[pool_name + 'BufferPoolCount'] = value['Count']
+            dict_jmx[pool_name + 'BufferPoolMemoryUsed'] = neg_bytes(value['MemoryUsed'])
+            dict_jmx[pool_name + 'BufferPoolTotalCapacity'] = neg_bytes(value['TotalCapacity'])
+
+    def map_operatingSysStats(self, results, dict_jmx):
+        ops = results.get('os')
+        if ops:
+            dict_jmx['osArchitecture'] = ops['Arch']
+            dict_jmx['availableProcessors'] = ops['AvailableProcessors']
+            dict_jmx['committedVirtualMemorySize'] = neg_bytes(ops['CommittedVirtualMemorySize'])
+            dict_jmx['freePhysicalMemorySize'] = to_mb(ops['FreePhysicalMemorySize'])
+            dict_jmx['freeSwapSpaceSize'] = to_mb(ops['FreeSwapSpaceSize'])
+            dict_jmx['maxFileDescriptors'] = ops['MaxFileDescriptorCount']
+            dict_jmx['osName'] = ops['Name']
+            dict_jmx['openFileDescriptors'] = ops['OpenFileDescriptorCount']
+            dict_jmx['processCpuLoad'] = ops['ProcessCpuLoad']
+            pcputime = ops['ProcessCpuTime']
+            if pcputime >= 0:
+                pcputime = round(pcputime / 1000000000.0, 2)
+            dict_jmx['processCpuTime'] = pcputime
+            dict_jmx['totalPhysicalMemorySize'] = to_mb(ops['TotalPhysicalMemorySize'])
+            dict_jmx['totalSwapSpaceSize'] = to_mb(ops['TotalSwapSpaceSize'])
+            dict_jmx['osVersion'] = ops['Version']
+            dict_jmx['systemCpuLoad'] = ops['SystemCpuLoad']
+            dict_jmx['systemLoadAverage'] = ops['SystemLoadAverage']
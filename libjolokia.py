@@ -9,6 +9,7 @@
 import os
 import sys
 import re
+import json
 import time
 import subprocess
 import socket
@@ -17,9 +18,12 @@ import threading
 import collectd
 from pyjolokia import Jolokia
 from contextlib import closing
+from libjvmregistry import REGISTRY, read_start_time
 
 #constants
 JOLOKIA_PATH = "/opt/sfapm/collectd/plugins/"
+JOLOKIA_AGENTS_FILE = "/opt/sfapm/collectd/var/lib/jolokia_agents.json"
+JOLOKIA_TIMEOUT = 5
 
 def synchronized(func):
     """Synchronise to prevent race condition which can occur
@@ -48,6 +52,107 @@ def get_cmd_output(cmd, shell_value=True, stdout_value=subprocess.PIPE,
     return status, err, returncode
 
 
+class JolokiaAgents(object):
+    """pid -> port of the Jolokia agents attached to running JVMs, shared by the
+    plugins of this process and kept in a file so that agents attached before
+    a restart of collectd are found without attaching again. An entry is valid
+    as long as the start time of the pid did not change."""
+
+    def __init__(self, filename=JOLOKIA_AGENTS_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.agents = {}
+        self.mtime = None
+        self.session = requests.Session()
+
+    def load(self):
+        """Reads the file if another process changed it."""
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.filename) as agents_file:
+                self.agents = json.load(agents_file)
+            self.mtime = mtime
+        except (IOError, ValueError) as err:
+            collectd.error("Failed to read %s: %s" % (self.filename, err))
+
+    def save(self):
+        tmp_file = "%s.%d" % (self.filename, os.getpid())
+        try:
+            dirname = os.path.dirname(self.filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with open(tmp_file, "w") as agents_file:
+                json.dump(self.agents, agents_file)
+            os.rename(tmp_file, self.filename)
+            self.mtime = os.stat(self.filename).st_mtime
+        except (IOError, OSError) as err:
+            collectd.error("Failed to write %s: %s" % (self.filename, err))
+
+    def get_port(self, pid):
+        """Returns port of the agent registered for pid, None if unknown."""
+        pid = str(pid)
+        with self.lock:
+            self.load()
+            agent = self.agents.get(pid)
+            if agent is None:
+                return None
+            start_time = read_start_time(pid)
+            if agent.get("startTime") != start_time:
+                # pid reused by another process
+                del self.agents[pid]
+                self.save()
+                return None
+            return agent.get("port")
+
+    def register(self, pid, port):
+        pid = str(pid)
+        with self.lock:
+            self.load()
+            self.agents = dict((agent_pid, agent) for agent_pid, agent in self.agents.items()
+                               if read_start_time(agent_pid) is not None)
+            self.agents[pid] = {"port": str(port), "startTime": read_start_time(pid)}
+            self.save()
+
+    def unregister(self, pid):
+        pid = str(pid)
+        with self.lock:
+            self.load()
+            if self.agents.pop(pid, None) is not None:
+                self.save()
+
+    def get_version(self, port):
+        """Returns value of the version request of the agent in port, None if
+        no agent answers."""
+        try:
+            resp = self.session.get("http://127.0.0.1:%s/jolokia/version" % port,
+                                    timeout=JOLOKIA_TIMEOUT)
+            if resp.status_code == 200:
+                return resp.json().get("value", {})
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        return None
+
+    def is_alive(self, pid, port):
+        """Returns True if the agent in port answers and belongs to pid. Agent
+        ids default to <ip>-<pid>-<hash>-jvm."""
+        version = self.get_version(port)
+        if version is None:
+            return False
+        agent_id = version.get("config", {}).get("agentId", "")
+        parts = agent_id.split("-")
+        if len(parts) >= 4 and parts[-1] == "jvm" and parts[-3] != str(pid):
+            return False
+        return True
+
+
+AGENTS = JolokiaAgents()
+
+
 class JolokiaClient(object):
 
     def __init__(self, plugin_name, process_name):
@@ -77,28 +182,17 @@ class JolokiaClient(object):
 
     def get_pid(self):
         """Get PIDs of the java process."""
-        pid_cmd = "jcmd | awk '{print $1 \" \" $2}' | grep -w \"%s\"" % self.process_name
-        pids, err, _ = get_cmd_output(pid_cmd)
-        if err:
-            collectd.error("Plugin %s: Error in collecting pid for process %s: %s" % (self.plugin_name, self.process_name, err))
-            return False
-        pids = pids.splitlines()
-        pid_list = []
-        for pid in pids:
-            if pid is not "":
-                pidval = pid.split()
-                pid_list.append(pidval[0])
+        pid_list = [str(jvm.pid) for jvm in REGISTRY.find(self.process_name)]
         collectd.debug("Plugin %s: PID(s) of %s process: %s" % (self.plugin_name, self.process_name, pid_list))
         return pid_list
 
     def get_uid_of_pid(self, pid):
         """Jolokia needs to be run with same user of the process attached"""
-        uid_cmd = "awk '/^Uid:/{print $2}' /proc/%s/status" % pid
-        uid, err, _ = get_cmd_output(uid_cmd)
-        if err:
-            collectd.error("Plugin %s: Failed to retrieve uid for pid %s, %s" % (self.plugin_name, pid, err))
+        jvm = REGISTRY.get(pid)
+        if jvm is None:
+            collectd.error("Plugin %s: Failed to retrieve uid for pid %s, process is not running" % (self.plugin_name, pid))
             return False
-        return uid.strip()
+        return str(jvm.uid)
 
     def run_jolokia_cmd(self, cmd, pid, port=None):
         """Common logic to run jolokia cmds."""
@@ -108,9 +202,22 @@ class JolokiaClient(object):
             jolokia_cmd += " --port=%s" % port
         return get_cmd_output(jolokia_cmd)
 
-    @synchronized
     def get_jolokia_port(self, pid):
+        """Returns port of the jolokia agent of pid, attaching one only when no
+        registered agent answers."""
+        port = AGENTS.get_port(pid)
+        if port and AGENTS.is_alive(pid, port):
+            return port
+        return self.attach_jolokia(pid)
+
+    @synchronized
+    def attach_jolokia(self, pid):
         """check if jmx jolokia agent already running, if running get port"""
+        # another plugin may have attached while waiting for the lock
+        port = AGENTS.get_port(pid)
+        if port and AGENTS.is_alive(pid, port):
+            return port
+        AGENTS.unregister(pid)
         status, err, ret = self.run_jolokia_cmd("status", pid)
         if err or ret:
             port = self.get_free_port()
@@ -127,21 +234,23 @@ class JolokiaClient(object):
                     return False
             else:
                 collectd.info("Plugin %s: Jolokia client started for pid %s and listening in port %s" % (self.plugin_name, pid, port))
+                AGENTS.register(pid, port)
                 return port
 
         # jolokia id already running and return port
         jolokiaip = status.splitlines()[1]
         port = re.findall('\d+', jolokiaip.split(':')[2])[0]
         collectd.info("Plugin %s: Jolokia client is already running for pid %s in IP %s" % (self.plugin_name, pid, jolokiaip))
+        AGENTS.register(pid, port)
         return port
 
     def connection_available(self, port):
         """Check if jolokia client is up."""
         try:
             jolokia_url = "http://127.0.0.1:%s/jolokia/version" % port
-            resp = requests.get(jolokia_url)
+            resp = AGENTS.session.get(jolokia_url, timeout=JOLOKIA_TIMEOUT)
             if resp.status_code == 200:
                 collectd.debug("Plugin %s: Jolokia Connection available in port %s" % (self.plugin_name, port))
                 return True
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.RequestException:
             return False
@@ -0,0 +1,199 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to discover the running JVMs without jcmd, shared by the jvm
+and JMX plugins. JVMs are found from the hsperfdata directories and from
+/proc/<pid>/cmdline. Every pid is looked at once per start time: later
+refreshes only read /proc/<pid>/stat to detect a pid reused by another
+process.
+"""
+
+import os
+import re
+import glob
+import time
+import threading
+from collections import namedtuple
+import libhsperf
+
+PROC = "/proc"
+HSPERFDATA_GLOB = "/tmp/hsperfdata_*/*"
+# seconds a refresh is reused, plugins polling in the same interval share it
+REFRESH_AGE = 5
+# java options which take the next argument as their value
+OPTIONS_WITH_VALUE = ("-cp", "-classpath", "--class-path", "-p", "--module-path",
+                      "--add-modules", "--add-opens", "--add-exports", "--add-reads")
+
+JvmProcess = namedtuple('jvm_process', 'pid main_class arguments uid start_time')
+
+
+def read_start_time(pid):
+    """Returns start time in jiffies of a pid, None if the process is gone."""
+    try:
+        with open(os.path.join(PROC, pid, "stat")) as stat_file:
+            data = stat_file.read()
+    except IOError:
+        return None
+    fields = data[data.rfind(")") + 2:].split()
+    return fields[19] if len(fields) > 19 else None
+
+
+def read_cmdline(pid):
+    """Returns argument list of a pid, empty for kernel threads."""
+    try:
+        with open(os.path.join(PROC, pid, "cmdline")) as cmdline:
+            return cmdline.read().split("\0")[:-1]
+    except IOError:
+        return []
+
+
+def read_uid(pid):
+    """Returns real uid of a pid, the first field of the Uid line of its
+    status, None if the process is gone."""
+    try:
+        with open(os.path.join(PROC, pid, "status")) as status:
+            for line in status:
+                if line.startswith("Uid:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def java_command(args):
+    """Returns main class or jar and its arguments from a java command line,
+    the way jcmd lists them."""
+    index = 1
+    while index < len(args):
+        arg = args[index]
+        if arg == "-jar":
+            return args[index + 1:index + 2] + args[index + 2:]
+        if arg in OPTIONS_WITH_VALUE:
+            index += 2
+        elif arg.startswith("-"):
+            index += 1
+        else:
+            return args[index:]
+    return []
+
+
+def loads_libjvm(pid):
+    """Returns True if a process has the JVM library mapped, for JVMs started
+    by launchers other than java such as jsvc."""
+    try:
+        with open(os.path.join(PROC, pid, "maps")) as maps:
+            for line in maps:
+                if line.rstrip().endswith("/libjvm.so"):
+                    return True
+    except IOError:
+        pass
+    return False
+
+
+def hsperfdata_pids():
+    """Returns set of pids which have a hsperfdata file."""
+    return set(os.path.basename(path) for path in glob.glob(HSPERFDATA_GLOB)
+               if os.path.basename(path).isdigit())
+
+
+class JvmRegistry(object):
+    """Cache of pid -> JvmProcess of the running JVMs."""
+
+    def __init__(self, refresh_age=REFRESH_AGE):
+        self.refresh_age = refresh_age
+        self.lock = threading.Lock()
+        # pid -> (start time, hsperfdata seen, JvmProcess or None for
+        # processes which are not JVMs)
+        self.processes = {}
+        self.last_refresh = 0
+
+    def inspect(self, pid, start_time, perf_pids):
+        """Returns JvmProcess of a pid, None if it is not a JVM."""
+        args = read_cmdline(pid)
+        if not args:
+            return None
+        is_java = os.path.basename(args[0]) == "java"
+        if not is_java and (pid not in perf_pids or not loads_libjvm(pid)):
+            return None
+        command = None
+        if pid in perf_pids:
+            # the command line as the JVM reports it, what jcmd prints
+            perf = None
+            path = libhsperf.hsperfdata_path(pid)
+            try:
+                perf = libhsperf.HsPerfData(path)
+                perf.refresh_index()
+                command = perf.get("sun.rt.javaCommand")
+            except (IOError, OSError, ValueError, TypeError, libhsperf.HsPerfError):
+                pass
+            finally:
+                if perf is not None:
+                    perf.close()
+            command = command.split() if command else None
+        if command is None:
+            command = java_command(args) if is_java else []
+        if not command:
+            return None
+        uid = read_uid(pid)
+        if uid is None:
+            return None
+        return JvmProcess(int(pid), command[0], " ".join(command[1:]), uid, start_time)
+
+    def refresh(self):
+        """Updates the cache with the processes started since the previous refresh."""
+        try:
+            pids = [name for name in os.listdir(PROC) if name.isdigit()]
+        except OSError:
+            return
+        perf_pids = hsperfdata_pids()
+        processes = {}
+        for pid in pids:
+            start_time = read_start_time(pid)
+            if start_time is None:
+                continue
+            has_perf = pid in perf_pids
+            cached = self.processes.get(pid)
+            # a JVM creates its hsperfdata file a moment after it started
+            if cached is not None and cached[0] == start_time and \
+                    (cached[1] or not has_perf):
+                processes[pid] = cached
+                continue
+            processes[pid] = (start_time, has_perf, self.inspect(pid, start_time, perf_pids))
+        self.processes = processes
+        self.last_refresh = time.time()
+
+    def get_jvms(self):
+        """Returns list of JvmProcess of all running JVMs."""
+        with self.lock:
+            if time.time() - self.last_refresh >= self.refresh_age:
+                self.refresh()
+            return [jvm for _, _, jvm in self.processes.values() if jvm is not None]
+
+    def get(self, pid):
+        """Returns JvmProcess of a pid, None if it is not a running JVM."""
+        for jvm in self.get_jvms():
+            if jvm.pid == int(pid):
+                return jvm
+        return None
+
+    def find(self, process_name):
+        """Returns JvmProcess of the JVMs whose main class contains the word(s)
+        process_name, like grep -w on the jcmd listing."""
+        pattern = re.compile(r"(?<!\w)(?:%s)(?!\w)" % process_name)
+        return sorted((jvm for jvm in self.get_jvms() if pattern.search(jvm.main_class)),
+                      key=lambda jvm: jvm.pid)
+
+    def search(self, process_pattern):
+        """Returns JvmProcess of the JVMs whose main class and arguments match
+        the regular expression process_pattern, like grep -E on the jcmd listing."""
+        pattern = re.compile(process_pattern)
+        return sorted((jvm for jvm in self.get_jvms()
+                       if pattern.search("%s %s" % (jvm.main_class, jvm.arguments))),
+                      key=lambda jvm: jvm.pid)
+
+
+REGISTRY = JvmRegistry()
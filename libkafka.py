@@ -0,0 +1,247 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to keep the topic and partition metadata of a kafka cluster
+between polls, and to compute the lag of the consumer groups with the kafka
+protocol. One KafkaConsumer connection is kept open and the metadata is
+fetched again only when it is older than METADATA_TTL or a topic is missing
+from it.
+"""
+
+import time
+import threading
+import collectd
+import kafka
+from kafka.client_async import KafkaClient
+from kafka.structs import TopicPartition
+from kafka.protocol.admin import ListGroupsRequest, DescribeGroupsRequest
+from kafka.protocol.commit import OffsetFetchRequest
+from kafka.protocol.offset import OffsetRequest
+from kafka.coordinator.protocol import ConsumerProtocolMemberAssignment
+
+# seconds the metadata is reused
+METADATA_TTL = 300
+# internal topics such as __consumer_offsets are left out of the metadata of
+# KafkaConsumer.topics(), the broker still has their MBeans
+INTERNAL_TOPIC_PREFIX = "__"
+# minimum seconds between refreshes forced by missing topics
+MIN_REFRESH_INTERVAL = 30
+# seconds to wait for the responses of a batch of protocol requests
+REQUEST_TIMEOUT = 10
+NO_ERROR = 0
+CONSUMER_PROTOCOL = "consumer"
+# timestamp of ListOffsets requesting the log end offset
+LATEST_OFFSET = -1
+
+
+def is_internal_topic(topic):
+    return topic.startswith(INTERNAL_TOPIC_PREFIX)
+
+
+class KafkaMetadata(object):
+    """Cache of topic -> partition ids of a kafka cluster."""
+
+    def __init__(self, plugin_name, bootstrap_server, ttl=METADATA_TTL):
+        self.plugin_name = plugin_name
+        self.bootstrap_server = bootstrap_server
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.consumer = None
+        self.partitions = {}
+        self.last_refresh = 0
+
+    def get_consumer(self):
+        if self.consumer is None:
+            self.consumer = kafka.KafkaConsumer(bootstrap_servers=self.bootstrap_server)
+        return self.consumer
+
+    def close(self):
+        if self.consumer is not None:
+            try:
+                self.consumer.close()
+            except Exception:
+                pass
+            self.consumer = None
+
+    def refresh(self):
+        """Fetches metadata of all topics with the shared consumer."""
+        consumer = self.get_consumer()
+        partitions = {}
+        for topic in consumer.topics():
+            partitions[topic] = sorted(consumer.partitions_for_topic(topic) or [])
+        self.partitions = partitions
+        self.last_refresh = time.time()
+
+    def get_partitions(self, required_topics=()):
+        """Returns dictionary of topic -> list of partition ids. The metadata is
+        refreshed when expired or when a topic of required_topics is unknown,
+        internal topics are never in the metadata and do not count as unknown."""
+        with self.lock:
+            age = time.time() - self.last_refresh
+            missing = any(topic not in self.partitions for topic in required_topics
+                          if not is_internal_topic(topic))
+            if age < self.ttl and not (missing and age >= MIN_REFRESH_INTERVAL):
+                return self.partitions
+            try:
+                self.refresh()
+            except Exception as err:
+                # reconnect on the next refresh
+                self.close()
+                if not self.partitions:
+                    raise
+                collectd.error("Plugin %s: error in refreshing metadata of %s, using cached metadata: %s"
+                               % (self.plugin_name, self.bootstrap_server, err))
+                self.last_refresh = time.time()
+            return self.partitions
+
+
+class KafkaProtocolClient(object):
+    """Sends kafka protocol requests to the brokers of a cluster over one
+    long lived kafka.client_async.KafkaClient."""
+
+    def __init__(self, bootstrap_server, timeout=REQUEST_TIMEOUT):
+        self.client = KafkaClient(bootstrap_servers=bootstrap_server)
+        self.timeout = timeout
+
+    def close(self):
+        self.client.close()
+
+    def wait(self, done):
+        """Polls the client until done() or the timeout, returns done()."""
+        deadline = time.time() + self.timeout
+        while not done() and time.time() < deadline:
+            self.client.poll(timeout_ms=100)
+        return done()
+
+    def refresh_metadata(self):
+        future = self.client.cluster.request_update()
+        if not self.wait(lambda: future.is_done) or future.failed():
+            raise IOError("metadata request to %s failed" % self.client.config['bootstrap_servers'])
+
+    def brokers(self):
+        return [broker.nodeId for broker in self.client.cluster.brokers()]
+
+    def leader(self, topic, partition):
+        return self.client.cluster.leader_for_partition(TopicPartition(topic, partition))
+
+    def send_all(self, requests):
+        """Sends list of (node id, request) without waiting for each response,
+        returns list of responses, None for the requests which failed."""
+        for node_id in set(node_id for node_id, _ in requests):
+            self.client.ready(node_id)
+        self.wait(lambda: all(self.client.is_ready(node_id) for node_id, _ in requests))
+        futures = [self.client.send(node_id, request) for node_id, request in requests]
+        self.wait(lambda: all(future.is_done for future in futures))
+        return [future.value if future.succeeded() else None for future in futures]
+
+
+def group_assignments(proto):
+    """Returns dictionary of (coordinator, group) -> list of (topic, partition,
+    consumer id, client id) of the partitions assigned to active consumers."""
+    brokers = proto.brokers()
+    coordinator_groups = {}
+    for node_id, response in zip(brokers, proto.send_all([(node_id, ListGroupsRequest[0]())
+                                                          for node_id in brokers])):
+        if response is None or response.error_code != NO_ERROR:
+            continue
+        groups = [group for group, protocol_type in response.groups if protocol_type == CONSUMER_PROTOCOL]
+        if groups:
+            coordinator_groups[node_id] = groups
+    requests = [(node_id, DescribeGroupsRequest[0](groups)) for node_id, groups in coordinator_groups.items()]
+    assignments = {}
+    for (node_id, _), response in zip(requests, proto.send_all(requests)):
+        if response is None:
+            continue
+        for error_code, group, _, _, _, members in response.groups:
+            if error_code != NO_ERROR:
+                continue
+            assigned = []
+            for member_id, client_id, _, _, member_assignment in members:
+                if not member_assignment:
+                    continue
+                assignment = ConsumerProtocolMemberAssignment.decode(member_assignment)
+                for topic, partitions in assignment.assignment:
+                    for partition in partitions:
+                        assigned.append((topic, partition, member_id, client_id))
+            if assigned:
+                assignments[(node_id, group)] = assigned
+    return assignments
+
+
+def topic_partitions(partitions):
+    """Returns list of (topic, [partition, ...]) of (topic, partition) pairs."""
+    topics = {}
+    for topic, partition in partitions:
+        topics.setdefault(topic, []).append(partition)
+    return sorted(topics.items())
+
+
+def committed_offsets(proto, assignments):
+    """Returns dictionary of (group, topic, partition) -> committed offset,
+    one OffsetFetch request per group sent to its coordinator."""
+    groups = []
+    requests = []
+    for (node_id, group), assigned in sorted(assignments.items()):
+        partitions = topic_partitions((topic, partition) for topic, partition, _, _ in assigned)
+        groups.append(group)
+        requests.append((node_id, OffsetFetchRequest[1](group, partitions)))
+    offsets = {}
+    for group, response in zip(groups, proto.send_all(requests)):
+        if response is None:
+            continue
+        for topic, partitions in response.topics:
+            for partition, offset, _, error_code in partitions:
+                if error_code == NO_ERROR and offset >= 0:
+                    offsets[(group, topic, partition)] = offset
+    return offsets
+
+
+def log_end_offsets(proto, partitions):
+    """Returns dictionary of (topic, partition) -> log end offset, one
+    ListOffsets request per partition leader."""
+    leader_partitions = {}
+    for topic, partition in partitions:
+        leader = proto.leader(topic, partition)
+        if leader is not None and leader >= 0:
+            leader_partitions.setdefault(leader, []).append((topic, partition))
+    requests = []
+    for leader, leader_parts in sorted(leader_partitions.items()):
+        topics = [(topic, [(partition, LATEST_OFFSET) for partition in parts])
+                  for topic, parts in topic_partitions(leader_parts)]
+        requests.append((leader, OffsetRequest[1](-1, topics)))
+    offsets = {}
+    for response in proto.send_all(requests):
+        if response is None:
+            continue
+        for topic, parts in response.topics:
+            for partition, error_code, _, offset in parts:
+                if error_code == NO_ERROR:
+                    offsets[(topic, partition)] = offset
+    return offsets
+
+
+def consumer_group_lag(proto):
+    """Returns list of dictionaries of the offsets and lag of every partition
+    assigned to an active consumer, the rows of kafka-consumer-groups.sh --describe."""
+    proto.refresh_metadata()
+    assignments = group_assignments(proto)
+    committed = committed_offsets(proto, assignments)
+    end_offsets = log_end_offsets(proto, set((topic, partition) for assigned in assignments.values()
+                                             for topic, partition, _, _ in assigned))
+    grp_list = []
+    for (_, group), assigned in sorted(assignments.items()):
+        for topic, partition, member_id, client_id in sorted(assigned):
+            current = committed.get((group, topic, partition))
+            end = end_offsets.get((topic, partition))
+            if current is None or end is None:
+                # nothing committed yet or the leader is not available
+                continue
+            grp_list.append({"_groupName": group, "_topicName": topic, "partition": partition,
+                             "currentOffset": current, "logEndOffset": end,
+                             "lag": max(end - current, 0), "custId": member_id,
+                             "clientId": client_id})
+    return grp_list
@@ -0,0 +1,276 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to list open files of all processes from /proc, producing
+the same fields as the lsof based lsofstats plugin
+"""
+
+import os
+import pwd
+import stat
+import time
+import libsockets
+
+PROC = "/proc"
+# fd names of lsof for the process wide entries
+SPECIAL_LINKS = (("cwd", "cwd"), ("root", "rtd"), ("exe", "txt"))
+
+
+def read_socket_inodes():
+    """Returns socket inode -> (file type, name) for the sockets of /proc/net."""
+    inodes = {}
+    for entry in libsockets.read_sockets():
+        ipv6 = entry.protocol.endswith("6")
+        local, remote = entry.local_address, entry.foreign_address
+        if ipv6:
+            local, remote = "[%s]" % local, "[%s]" % remote
+        protocol = entry.protocol[:3].upper()
+        if entry.foreign_port == 0:
+            if local in ("0.0.0.0", "[::]"):
+                local = "*"
+            name = "%s %s:%d" % (protocol, local, entry.local_port)
+        else:
+            name = "%s %s:%d->%s:%d" % (protocol, local, entry.local_port, remote, entry.foreign_port)
+        if protocol == "TCP":
+            name = "%s (%s)" % (name, entry.state)
+        inodes[str(entry.inode)] = ("IPv6" if ipv6 else "IPv4", name)
+    try:
+        with open(os.path.join(PROC, "net", "unix")) as table:
+            table.readline()
+            for line in table:
+                fields = line.split()
+                if len(fields) >= 7:
+                    inodes[fields[6]] = ("unix", fields[7] if len(fields) > 7 else "socket")
+    except IOError:
+        pass
+    try:
+        with open(os.path.join(PROC, "net", "netlink")) as table:
+            table.readline()
+            for line in table:
+                fields = line.split()
+                if len(fields) >= 10:
+                    inodes[fields[-1]] = ("netlink", "netlink")
+    except IOError:
+        pass
+    return inodes
+
+
+class ProcessEntry(object):
+    """Open files of one process as seen by the previous scan."""
+    __slots__ = ("start_time", "fds", "rows")
+
+    def __init__(self, start_time, fds, rows):
+        self.start_time = start_time
+        self.fds = fds
+        self.rows = rows
+
+
+class OpenFileScanner(object):
+    """Walks /proc/<pid>/fd of every process. Processes whose start time and
+    fd listing did not change since the previous poll reuse their rows, a
+    full rescan is done every full_scan_interval polls and a poll stops
+    scanning once time_budget seconds are spent; processes not reached reuse
+    their previous rows and are scanned first on the next poll."""
+
+    def __init__(self, time_budget=2.0, full_scan_interval=10, include_mem=True):
+        self.time_budget = time_budget
+        self.full_scan_interval = full_scan_interval
+        self.include_mem = include_mem
+        self.processes = {}
+        self.users = {}
+        self.polls = 0
+        self.resume_pid = None
+        self.socket_inodes = None
+        self.stats = {}
+
+    def get_user(self, uid):
+        user = self.users.get(uid)
+        if user is None:
+            try:
+                user = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                user = str(uid)
+            self.users[uid] = user
+        return user
+
+    def get_socket(self, inode):
+        if self.socket_inodes is None:
+            self.socket_inodes = read_socket_inodes()
+        return self.socket_inodes.get(inode, ("sock", "protocol: unknown"))
+
+    def file_row(self, link, fd_path):
+        """Returns (fileType, device, node, size, name) of one link."""
+        if link.startswith("socket:["):
+            inode = link[8:-1]
+            file_type, name = self.get_socket(inode)
+            return file_type, "None", inode, 0, name
+        if link.startswith("anon_inode:"):
+            return "a_inode", "None", "None", 0, link[11:]
+        if link.startswith("pipe:["):
+            return "FIFO", "None", link[6:-1], 0, "pipe"
+        try:
+            st = os.stat(fd_path)
+        except OSError:
+            return "unknown", "None", "None", 0, link
+        mode = st.st_mode
+        size = 0
+        dev = st.st_dev
+        if stat.S_ISREG(mode):
+            file_type = "REG"
+            size = st.st_size
+        elif stat.S_ISDIR(mode):
+            file_type = "DIR"
+            size = st.st_size
+        elif stat.S_ISCHR(mode):
+            file_type = "CHR"
+            dev = st.st_rdev
+        elif stat.S_ISBLK(mode):
+            file_type = "BLK"
+            dev = st.st_rdev
+        elif stat.S_ISFIFO(mode):
+            file_type = "FIFO"
+        else:
+            file_type = "unknown"
+        return (file_type, "%d,%d" % (os.major(dev), os.minor(dev)),
+                str(st.st_ino), size, link)
+
+    @staticmethod
+    def fd_mode(fd_path):
+        """lsof access mode of a fd, procfs reflects it in the link permissions."""
+        try:
+            mode = os.lstat(fd_path).st_mode
+        except OSError:
+            return ""
+        readable = mode & stat.S_IRUSR
+        writable = mode & stat.S_IWUSR
+        if readable and writable:
+            return "u"
+        if writable:
+            return "w"
+        if readable:
+            return "r"
+        return ""
+
+    def scan_process(self, pid, command, user, fds):
+        rows = []
+        pid_path = os.path.join(PROC, pid)
+        pid_value = long(pid)
+
+        def add(fd_name, file_type, device, node, size, name):
+            rows.append({"processCommand": command, "pid": pid_value, "user": user,
+                         "fileDescriptor": fd_name, "fileType": file_type,
+                         "device": device, "node": node, "size": size, "name": name})
+
+        for link_name, fd_name in SPECIAL_LINKS:
+            link_path = os.path.join(pid_path, link_name)
+            try:
+                link = os.readlink(link_path)
+            except OSError:
+                continue
+            add(fd_name, *self.file_row(link, link_path))
+
+        if self.include_mem:
+            seen = set()
+            try:
+                with open(os.path.join(pid_path, "maps")) as maps:
+                    for line in maps:
+                        fields = line.split(None, 5)
+                        if len(fields) < 6 or fields[4] == "0" or not fields[5].startswith("/"):
+                            continue
+                        name = fields[5].rstrip("\n")
+                        if name in seen:
+                            continue
+                        seen.add(name)
+                        major, minor = fields[3].split(":")
+                        try:
+                            size = os.stat(name).st_size
+                        except OSError:
+                            size = 0
+                        add("mem", "REG", "%d,%d" % (int(major, 16), int(minor, 16)),
+                            fields[4], size, name)
+            except IOError:
+                pass
+
+        fd_dir = os.path.join(pid_path, "fd")
+        for fd in fds:
+            fd_path = os.path.join(fd_dir, fd)
+            try:
+                link = os.readlink(fd_path)
+            except OSError:
+                # closed while scanning
+                continue
+            add(fd + self.fd_mode(fd_path), *self.file_row(link, fd_path))
+        return rows
+
+    def read_process(self, pid):
+        """Returns (start time, command, uid) of a process or None."""
+        try:
+            with open(os.path.join(PROC, pid, "stat")) as stat_file:
+                data = stat_file.read()
+            uid = os.stat(os.path.join(PROC, pid)).st_uid
+        except (IOError, OSError):
+            return None
+        command = data[data.find("(") + 1:data.rfind(")")]
+        fields = data[data.rfind(")") + 2:].split()
+        # field 22 of stat, start time in jiffies since boot
+        return fields[19], command, uid
+
+    def poll(self):
+        """Returns list of open file rows of all processes."""
+        start = time.time()
+        self.polls += 1
+        full_scan = self.full_scan_interval and self.polls % self.full_scan_interval == 0
+        self.socket_inodes = None
+        try:
+            pids = sorted((name for name in os.listdir(PROC) if name.isdigit()), key=int)
+        except OSError:
+            return []
+        # continue with the processes the previous poll did not reach
+        if self.resume_pid is not None:
+            index = 0
+            while index < len(pids) and int(pids[index]) < int(self.resume_pid):
+                index += 1
+            pids = pids[index:] + pids[:index]
+        self.resume_pid = None
+
+        result = []
+        processes = {}
+        scanned = reused = stale = 0
+        for pid in pids:
+            cached = self.processes.get(pid)
+            if self.resume_pid is None and time.time() - start > self.time_budget:
+                self.resume_pid = pid
+            if self.resume_pid is not None:
+                # out of time for this poll
+                if cached is not None:
+                    processes[pid] = cached
+                    result.extend(cached.rows)
+                    stale += 1
+                continue
+            info = self.read_process(pid)
+            if info is None:
+                continue
+            start_time, command, uid = info
+            try:
+                fds = tuple(sorted(os.listdir(os.path.join(PROC, pid, "fd")), key=int))
+            except OSError:
+                # kernel thread or no permission
+                fds = ()
+            if not full_scan and cached is not None and cached.start_time == start_time \
+                    and cached.fds == fds:
+                entry = cached
+                reused += 1
+            else:
+                entry = ProcessEntry(start_time, fds,
+                                     self.scan_process(pid, command, self.get_user(uid), fds))
+                scanned += 1
+            processes[pid] = entry
+            result.extend(entry.rows)
+        self.processes = processes
+        self.stats = {"scanned": scanned, "reused": reused, "stale": stale,
+                      "duration": time.time() - start}
+        return result
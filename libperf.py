@@ -0,0 +1,226 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to sample the last level cache loads and misses of all cpus in
+a background thread, so that the read callbacks only pick up the latest value.
+The counters are read with perf_event_open when the kernel permits it,
+otherwise a long running perf stat process streams one line per interval.
+"""
+
+import os
+import errno
+import ctypes
+import struct
+import platform
+import subprocess
+import threading
+from threading import Thread
+import collectd
+
+# linux/perf_event.h
+PERF_TYPE_HW_CACHE = 3
+PERF_COUNT_HW_CACHE_LL = 2
+PERF_COUNT_HW_CACHE_OP_READ = 0
+PERF_COUNT_HW_CACHE_RESULT_ACCESS = 0
+PERF_COUNT_HW_CACHE_RESULT_MISS = 1
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1
+PERF_FORMAT_TOTAL_TIME_RUNNING = 2
+PERF_FLAG_FD_CLOEXEC = 8
+LLC_LOADS = PERF_COUNT_HW_CACHE_LL | (PERF_COUNT_HW_CACHE_OP_READ << 8) | \
+    (PERF_COUNT_HW_CACHE_RESULT_ACCESS << 16)
+LLC_LOAD_MISSES = PERF_COUNT_HW_CACHE_LL | (PERF_COUNT_HW_CACHE_OP_READ << 8) | \
+    (PERF_COUNT_HW_CACHE_RESULT_MISS << 16)
+# type, size, config, sample_period, sample_type, read_format, flags,
+# wakeup_events, bp_type, config1 (PERF_ATTR_SIZE_VER0)
+PERF_EVENT_ATTR = struct.Struct("=IIQQQQQIIQ")
+# value, time_enabled, time_running
+PERF_READ_FORMAT = struct.Struct("=QQQ")
+PERF_EVENT_OPEN_SYSCALL = {"x86_64": 298, "i386": 336, "i686": 336, "aarch64": 241,
+                           "armv7l": 364, "ppc64": 319, "ppc64le": 319, "s390x": 331}
+
+PERF_COMMAND = ["perf", "stat", "-a", "-x", ",", "-I", None, "-e", "LLC-loads,LLC-load-misses"]
+LLC_LOADS_EVENT = "LLC-loads"
+LLC_LOAD_MISSES_EVENT = "LLC-load-misses"
+NOT_SUPPORTED = "<not supported>"
+NOT_COUNTED = "<not counted>"
+
+
+def miss_rate(loads, misses):
+    """Returns percentage of LLC loads which missed, 0 without loads."""
+    if loads <= 0:
+        return 0
+    return round((float(misses) / loads) * 100, 2)
+
+
+class PerfCounters(object):
+    """One LLC-loads and one LLC-load-misses counter per cpu opened with
+    perf_event_open."""
+
+    def __init__(self, fds):
+        self.fds = fds
+        self.prev = None
+
+    @classmethod
+    def open(cls):
+        """Returns PerfCounters, None if the kernel does not permit them."""
+        syscall_number = PERF_EVENT_OPEN_SYSCALL.get(platform.machine())
+        if syscall_number is None:
+            return None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+        except OSError:
+            return None
+        fds = []
+        for cpu in range(os.sysconf("SC_NPROCESSORS_CONF")):
+            for config in (LLC_LOADS, LLC_LOAD_MISSES):
+                attr = ctypes.create_string_buffer(PERF_EVENT_ATTR.pack(
+                    PERF_TYPE_HW_CACHE, PERF_EVENT_ATTR.size, config, 0, 0,
+                    PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING,
+                    0, 0, 0, 0), PERF_EVENT_ATTR.size)
+                fd = libc.syscall(syscall_number, attr, -1, cpu, -1, PERF_FLAG_FD_CLOEXEC)
+                if fd < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.ENODEV:
+                        # offline cpu
+                        continue
+                    for opened in fds:
+                        os.close(opened[1])
+                    collectd.info("Plugin cpu_util: perf_event_open not permitted (%s), "
+                                  "using perf stat" % os.strerror(err))
+                    return None
+                fds.append((config, fd))
+        if not fds:
+            return None
+        return cls(fds)
+
+    def close(self):
+        for _, fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+    def read(self):
+        """Returns (loads, misses) counted since the counters were opened,
+        scaled when the kernel multiplexed them."""
+        totals = {LLC_LOADS: 0, LLC_LOAD_MISSES: 0}
+        for config, fd in self.fds:
+            value, enabled, running = PERF_READ_FORMAT.unpack(os.read(fd, PERF_READ_FORMAT.size))
+            if running:
+                totals[config] += value * float(enabled) / running
+        return totals[LLC_LOADS], totals[LLC_LOAD_MISSES]
+
+    def sample(self):
+        """Returns miss rate since the previous sample."""
+        current = self.read()
+        prev = self.prev or (0, 0)
+        self.prev = current
+        return miss_rate(current[0] - prev[0], current[1] - prev[1])
+
+
+class LLCSampler(Thread):
+    """Thread keeping the LLC miss rate of the latest interval."""
+
+    def __init__(self, interval):
+        Thread.__init__(self)
+        self.daemon = True
+        self.interval = max(float(interval), 0.1)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.rate = 0
+        self.supported = True
+        self.process = None
+
+    def latest(self):
+        """Returns the miss rate of the latest complete interval, 0 if none yet."""
+        with self.lock:
+            return self.rate
+
+    def publish(self, rate):
+        with self.lock:
+            self.rate = rate
+
+    def unsupported(self, message):
+        collectd.info("Plugin cpu_util: %s" % message)
+        self.supported = False
+        self.publish(0)
+
+    def run(self):
+        """Main thread entrypoint"""
+        counters = PerfCounters.open()
+        if counters is not None:
+            try:
+                self.sample_counters(counters)
+            finally:
+                counters.close()
+            return
+        while self.supported and not self.stopped.is_set():
+            self.stream_perf()
+            # perf exited, restart it after an interval
+            self.stopped.wait(self.interval)
+
+    def sample_counters(self, counters):
+        counters.sample()
+        while not self.stopped.wait(self.interval):
+            try:
+                self.publish(counters.sample())
+            except (OSError, struct.error) as err:
+                collectd.error("Plugin cpu_util: error in reading LLC counters: %s" % err)
+                return
+
+    def stream_perf(self):
+        """Runs perf stat in interval mode and publishes the rate of every interval."""
+        command = list(PERF_COMMAND)
+        command[command.index(None)] = str(int(self.interval * 1000))
+        try:
+            with open(os.devnull, "w") as devnull:
+                self.process = subprocess.Popen(command, stdout=devnull, stderr=subprocess.PIPE,
+                                                close_fds=True)
+        except OSError:
+            self.unsupported("Perf is not installed.")
+            return
+        values = {}
+        timestamp = None
+        try:
+            while not self.stopped.is_set():
+                line = self.process.stderr.readline()
+                if not line:
+                    break
+                if "perf not found for kernel" in line:
+                    self.unsupported("Perf is not installed for the kernel.")
+                    break
+                fields = line.strip().split(",")
+                if len(fields) < 4 or fields[3] not in (LLC_LOADS_EVENT, LLC_LOAD_MISSES_EVENT):
+                    continue
+                if fields[1] == NOT_SUPPORTED:
+                    self.unsupported("LLC Statistics is hidden from Virtual machines.")
+                    break
+                if fields[0] != timestamp:
+                    timestamp = fields[0]
+                    values = {}
+                try:
+                    values[fields[3]] = float(fields[1])
+                except ValueError:
+                    # <not counted>
+                    values[fields[3]] = 0
+                if len(values) == 2:
+                    self.publish(miss_rate(values[LLC_LOADS_EVENT], values[LLC_LOAD_MISSES_EVENT]))
+        finally:
+            self.kill_process()
+
+    def kill_process(self):
+        process = self.process
+        self.process = None
+        if process is not None and process.poll() is None:
+            try:
+                process.terminate()
+                process.wait()
+            except OSError:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        self.kill_process()
+        self.join(1)
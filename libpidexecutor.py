@@ -0,0 +1,180 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to collect the pids of the jolokia based plugins, or the
+targets of the prometheus plugins, concurrently in a bounded pool of worker
+threads. Every pid has to finish within the pid timeout and all pids within
+the cycle timeout, results of late pids are dropped so that one hung JVM does
+not stall the other pids of the plugin. The status and time taken by every
+pid of the latest cycle are kept and dispatched by the plugin as
+collectorStats documents.
+"""
+
+import time
+import Queue
+import threading
+import collectd
+
+# user imports
+from constants import *
+
+MAX_WORKERS = 4
+# seconds a pid may take
+PID_TIMEOUT = 30
+# seconds between checks of the deadlines while waiting for results
+WAIT_INTERVAL = 0.1
+
+OK = "ok"
+ERROR = "error"
+TIMEOUT = "timeout"
+# still collecting an earlier cycle
+SKIPPED = "skipped"
+
+
+class PidTask(object):
+    """Collection of one pid in one cycle."""
+
+    def __init__(self, pid, func, args, results):
+        self.pid = pid
+        self.func = func
+        self.args = args
+        self.results = results
+        self.cancelled = False
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+    def is_running(self):
+        return self.started is not None and self.finished is None
+
+
+class PidExecutor(object):
+    """Runs a function for every pid of a cycle on worker threads."""
+
+    def __init__(self, plugin_name, max_workers=MAX_WORKERS, pid_timeout=PID_TIMEOUT, item_name="pid"):
+        self.plugin_name = plugin_name
+        # what the items are called in the log messages
+        self.item_name = item_name
+        self.max_workers = max_workers
+        self.pid_timeout = pid_timeout
+        self.tasks = Queue.Queue()
+        self.workers = []
+        # pid -> PidTask of the latest cycle
+        self.last_tasks = {}
+        # pid -> (status, seconds) of the latest cycle
+        self.timings = {}
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            if task.cancelled:
+                continue
+            task.started = time.time()
+            try:
+                task.result = task.func(task.pid, *task.args)
+            except Exception as err:
+                task.error = err
+            task.finished = time.time()
+            task.results.put(task)
+
+    def ensure_workers(self, count):
+        """Starts workers up to count, plus one for every worker still stuck in
+        a cancelled task, at most twice max_workers."""
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+        stuck = len([task for task in self.last_tasks.values() if task.cancelled and task.is_running()])
+        wanted = min(min(count, self.max_workers) + stuck, 2 * self.max_workers)
+        while len(self.workers) < wanted:
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def cancel(self, task, reason):
+        task.cancelled = True
+        elapsed = time.time() - task.started if task.started else 0
+        self.timings[task.pid] = (TIMEOUT, elapsed)
+        collectd.error("Plugin %s: dropped %s %s, %s after %.2f seconds" %
+                       (self.plugin_name, self.item_name, task.pid, reason, elapsed))
+
+    def run(self, func, pids, cycle_timeout, *args):
+        """Calls func(pid, *args) for every pid, returns list of (pid, result)
+        of the pids which finished without error within the deadlines."""
+        results = Queue.Queue()
+        pending = {}
+        for pid in pids:
+            last_task = self.last_tasks.get(pid)
+            if last_task is not None and last_task.is_running():
+                self.timings[pid] = (SKIPPED, time.time() - last_task.started)
+                collectd.error("Plugin %s: %s %s is still collecting an earlier cycle, skipped" %
+                               (self.plugin_name, self.item_name, pid))
+                continue
+            task = PidTask(pid, func, args, results)
+            pending[pid] = task
+            self.last_tasks[pid] = task
+        for pid in list(self.last_tasks):
+            if pid not in pids and not self.last_tasks[pid].is_running():
+                del self.last_tasks[pid]
+                self.timings.pop(pid, None)
+        self.ensure_workers(len(pending))
+        for task in pending.values():
+            self.tasks.put(task)
+
+        output = []
+        deadline = time.time() + cycle_timeout
+        while pending:
+            now = time.time()
+            if now >= deadline:
+                break
+            for task in pending.values():
+                if task.is_running() and now - task.started >= self.pid_timeout:
+                    self.cancel(task, "%s timeout" % self.item_name)
+                    del pending[task.pid]
+            try:
+                task = results.get(timeout=min(WAIT_INTERVAL, deadline - now))
+            except Queue.Empty:
+                continue
+            if task.cancelled:
+                continue
+            del pending[task.pid]
+            elapsed = task.finished - task.started
+            if task.error is not None:
+                self.timings[task.pid] = (ERROR, elapsed)
+                collectd.error("Plugin %s: error in collecting %s %s: %s" %
+                               (self.plugin_name, self.item_name, task.pid, task.error))
+                continue
+            self.timings[task.pid] = (OK, elapsed)
+            collectd.info("Plugin %s: collected %s %s in %.2f seconds" %
+                          (self.plugin_name, self.item_name, task.pid, elapsed))
+            output.append((task.pid, task.result))
+        for task in pending.values():
+            self.cancel(task, "cycle timeout")
+        return output
+
+    def get_stats(self):
+        """Returns the self-metrics documents of the latest cycle, one per pid
+        with its status and the seconds it took."""
+        timestamp = int(round(time.time() * 1000))
+        stats_list = []
+        for pid, (status, seconds) in sorted(self.timings.items()):
+            stats_list.append({self.item_name: pid,
+                               "status": status,
+                               "duration": round(seconds, 3),
+                               TIMESTAMP: timestamp,
+                               PLUGIN: self.plugin_name,
+                               PLUGINTYPE: COLLECTOR_STATS,
+                               ACTUALPLUGINTYPE: self.plugin_name})
+        return stats_list
+
+    def shutdown(self):
+        """Stops the idle workers, registered as collectd shutdown callback of
+        the plugins owning an executor."""
+        for _ in self.workers:
+            self.tasks.put(None)
+        self.workers = []
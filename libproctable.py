@@ -0,0 +1,182 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to read the process table from /proc, shared by the topstats
+and psstats plugins. CPU usage is computed from the jiffies consumed between
+two polls and the top processes are selected with a heap.
+"""
+
+import os
+import pwd
+import time
+import heapq
+
+PROC = "/proc"
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE_KB = os.sysconf("SC_PAGE_SIZE") / 1024
+
+
+class ProcessSample(object):
+    """One process as read from /proc/<pid>/stat."""
+    __slots__ = ("pid", "name", "state", "tty_nr", "processor", "jiffies", "start_time",
+                 "vsize_kb", "rss_kb", "uid", "cpu_percent", "memory_percent", "elapsed")
+
+    def __init__(self, pid, name, state, tty_nr, processor, jiffies, start_time, vsize_kb, rss_kb, uid):
+        self.pid = pid
+        self.name = name
+        self.state = state
+        self.tty_nr = tty_nr
+        self.processor = processor
+        self.jiffies = jiffies
+        self.start_time = start_time
+        self.vsize_kb = vsize_kb
+        self.rss_kb = rss_kb
+        self.uid = uid
+        self.cpu_percent = 0.0
+        self.memory_percent = 0.0
+        self.elapsed = 0.0
+
+
+def read_uptime():
+    with open(os.path.join(PROC, "uptime")) as uptime_file:
+        return float(uptime_file.read().split()[0])
+
+
+def read_mem_total_kb():
+    with open(os.path.join(PROC, "meminfo")) as meminfo:
+        for line in meminfo:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1])
+    return 0
+
+
+def read_stat(pid):
+    """Returns ProcessSample of a pid or None if the process is gone."""
+    try:
+        with open(os.path.join(PROC, pid, "stat")) as stat_file:
+            data = stat_file.read()
+        uid = os.stat(os.path.join(PROC, pid)).st_uid
+    except (IOError, OSError):
+        return None
+    # the command name may contain spaces and parentheses
+    end = data.rfind(")")
+    fields = data[end + 2:].split()
+    if len(fields) < 37:
+        return None
+    return ProcessSample(int(pid), data[data.find("(") + 1:end], fields[0], int(fields[4]),
+                         int(fields[36]), int(fields[11]) + int(fields[12]), int(fields[19]),
+                         int(fields[20]) / 1024, int(fields[21]) * PAGE_SIZE_KB, uid)
+
+
+def tty_name(tty_nr):
+    """Converts tty_nr of /proc/<pid>/stat to the name ps shows."""
+    major = (tty_nr >> 8) & 0xfff
+    minor = (tty_nr & 0xff) | ((tty_nr >> 12) & 0xfff00)
+    if major == 0:
+        return "?"
+    if 136 <= major <= 143:
+        return "pts/%d" % ((major - 136) * 256 + minor)
+    if major == 4:
+        return "tty%d" % minor if minor < 64 else "ttyS%d" % (minor - 64)
+    return "%d,%d" % (major, minor)
+
+
+def format_time(seconds, hours=True):
+    """Formats seconds as [DD-]HH:MM:SS, or [[DD-]HH:]MM:SS like ps etime."""
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hour, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours or days or hour:
+        text = "%02d:%02d:%02d" % (hour, minutes, seconds)
+    else:
+        text = "%02d:%02d" % (minutes, seconds)
+    if days:
+        text = "%d-%s" % (days, text)
+    return text
+
+
+class ProcessTable(object):
+    """Reads all processes every poll and keeps the jiffies of the previous
+    poll to compute CPU usage over the poll interval."""
+
+    def __init__(self):
+        self.prev = {}
+        self.prev_uptime = None
+        self.users = {}
+
+    def get_user(self, uid):
+        user = self.users.get(uid)
+        if user is None:
+            try:
+                user = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                user = str(uid)
+            self.users[uid] = user
+        return user
+
+    def poll(self):
+        """Returns list of ProcessSample of all processes."""
+        uptime = read_uptime()
+        mem_total = read_mem_total_kb()
+        try:
+            pids = [name for name in os.listdir(PROC) if name.isdigit()]
+        except OSError:
+            return []
+        delta = uptime - self.prev_uptime if self.prev_uptime is not None else 0
+        prev = self.prev
+        current = {}
+        samples = []
+        for pid in pids:
+            sample = read_stat(pid)
+            if sample is None:
+                continue
+            sample.elapsed = max(uptime - float(sample.start_time) / CLK_TCK, 0)
+            previous = prev.get((sample.pid, sample.start_time))
+            if previous is not None and delta > 0:
+                sample.cpu_percent = (sample.jiffies - previous) * 100.0 / (delta * CLK_TCK)
+            elif sample.elapsed > 0:
+                # first time seen, average over the lifetime of the process like ps
+                sample.cpu_percent = sample.jiffies * 100.0 / (sample.elapsed * CLK_TCK)
+            if mem_total:
+                sample.memory_percent = sample.rss_kb * 100.0 / mem_total
+            current[(sample.pid, sample.start_time)] = sample.jiffies
+            samples.append(sample)
+        self.prev = current
+        self.prev_uptime = uptime
+        return samples
+
+    @staticmethod
+    def top(samples, count, sort_by="CPU"):
+        """Returns the count samples with highest CPU or memory usage, all
+        samples sorted when count is None."""
+        if sort_by == "MEM":
+            key = lambda sample: sample.rss_kb
+        else:
+            key = lambda sample: sample.cpu_percent
+        if count is None:
+            return sorted(samples, key=key, reverse=True)
+        return heapq.nlargest(count, samples, key=key)
+
+    @staticmethod
+    def shared_kb(sample):
+        """Returns shared memory of a process from /proc/<pid>/statm."""
+        try:
+            with open(os.path.join(PROC, str(sample.pid), "statm")) as statm:
+                return int(statm.read().split()[2]) * PAGE_SIZE_KB
+        except (IOError, IndexError, ValueError):
+            return 0
+
+    @staticmethod
+    def command_line(sample):
+        """Returns the arguments of a process, the name for kernel threads."""
+        try:
+            with open(os.path.join(PROC, str(sample.pid), "cmdline")) as cmdline:
+                args = cmdline.read().replace("\0", " ").strip()
+        except IOError:
+            args = ""
+        return args or "[%s]" % sample.name
@@ -0,0 +1,310 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to parse the prometheus text exposition format in one pass
+over the lines of an exporter response. Every metric family becomes a
+dictionary of its HELP, TYPE and list of samples, a sample is a dictionary
+of its labels and value.
+
+    # HELP http_requests_total The total number of HTTP requests.
+    # TYPE http_requests_total counter
+    http_requests_total{method="post",code="200"} 1027 1395066363000
+
+A MetricFilter drops families by name before their lines are parsed, and
+samples by their labels. A SeriesStore keeps the last value of every series
+of an exporter between polls, to add the per second rate to counter samples
+and to leave out gauge samples which did not change.
+"""
+
+import re
+import math
+
+# name of a sample line, followed by labels, value and optional timestamp
+NAME_PATTERN = re.compile(r'[a-zA-Z_:][a-zA-Z0-9_:]*')
+SAMPLE_PATTERN = re.compile(r'[ \t]*(?:\{(.*)\})?[ \t]+(\S+)(?:[ \t]+(-?\d+))?[ \t]*$')
+LABEL_PATTERN = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)[ \t]*=[ \t]*"((?:[^"\\]|\\.)*)"')
+# HELP and TYPE lines, other comments are ignored
+METADATA_PATTERN = re.compile(r'#[ \t]+(HELP|TYPE)[ \t]+(\S+)(?:[ \t]+(.*))?$')
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+ESCAPES = {'n': '\n', '"': '"', '\\': '\\'}
+# names of the samples of a histogram, summary or counter family besides the family name
+SAMPLE_SUFFIXES = ("_bucket", "_sum", "_count", "_total", "_created")
+# label matcher of the filter configuration, label="value", !=, =~ or !~
+LABEL_MATCHER_PATTERN = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"(.*)"\s*$')
+# fields of a sample which are not labels
+SAMPLE_FIELDS = ("value", "suffix", "rate")
+# samples of a counter family which count, _created holds a timestamp
+COUNTER_SUFFIXES = (None, "_total")
+# polls a series is kept without being seen
+SERIES_MAX_IDLE_POLLS = 10
+RATE_PRECISION = 4
+
+
+def unescape(text):
+    if '\\' not in text:
+        return text
+    return ESCAPE_PATTERN.sub(lambda match: ESCAPES.get(match.group(1), match.group(0)), text)
+
+
+def parse_value(text):
+    """Returns int or float of a sample value. NaN and +Inf/-Inf have no
+    JSON representation and are kept as strings."""
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    value = float(text)
+    if math.isnan(value) or math.isinf(value):
+        return text
+    return value
+
+
+def glob_to_regex(pattern):
+    """Returns regular expression of a glob pattern, /pattern/ is a regular expression."""
+    if len(pattern) > 1 and pattern.startswith("/") and pattern.endswith("/"):
+        return pattern[1:-1]
+    return "".join(".*" if char == "*" else "." if char == "?" else re.escape(char) for char in pattern)
+
+
+def compile_patterns(patterns):
+    """Returns one regular expression matching the whole of a name against
+    any of the patterns, None if there are none."""
+    if not patterns:
+        return None
+    return re.compile("(?:%s)$" % "|".join("(?:%s)" % glob_to_regex(pattern) for pattern in patterns))
+
+
+class MetricFilter(object):
+    """Family name include and exclude patterns and sample label matchers,
+    compiled once. Raises ValueError for an invalid pattern or matcher."""
+
+    def __init__(self, include=(), exclude=(), label_matchers=()):
+        try:
+            self.include = compile_patterns(include)
+            self.exclude = compile_patterns(exclude)
+        except re.error as err:
+            raise ValueError("invalid metric pattern: %s" % err)
+        self.label_matchers = [self.compile_matcher(matcher) for matcher in label_matchers]
+
+    @staticmethod
+    def compile_matcher(matcher):
+        match = LABEL_MATCHER_PATTERN.match(matcher)
+        if match is None:
+            raise ValueError("invalid label matcher: %s" % matcher)
+        label, operator, value = match.groups()
+        if operator in ("=~", "!~"):
+            try:
+                value = re.compile("(?:%s)$" % value)
+            except re.error as err:
+                raise ValueError("invalid label matcher %s: %s" % (matcher, err))
+        return label, operator, value
+
+    def keep_family(self, name):
+        if self.include is not None and not self.include.match(name):
+            return False
+        return self.exclude is None or not self.exclude.match(name)
+
+    def keep_sample(self, labels):
+        """Returns True if the labels satisfy all matchers, a missing label
+        has the empty value."""
+        for label, operator, value in self.label_matchers:
+            actual = labels.get(label, "")
+            if operator == "=":
+                matched = actual == value
+            elif operator == "!=":
+                matched = actual != value
+            elif operator == "=~":
+                matched = value.match(actual) is not None
+            else:
+                matched = value.match(actual) is None
+            if not matched:
+                return False
+        return True
+
+
+class ExpositionParser(object):
+    """Parses the lines of an exporter response into metric families."""
+
+    def __init__(self, metric_filter=None):
+        self.metric_filter = metric_filter
+        # family name -> {"HELP": .., "TYPE": .., "metrics": [sample, ..]}
+        # of the families kept by the filter
+        self.families = {}
+        # names of all families seen, kept or dropped
+        self.family_names = set()
+        # sample name -> (family, suffix) of the names already seen, family
+        # is None for the samples of dropped families
+        self.sample_families = {}
+        self.invalid_lines = 0
+
+    def keep_family(self, name):
+        return self.metric_filter is None or self.metric_filter.keep_family(name)
+
+    def get_family(self, name):
+        family = self.families.get(name)
+        if family is None:
+            family = {"metrics": []}
+            self.families[name] = family
+        return family
+
+    def resolve(self, name):
+        """Returns family and suffix of a sample name, a sample which is not
+        part of a declared family starts a family of its own."""
+        resolved = self.sample_families.get(name)
+        if resolved is None:
+            family_name, suffix = name, None
+            if name not in self.family_names:
+                for candidate in SAMPLE_SUFFIXES:
+                    if name.endswith(candidate) and name[:-len(candidate)] in self.family_names:
+                        family_name, suffix = name[:-len(candidate)], candidate
+                        break
+            self.family_names.add(family_name)
+            if self.keep_family(family_name):
+                resolved = self.get_family(family_name), suffix
+            else:
+                resolved = None, None
+            self.sample_families[name] = resolved
+        return resolved
+
+    def parse_metadata(self, line):
+        match = METADATA_PATTERN.match(line)
+        if match is None:
+            return
+        keyword, name, text = match.groups()
+        self.family_names.add(name)
+        if not self.keep_family(name):
+            return
+        if keyword == "HELP":
+            self.get_family(name)["HELP"] = unescape(text or "")
+        else:
+            self.get_family(name)["TYPE"] = (text or "untyped").strip()
+
+    def parse_sample(self, line):
+        name_match = NAME_PATTERN.match(line)
+        if name_match is None:
+            self.invalid_lines += 1
+            return
+        family, suffix = self.resolve(name_match.group())
+        if family is None:
+            return
+        match = SAMPLE_PATTERN.match(line, name_match.end())
+        if match is None:
+            self.invalid_lines += 1
+            return
+        labels, value, _ = match.groups()
+        try:
+            value = parse_value(value)
+        except ValueError:
+            self.invalid_lines += 1
+            return
+        sample = {}
+        if labels:
+            for label, label_value in LABEL_PATTERN.findall(labels):
+                sample[label] = unescape(label_value)
+        if self.metric_filter is not None and not self.metric_filter.keep_sample(sample):
+            return
+        sample["value"] = value
+        if suffix:
+            sample["suffix"] = suffix
+        family["metrics"].append(sample)
+
+    def parse(self, lines):
+        """Parses lines, returns dictionary of family name -> family of the
+        families which have samples."""
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '#':
+                self.parse_metadata(line)
+            else:
+                self.parse_sample(line)
+        return dict((name, family) for name, family in self.families.items() if family["metrics"])
+
+
+def intern_text(text):
+    return intern(text) if type(text) is str else text
+
+
+def series_key(family_name, sample):
+    """Returns key of the series of a sample, the family name, suffix and
+    sorted label pairs, built from interned strings so that the keys of all
+    polls share them."""
+    labels = tuple(sorted((intern_text(label), intern_text(value)) for label, value in sample.items()
+                          if label not in SAMPLE_FIELDS))
+    return intern_text(family_name), sample.get("suffix"), labels
+
+
+class Series(object):
+    """Last value of a series."""
+    __slots__ = ('value', 'time', 'poll')
+
+    def __init__(self, value, time, poll):
+        self.value = value
+        self.time = time
+        self.poll = poll
+
+
+class SeriesStore(object):
+    """Series of an exporter between polls. Series not seen for max_idle_polls
+    polls are evicted."""
+
+    def __init__(self, max_idle_polls=SERIES_MAX_IDLE_POLLS):
+        self.max_idle_polls = max_idle_polls
+        # series key -> Series
+        self.series = {}
+        self.poll = 0
+
+    def update(self, families, now, suppress_unchanged=False):
+        """Adds the per second rate since the previous poll to the samples of
+        counter families, a counter lower than before was reset and counts
+        from 0. With suppress_unchanged, gauge samples equal to the previous
+        poll are removed, and families left without samples. Returns number
+        of samples removed."""
+        self.poll += 1
+        removed = 0
+        for name in list(families):
+            family = families[name]
+            kind = family.get("TYPE")
+            if kind != "counter" and not (kind == "gauge" and suppress_unchanged):
+                continue
+            kept = []
+            for sample in family["metrics"]:
+                value = sample["value"]
+                if isinstance(value, basestring) or (kind == "counter" and
+                                                     sample.get("suffix") not in COUNTER_SUFFIXES):
+                    kept.append(sample)
+                    continue
+                key = series_key(name, sample)
+                series = self.series.get(key)
+                if series is None:
+                    self.series[key] = Series(value, now, self.poll)
+                    kept.append(sample)
+                    continue
+                if kind == "counter":
+                    if now > series.time:
+                        increase = value - series.value if value >= series.value else value
+                        sample["rate"] = round(increase / (now - series.time), RATE_PRECISION)
+                    kept.append(sample)
+                elif value != series.value:
+                    kept.append(sample)
+                series.value = value
+                series.time = now
+                series.poll = self.poll
+            removed += len(family["metrics"]) - len(kept)
+            family["metrics"] = kept
+            if not kept:
+                del families[name]
+        if self.poll % self.max_idle_polls == 0:
+            self.evict()
+        return removed
+
+    def evict(self):
+        """Drops the series not seen for max_idle_polls polls."""
+        oldest = self.poll - self.max_idle_polls
+        for key in [key for key, series in self.series.items() if series.poll <= oldest]:
+            del self.series[key]
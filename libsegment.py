@@ -0,0 +1,255 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+Fixed size, memory mapped segment log used by write_json as an alternative
+to the ring of index.txt + N files.
+
+Layout of a segment file:
+    header  : magic, capacity, head, tail, first_seq, next_seq (HEADER_SIZE bytes)
+    records : length (4 bytes) + sequence number (8 bytes) + JSON payload
+
+Records are appended at head and the oldest records starting at tail are
+dropped when the writer needs their space. A record that does not fit in
+front of the end of the file is preceded by a wrap marker and written at the
+start of the data area. Readers remember the sequence number of the last
+record they have seen and tail the file without reopening it.
+
+Run as a script to print the records of a segment:
+    python libsegment.py <plugin directory or segment file> [--follow]
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+
+SEGMENT_FILE = "segment.log"
+SEGMENT_MAGIC = b"SFSEG001"
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024
+HEADER_FORMAT = "<8sQQQQQ"
+HEADER_SIZE = 64
+RECORD_FORMAT = "<IQ"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_FORMAT)
+WRAP_MARKER = 0xFFFFFFFF
+# ring layout written by write_json before the segment mode
+INDEX_FILE = "index.txt"
+LOG_EXTENSION = ".txt"
+
+
+class SegmentError(Exception):
+    """Raised when a segment file can not be used."""
+    pass
+
+
+class SegmentLog(object):
+    """Writer side of a segment file."""
+
+    def __init__(self, filename, capacity=DEFAULT_SEGMENT_SIZE):
+        self.filename = filename
+        created = not os.path.exists(filename)
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if created or os.fstat(self.fd).st_size < HEADER_SIZE:
+                os.ftruncate(self.fd, capacity)
+            self.capacity = os.fstat(self.fd).st_size
+            self.mm = mmap.mmap(self.fd, self.capacity)
+        except (IOError, OSError, ValueError, mmap.error):
+            os.close(self.fd)
+            raise
+        header = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if header[0] != SEGMENT_MAGIC:
+            self.head = self.tail = HEADER_SIZE
+            self.first_seq = self.next_seq = 0
+            self.write_header()
+        else:
+            (_, _, self.head, self.tail, self.first_seq, self.next_seq) = header
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+    def write_header(self):
+        struct.pack_into(HEADER_FORMAT, self.mm, 0, SEGMENT_MAGIC, self.capacity,
+                         self.head, self.tail, self.first_seq, self.next_seq)
+
+    def drop_oldest(self):
+        """Moves tail past the oldest record."""
+        length = struct.unpack_from(RECORD_FORMAT, self.mm, self.tail)[0]
+        self.tail += RECORD_HEADER_SIZE + length
+        self.first_seq += 1
+        self.wrap_tail()
+
+    def wrap_tail(self):
+        if self.tail + RECORD_HEADER_SIZE > self.capacity or \
+                struct.unpack_from(RECORD_FORMAT, self.mm, self.tail)[0] == WRAP_MARKER:
+            self.tail = HEADER_SIZE
+
+    def reserve(self, size):
+        """Returns the offset a record of size bytes is written at, dropping
+        the oldest records which overlap it."""
+        if self.head + size > self.capacity:
+            # records of the previous lap between head and the end of file
+            while self.first_seq < self.next_seq and self.tail >= self.head:
+                self.drop_oldest()
+            if self.head + RECORD_HEADER_SIZE <= self.capacity:
+                struct.pack_into(RECORD_FORMAT, self.mm, self.head, WRAP_MARKER, 0)
+            self.head = HEADER_SIZE
+            if self.first_seq == self.next_seq:
+                self.tail = HEADER_SIZE
+        while self.first_seq < self.next_seq and self.head <= self.tail < self.head + size:
+            self.drop_oldest()
+        if self.first_seq == self.next_seq:
+            self.tail = self.head
+        return self.head
+
+    def append(self, records):
+        """Appends a list of serialized records and publishes them with a
+        single header update. Returns the number of records written."""
+        written = 0
+        for payload in records:
+            if not isinstance(payload, bytes):
+                payload = payload.encode("utf-8")
+            size = RECORD_HEADER_SIZE + len(payload)
+            if size > self.capacity - HEADER_SIZE:
+                continue
+            offset = self.reserve(size)
+            struct.pack_into(RECORD_FORMAT, self.mm, offset, len(payload), self.next_seq)
+            self.mm[offset + RECORD_HEADER_SIZE:offset + size] = payload
+            self.head = offset + size
+            self.next_seq += 1
+            written += 1
+        self.write_header()
+        return written
+
+
+class SegmentReader(object):
+    """Reader side of a segment file, keeps the file mapped between reads."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.last_seq = None
+
+    def close(self):
+        self.mm.close()
+
+    def header(self):
+        header = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if header[0] != SEGMENT_MAGIC:
+            raise SegmentError("%s is not a segment file" % self.filename)
+        return header[1:]
+
+    def records(self, since=None):
+        """Returns (seq, payload) of all records with a sequence number
+        greater than since, oldest first."""
+        capacity, _, tail, first_seq, next_seq = self.header()
+        result = []
+        offset = tail
+        seq = first_seq
+        while seq < next_seq:
+            if offset + RECORD_HEADER_SIZE > capacity:
+                offset = HEADER_SIZE
+                continue
+            length, rec_seq = struct.unpack_from(RECORD_FORMAT, self.mm, offset)
+            if length == WRAP_MARKER:
+                offset = HEADER_SIZE
+                continue
+            if rec_seq != seq or offset + RECORD_HEADER_SIZE + length > capacity:
+                # overwritten by the writer while reading
+                break
+            if since is None or seq > since:
+                result.append((seq, self.mm[offset + RECORD_HEADER_SIZE:
+                                            offset + RECORD_HEADER_SIZE + length]))
+            offset += RECORD_HEADER_SIZE + length
+            seq += 1
+        # drop records the writer reclaimed while they were being copied
+        first_seq = self.header()[3]
+        return [record for record in result if record[0] >= first_seq]
+
+    def tail(self):
+        """Returns records written since the previous call."""
+        records = self.records(self.last_seq)
+        if records:
+            self.last_seq = records[-1][0]
+        return records
+
+    def latest(self):
+        """Returns the payload of the newest record or None."""
+        _, _, _, first_seq, next_seq = self.header()
+        if first_seq == next_seq:
+            return None
+        records = self.records(next_seq - 2)
+        return records[-1][1] if records else None
+
+
+def segment_path(dirname):
+    return os.path.join(dirname, SEGMENT_FILE)
+
+
+def migrate_ring(dirname, segment):
+    """Copies the documents of the index.txt ring layout of dirname into
+    segment, oldest first. Ring files are left in place."""
+    index_path = os.path.join(dirname, INDEX_FILE)
+    try:
+        with open(index_path) as index_file:
+            index = int(index_file.readline())
+            max_entries = int(index_file.readline())
+    except (IOError, ValueError):
+        return 0
+    if index < 0:
+        return 0
+    records = []
+    for offset in range(1, max_entries + 1):
+        log_path = os.path.join(dirname, str((index + offset) % max_entries) + LOG_EXTENSION)
+        try:
+            with open(log_path) as log_file:
+                records.extend(line.rstrip("\n") for line in log_file if line.strip())
+        except IOError:
+            continue
+    return segment.append(records)
+
+
+def open_segment(dirname, capacity=DEFAULT_SEGMENT_SIZE):
+    """Returns the SegmentLog of dirname, creating it and migrating the
+    documents of an existing index.txt ring on first use."""
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    filename = segment_path(dirname)
+    created = not os.path.exists(filename)
+    segment = SegmentLog(filename, capacity)
+    if created:
+        migrate_ring(dirname, segment)
+    return segment
+
+
+def main(argv):
+    if len(argv) < 2:
+        sys.stderr.write("usage: %s <plugin directory or segment file> [--follow]\n" % argv[0])
+        return 1
+    filename = argv[1]
+    if os.path.isdir(filename):
+        filename = segment_path(filename)
+    reader = SegmentReader(filename)
+    try:
+        while True:
+            for _, payload in reader.tail():
+                sys.stdout.write(payload.decode("utf-8") + "\n")
+            sys.stdout.flush()
+            if "--follow" not in argv:
+                break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
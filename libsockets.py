@@ -0,0 +1,146 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to read the tcp/udp socket tables of the kernel from
+/proc/net/{tcp,tcp6,udp,udp6} or the sock_diag netlink interface
+"""
+
+import os
+import socket
+import struct
+from collections import namedtuple
+
+PROC_NET = "/proc/net"
+TCP_STATES = {
+    1: "ESTABLISHED", 2: "SYN_SENT", 3: "SYN_RECV", 4: "FIN_WAIT1",
+    5: "FIN_WAIT2", 6: "TIME_WAIT", 7: "CLOSE", 8: "CLOSE_WAIT",
+    9: "LAST_ACK", 10: "LISTEN", 11: "CLOSING"
+}
+# name of the table, address family, ip protocol
+PROTOCOLS = (("tcp", socket.AF_INET, socket.IPPROTO_TCP),
+             ("tcp6", socket.AF_INET6, socket.IPPROTO_TCP),
+             ("udp", socket.AF_INET, socket.IPPROTO_UDP),
+             ("udp6", socket.AF_INET6, socket.IPPROTO_UDP))
+
+# sock_diag netlink constants, linux/netlink.h, linux/sock_diag.h, linux/inet_diag.h
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+NLMSG_HEADER = struct.Struct("=IHHII")
+# family, protocol, ext, pad, states, inet_diag_sockid (ports in network byte order)
+INET_DIAG_REQ_V2 = struct.Struct("=BBBBIHH16s16sIII")
+# family, state, timer, retrans, inet_diag_sockid, expires, rqueue, wqueue, uid, inode
+INET_DIAG_MSG = struct.Struct("=BBBBHH16s16sIIIIIIII")
+ALL_STATES = 0xffffffff
+
+SocketEntry = namedtuple(
+    'socket', 'protocol state recv_q send_q local_address local_port foreign_address foreign_port inode')
+
+
+class AddressCache(object):
+    """Decodes the hex addresses of /proc/net tables, addresses repeat a lot
+    so each one is converted only once."""
+
+    def __init__(self):
+        self.addresses = {}
+
+    def decode(self, address, family):
+        text = self.addresses.get(address)
+        if text is None:
+            if family == socket.AF_INET:
+                packed = struct.pack("<I", int(address, 16))
+            else:
+                packed = struct.pack("<IIII", *[int(address[i:i + 8], 16) for i in range(0, 32, 8)])
+            text = socket.inet_ntop(family, packed)
+            self.addresses[address] = text
+        return text
+
+
+def read_proc_table(protocol, family, cache):
+    """Returns list of SocketEntry of /proc/net/<protocol>."""
+    entries = []
+    try:
+        with open(os.path.join(PROC_NET, protocol)) as table:
+            lines = table.read().splitlines()
+    except IOError:
+        return entries
+    decode = cache.decode
+    for line in lines[1:]:
+        fields = line.split()
+        if len(fields) < 10:
+            continue
+        local, lport = fields[1].split(":")
+        remote, rport = fields[2].split(":")
+        tx_queue, rx_queue = fields[4].split(":")
+        entries.append(SocketEntry(protocol, TCP_STATES.get(int(fields[3], 16), fields[3]),
+                                   int(rx_queue, 16), int(tx_queue, 16),
+                                   decode(local, family), int(lport, 16),
+                                   decode(remote, family), int(rport, 16), int(fields[9])))
+    return entries
+
+
+def read_netlink_table(protocol, family, ipproto):
+    """Returns list of SocketEntry of one family/protocol using sock_diag,
+    None if the netlink interface can not be used."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+    except (AttributeError, socket.error):
+        return None
+    entries = []
+    try:
+        request = INET_DIAG_REQ_V2.pack(family, ipproto, 0, 0, ALL_STATES,
+                                        0, 0, b"\0" * 16, b"\0" * 16, 0, 0, 0)
+        header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY,
+                                   NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        sock.sendall(header + request)
+        addr_len = 4 if family == socket.AF_INET else 16
+        done = False
+        while not done:
+            data = sock.recv(65536)
+            if not data:
+                break
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, msg_type = NLMSG_HEADER.unpack_from(data, offset)[:2]
+                if msg_type == NLMSG_DONE:
+                    done = True
+                    break
+                if msg_type == NLMSG_ERROR or length < NLMSG_HEADER.size:
+                    return None
+                (_, state, _, _, sport, dport, src, dst, _, _, _,
+                 _, rqueue, wqueue, _, inode) = INET_DIAG_MSG.unpack_from(data, offset + NLMSG_HEADER.size)
+                if TCP_STATES.get(state) == "LISTEN":
+                    # sock_diag reports the listen backlog as write queue,
+                    # /proc/net/tcp and netstat report 0
+                    wqueue = 0
+                entries.append(SocketEntry(protocol, TCP_STATES.get(state, str(state)), rqueue, wqueue,
+                                           socket.inet_ntop(family, src[:addr_len]), socket.ntohs(sport),
+                                           socket.inet_ntop(family, dst[:addr_len]), socket.ntohs(dport),
+                                           inode))
+                # messages are aligned to 4 bytes
+                offset += (length + 3) & ~3
+    except (socket.error, struct.error):
+        return None
+    finally:
+        sock.close()
+    return entries
+
+
+def read_sockets(use_netlink=False):
+    """Returns list of SocketEntry of all tcp/udp sockets. With use_netlink the
+    tables are dumped over sock_diag, falling back to /proc/net per table."""
+    cache = AddressCache()
+    entries = []
+    for protocol, family, ipproto in PROTOCOLS:
+        table = read_netlink_table(protocol, family, ipproto) if use_netlink else None
+        if table is None:
+            table = read_proc_table(protocol, family, cache)
+        entries.extend(table)
+    return entries
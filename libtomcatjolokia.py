@@ -17,6 +17,8 @@ import threading
 import collectd
 from pyjolokia import Jolokia
 from contextlib import closing
+from libjvmregistry import REGISTRY
+from libjolokia import AGENTS, JOLOKIA_TIMEOUT
 
 #constants
 JOLOKIA_PATH = "/opt/sfapm/collectd/plugins/"
@@ -78,29 +80,17 @@ class JolokiaClient(object):
 
     def get_pid(self):
         """Get PIDs of the java process."""
-        pid_cmd = self.java_path + "/jcmd | awk '{print $1 \" \" $2}' | grep -w \"%s\"" % self.process_name
-        #collectd.error("PID_CMD = %s" % pid_cmd)
-        pids, err, _ = get_cmd_output(pid_cmd)
-        if err:
-            collectd.error("Plugin %s: Error in collecting pid for process %s: %s" % (self.plugin_name, self.process_name, err))
-            return False
-        pids = pids.splitlines()
-        pid_list = []
-        for pid in pids:
-            if pid is not "":
-                pidval = pid.split()
-                pid_list.append(pidval[0])
+        pid_list = [str(jvm.pid) for jvm in REGISTRY.find(self.process_name)]
         collectd.debug("Plugin %s: PID(s) of %s process: %s" % (self.plugin_name, self.process_name, pid_list))
         return pid_list
 
     def get_uid_of_pid(self, pid):
         """Jolokia needs to be run with same user of the process attached"""
-        uid_cmd = "awk '/^Uid:/{print $2}' /proc/%s/status" % pid
-        uid, err, _ = get_cmd_output(uid_cmd)
-        if err:
-            collectd.error("Plugin %s: Failed to retrieve uid for pid %s, %s" % (self.plugin_name, pid, err))
+        jvm = REGISTRY.get(pid)
+        if jvm is None:
+            collectd.error("Plugin %s: Failed to retrieve uid for pid %s, process is not running" % (self.plugin_name, pid))
             return False
-        return uid.strip()
+        return str(jvm.uid)
 
     def run_jolokia_cmd(self, cmd, pid, port=None):
         """Common logic to run jolokia cmds."""
@@ -112,9 +102,22 @@ class JolokiaClient(object):
             jolokia_cmd += " --port=%s" % port
         return get_cmd_output(jolokia_cmd)
 
-    @synchronized
     def get_jolokia_port(self, pid):
+        """Returns port of the jolokia agent of pid, attaching one only when no
+        registered agent answers."""
+        port = AGENTS.get_port(pid)
+        if port and AGENTS.is_alive(pid, port):
+            return port
+        return self.attach_jolokia(pid)
+
+    @synchronized
+    def attach_jolokia(self, pid):
         """check if jmx jolokia agent already running, if running get port"""
+        # another plugin may have attached while waiting for the lock
+        port = AGENTS.get_port(pid)
+        if port and AGENTS.is_alive(pid, port):
+            return port
+        AGENTS.unregister(pid)
         status, err, ret = self.run_jolokia_cmd("status", pid)
         if err or ret:
             port = self.get_free_port()
@@ -131,22 +134,24 @@ class JolokiaClient(object):
                     return False
             else:
                 collectd.info("Plugin %s: Jolokia client started for pid %s and listening in port %s" % (self.plugin_name, pid, port))
+                AGENTS.register(pid, port)
                 return port
 
         # jolokia id already running and return port
         jolokiaip = status.splitlines()[1]
         port = re.findall('\d+', jolokiaip.split(':')[2])[0]
         collectd.info("Plugin %s: Jolokia client is already running for pid %s in IP %s" % (self.plugin_name, pid, jolokiaip))
+        AGENTS.register(pid, port)
         return port
 
     def connection_available(self, port):
         """Check if jolokia client is up."""
         try:
             jolokia_url = "http://127.0.0.1:%s/jolokia/version" % port
-            resp = requests.get(jolokia_url)
+            resp = AGENTS.session.get(jolokia_url, timeout=JOLOKIA_TIMEOUT)
             if resp.status_code == 200:
                 collectd.debug("Plugin %s: Jolokia Connection available in port %s" % (self.plugin_name, port))
                 return True
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.RequestException:
             return False
 
@@ -158,42 +158,19 @@ class LinuxStats(object):
 
 
 
-    def get_disk_info(self):
-        """Function to get name, type, size and mountpoint info of disk and partition."""
-        (lsblk, err) = utils.get_cmd_output(
-            'lsblk -bno  KNAME,TYPE,SIZE,MOUNTPOINT | grep \'disk\|part\'')
-        if err:
-            collectd.error('Plugin disk_stat: error in lsblk command')
-            return None
-
-        disk_info = re.split('\n', lsblk)
-        return disk_info
-
     def get_disk_static_data(self):
         """Returns dictionary with values of NAME, TYPE, CAPACITY and MOUNTPOINT."""
         dict_disk = {}
-        list_disk = self.get_disk_info()
-        if not list_disk:
+        list_disk = libdiskstat.get_disk_info()
+        if list_disk == FAILURE or not list_disk:
             return None
 
-        index = 0
-        num_lines = len(list_disk)
-
-        while index < num_lines:
-            line = list_disk[index]
-            if line:
-                parts = re.split(r'\s+', line.strip())
-                disk = {DISK_TYPE: parts[1], CAPACITY: round(
-                    float(parts[2]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)}
-                if len(parts) == 4:
-                    disk[MOUNTPOINT] = parts[3]
-                else:
-                    disk[MOUNTPOINT] = []
-                if SWAP not in disk[MOUNTPOINT]:
-                    dict_disk[parts[0]] = disk
-                index += 1
-            else:
-                break
+        for name, disk_type, size, mountpoint in list_disk:
+            disk = {DISK_TYPE: disk_type, CAPACITY: round(
+                float(size) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)}
+            disk[MOUNTPOINT] = mountpoint if mountpoint else []
+            if SWAP not in disk[MOUNTPOINT]:
+                dict_disk[name] = disk
 
         return dict_disk
 
@@ -229,44 +206,15 @@ class LinuxStats(object):
 
     def add_agg_capacity(self):
         """Function to get total capacity."""
-        lsblk, err = utils.get_cmd_output(
-            "lsblk -nbo KNAME,TYPE,SIZE | grep disk | grep -v fd | awk '{print $3}'")
-        if err:
-            collectd.error("Plugin disk_stat : error in lsblk command")
+        total_sum = libdiskstat.get_total_capacity()
+        if total_sum == FAILURE:
+            collectd.error("Plugin disk_stat : error in reading block devices")
             return None
-
-        sdlines = re.split("\n", lsblk)
-        num_lines = len(sdlines)
-        index = 0
-        total_sum = 0
-        while index < num_lines:
-            line = sdlines[index]
-            if line:
-                total_sum += int(line)
-                index += 1
-            else:
-                index += 1
         return round(float(total_sum) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)
 
     def add_agg_usage(self):
         """Function to get total usage."""
-        (df_out, err) = utils.get_cmd_output(
-            "df -kl |awk '/^\/dev\//' | awk '{print $3}'")
-        if err:
-            collectd.error('Plugin disk_stat: error in df command')
-            return None
-
-        splines = re.split('\n', df_out)
-        unum_lines = len(splines)
-        uindex = 0
-        usage_sum = 0
-        while uindex < unum_lines:
-            line = splines[uindex]
-            if line:
-                usage_sum += int(line)  # usage_sum is in Kb
-                uindex += 1
-            else:
-                uindex += 1
+        usage_sum = libdiskstat.get_total_usage_kb()  # usage_sum is in Kb
         return round(float((usage_sum * FACTOR)) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)
 
     def add_disk_aggregate(self, dict_disks):
@@ -4,9 +4,10 @@
 *
 ********************
 """
-"""Python plugin for collectd to get list of open files and related stats using lsof command"""
+"""Python plugin for collectd to get list of open files and related stats from /proc or using lsof command"""
 
 # !/usr/bin/python
+import os
 import signal
 import json
 import time
@@ -14,8 +15,13 @@ import collectd
 
 # user imports
 import utils
+import libopenfiles
 from constants import *
 
+# collectors of open files
+PROC_COLLECTOR = "proc"
+LSOF_COLLECTOR = "lsof"
+
 
 class LsofStats(object):
     """Plugin object will be created only once and collects available info from lsof command every interval."""
@@ -23,12 +29,25 @@ class LsofStats(object):
     def __init__(self):
         """Initializes interval and previous dictionary variable."""
         self.interval = DEFAULT_INTERVAL
+        self.columnar = False
+        self.collector = PROC_COLLECTOR
+        self.time_budget = 2.0
+        self.full_scan_interval = 10
+        self.scanner = None
 
     def config(self, cfg):
         """Initializes variables from conf files."""
         for children in cfg.children:
             if children.key == INTERVAL:
                 self.interval = children.values[0]
+            if children.key == COLUMNAR:
+                self.columnar = str(children.values[0]).lower() == "true"
+            if children.key == "collector":
+                self.collector = children.values[0]
+            if children.key == "time_budget":
+                self.time_budget = float(children.values[0])
+            if children.key == "full_scan_interval":
+                self.full_scan_interval = int(children.values[0])
 
     def conv_b_to_kb(self, input_bytes):
         if input_bytes is None:
@@ -101,6 +120,24 @@ class LsofStats(object):
                 break
         return result
 
+    def proc_command(self):
+        """
+        Returns dictionary with information regarding open files read from /proc
+        """
+        if self.scanner is None:
+            self.scanner = libopenfiles.OpenFileScanner(self.time_budget, self.full_scan_interval)
+        result = []
+        for row in self.scanner.poll():
+            lsof_res = dict(row)
+            lsof_res["size"] = self.conv_b_to_kb(row["size"])
+            name = row["name"]
+            for c in "[]{}()":
+                name = name.replace(c, "")
+            lsof_res["name"] = name
+            result.append(lsof_res)
+        collectd.debug("Plugin lsofstats: /proc scan %s" % self.scanner.stats)
+        return result
+
     def add_common_params(self, lsof_res):
         """Adds TIMESTAMP, PLUGIN, PLUGIN_INS to dictionary."""
         timestamp = int(round(time.time() * 1000))
@@ -115,7 +152,10 @@ class LsofStats(object):
 
     def collect_data(self):
         """Validates if dictionary is not null.If null then returns None."""
-        lsof_res = self.lsof_command()
+        if self.collector == LSOF_COLLECTOR or not os.path.isdir("/proc/self/fd"):
+            lsof_res = self.lsof_command()
+        else:
+            lsof_res = self.proc_command()
         if not lsof_res:
             collectd.error("Plugin lsofstats: Unable to fetch lsof Summary")
             return None
@@ -129,11 +169,11 @@ class LsofStats(object):
     def dispatch_data(self, lsof_res):
         """Dispatches dictionary to collectd."""
         collectd.info("Plugin lsofstats: Successfully sent to collectd.")
-        collectd.info("Plugin lsofstats: Values dispatched = " +
-                       json.dumps(lsof_res))
-        for result in lsof_res:
-            collectd.info("Dump: %s" % result)
-            utils.dispatch(result)
+        collectd.debug("Plugin lsofstats: Documents dispatched = %d" % len(lsof_res))
+        if self.columnar:
+            utils.dispatch_columnar(lsof_res)
+        else:
+            utils.dispatch_batch(lsof_res)
 
 
     def read(self):
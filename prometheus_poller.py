@@ -11,13 +11,27 @@ import json
 import time
 import collectd
 import requests
-from copy import deepcopy
-import re
 import traceback
 
 # user imports
 import utils
 from constants import *
+from libprometheus import ExpositionParser, MetricFilter, SeriesStore
+from libpidexecutor import PidExecutor
+
+MAX_SCRAPE_WORKERS = 8
+# text format of the exporters, compressed with gzip on the wire
+SCRAPE_HEADERS = {'Accept': 'text/plain;version=0.0.4', 'Accept-Encoding': 'gzip'}
+
+
+def target_url(target):
+    """Returns metrics URL of a target, given as URL, host:port or port."""
+    if "://" in target:
+        return target
+    if ":" not in target:
+        target = "localhost:%s" % target
+    return "http://%s/metrics" % target
+
 
 class PrometheusStat(object):
     """Plugin object will be created only once and collects JMX statistics info every interval."""
@@ -28,21 +42,24 @@ class PrometheusStat(object):
         self.plugin_name = conf["name"]
         self.host = 'localhost'
         self.port = conf["port"]
-
-    def connection_available(self):
-        """
-
-        :return:
-        """
-        url = "http://{}:{}".format(self.host, self.port)
-        headers = {'content-type': 'application/json'}
+        # exporters scraped concurrently, the local port when none are configured
+        self.targets = [str(target) for target in conf.get(TARGETS) or ["%s:%s" % (self.host, self.port)]]
+        self.timeout = float(conf.get(SCRAPE_TIMEOUT) or self.interval)
+        self.executor = PidExecutor(self.plugin_name, max_workers=MAX_SCRAPE_WORKERS,
+                                    pid_timeout=self.timeout, item_name="target")
+        # target -> requests.Session keeping the connection to the exporter alive
+        self.sessions = {}
+        # target -> SeriesStore of the previous values of its series
+        self.series_stores = {}
+        self.suppress_unchanged = str(conf.get(SUPPRESS_UNCHANGED, "false")).lower() == "true"
+        # metric families mapped as nested in elasticsearch, read from it on the first poll
+        self.mapped_families = None
         try:
-            resp = requests.get(url, headers=headers, timeout=60)
-        except Exception as err:
-            collectd.info("Error in connecting service to %s in %s due to %s" %(self.host, self.port, str(err)))
-            return False
-        if resp.status_code == 200:
-            return True
+            self.metric_filter = MetricFilter(conf.get(INCLUDE_METRICS, ()), conf.get(EXCLUDE_METRICS, ()),
+                                              conf.get(LABEL_FILTER, ()))
+        except ValueError as err:
+            collectd.error("Plugin %s: ignoring metric filter configuration: %s" % (self.plugin_name, str(err)))
+            self.metric_filter = None
 
     def get_elastic_search_details(self):
         try:
@@ -57,7 +74,7 @@ class PrometheusStat(object):
         except IOError:
             collectd.error("Could not read file: /opt/sfapm/collectd/conf/elasticsearch.conf")
 
-    def add_common_params(self, prometheus_dict):
+    def add_common_params(self, prometheus_dict, target):
         """Adds TIMESTAMP, PLUGIN, PLUGITYPE to dictionary."""
         timestamp = int(round(time.time() * 1000))
         for details_type, details in prometheus_dict.items():
@@ -65,37 +82,54 @@ class PrometheusStat(object):
             details[PLUGIN] = self.plugin_name
             details[PLUGINTYPE] = details_type
             details[ACTUALPLUGINTYPE] = self.plugin_name
+            details[PROMETHEUS_TARGET] = target
 
         collectd.info("Plugin Prometheus: Added common parameters successfully")
 
-    def poll_metrics(self):
+    def poll_metrics(self, target):
         '''
         func: Poll prometheus metrics from exporter running on the endpoint
         :return: prometheus metrics exposed by the exporter.
         '''
+        url = target_url(target)
+        session = self.sessions.get(target)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(SCRAPE_HEADERS)
+            self.sessions[target] = session
         try:
-            collectd.info("Establishing connection with prometheus exporter %s " % (self.plugin_name))
-            url = "http://{}:{}/metrics".format(self.host, self.port)
-            headers = {'content-type': 'application/json'}
+            collectd.info("Sending GET request for prometheus exporter %s at %s." % (self.plugin_name, url))
+            resp = session.get(url, timeout=self.timeout)
         except Exception as err:
-            collectd.error("Error constructing URL for prometheus exporter %s" % (self.plugin_name))
-            return
-
-        try:
-            collectd.info("Sending GET request for prometheus exporter %s." % (self.plugin_name))
-            resp = requests.get(url, headers=headers, timeout=60)
-        except Exception as err:
-            collectd.error("Error getting metrics for prometheus server %s." % (self.plugin_name))
-            collectd.error("%s", str(err))
+            # reconnect on the next poll
+            self.sessions.pop(target).close()
+            collectd.error("Error getting metrics for prometheus server %s at %s: %s"
+                           % (self.plugin_name, url, str(err)))
             return
 
         if resp.status_code == 200:
-            self.prom_response = resp.content
-            collectd.info("Successfully polled for metric %s" % (self.plugin_name))
+            collectd.info("Successfully polled for metric %s at %s" % (self.plugin_name, url))
             return resp.content
 
-        collectd.error("Response code for metrics request for prometheus server %s is %s."
-                       % (self.plugin_name, resp.status_code))
+        collectd.error("Response code for metrics request for prometheus server %s at %s is %s."
+                       % (self.plugin_name, url, resp.status_code))
+
+    def scrape(self, target):
+        """Returns the converted metrics of a target, None if it could not be scraped.
+        Counter samples get their rate since the previous scrape of the target."""
+        prometheus_metrics = self.poll_metrics(target)
+        if not prometheus_metrics:
+            return None
+        exporter_metrics = self.convert_metrics(prometheus_metrics)
+        if exporter_metrics:
+            now = time.time()
+            store = self.series_stores.setdefault(target, SeriesStore())
+            for families in exporter_metrics.values():
+                removed = store.update(families, now, self.suppress_unchanged)
+                if removed:
+                    collectd.info("Plugin %s: left out %s unchanged gauge samples of %s"
+                                  % (self.plugin_name, removed, target))
+        return exporter_metrics
 
     def convert_metrics(self, prometheus_metrics):
         """
@@ -103,172 +137,113 @@ class PrometheusStat(object):
         :param plugin_detail:
         :return:
         """
-        # TBA : Convert only those metrics to Json object which is mentioned
-        # in prometheus_regex.json.
+        # only the families and samples kept by the metric filter are converted
         doc_type = self.plugin_name.split('prometheus')[1] + 'Stats'
         collectd.info("Converting the metrics to Json format for further processing for plugin %s." % (self.plugin_name))
-        prometheus_json = {}
-
-        prometheus_json[doc_type] = {}
-        metric_dict= {}
-        metric_dict["metrics"] = []
-        document_name = None
-        count = 0
-        int_pattern = re.compile(r'\d+')
-        float_pattern = re.compile(r'(\d+\.\d+(e\+\d+|e\-\d+)?|\d+(e\+\d+|e\-\d+))')
-        for line in prometheus_metrics.splitlines():
-            try:
-                count += 1
-                if "# HELP" in line:
-                    document_name = line.split(" ")[2]
-                    collectd.info("Converting metrics to json for plugin %s for document %s"
-                                  % (self.plugin_name, document_name))
-                    prometheus_json[doc_type][document_name] = {}
-                    metric_dict["HELP"] = " ".join(line.split(" ")[3:])
-                    continue
-
-                elif "# TYPE" in line:
-                    metric_dict["TYPE"] = line.split(" ")[3]
-                    continue
-
-                else:
-                    metric = {}
-                    if "{" in line:
-                        if "}" in line:
-                            items = line.split("{")[1].split("} ")[0].split(",")
-                        else:
-                            items = line.split("{")[1].split(" ")[0].strip("}").split(",")
-
-                        for item in items:
-                            # metric[re.sub('[^A-Za-z0-9.]+', '', item.split("=")[0])] = \
-                            #     re.sub('[^A-Za-z0-9.]+', '', item.split("=")[1])
-                            metric[re.sub('[^A-Za-z0-9/()-_.]+', '', item.split("=")[0])] = \
-                                re.sub('[^A-Za-z0-9/()-_.]+', '', item.split("=")[1])
-                    if "}" in line:
-                        value = line.split("} ")[1]
-                        if float_pattern.search(value):
-                            value = float(value)
-                        elif int_pattern.search(value):
-                            value = int(value)
-                        metric["value"] = value
-                    else:
-                        value = line.split(" ")[1]
-                        if float_pattern.search(value):
-                            value = float(value)
-                        elif int_pattern.search(value):
-                            value = int(value)
-                        metric["value"] = value
-                    metric_dict["metrics"].append(metric)
-
-                    if count == len(prometheus_metrics.splitlines()):
-                        prometheus_json[doc_type][document_name] = metric_dict
-                        break
-
-                    elif "# HELP" in prometheus_metrics.splitlines()[count]:
-                        prometheus_json[doc_type][document_name] = metric_dict
-                        metric_dict = {}
-                        metric_dict["metrics"] = []
-
-            except Exception as err:
-                collectd.error("Error converting file based metrics for \
-                                prometheus plugin %s to dictionary format." % (self.plugin_name))
-                return
+        parser = ExpositionParser(self.metric_filter)
+        try:
+            families = parser.parse(prometheus_metrics.splitlines())
+        except Exception as err:
+            collectd.error("Error converting file based metrics for \
+                            prometheus plugin %s to dictionary format: %s" % (self.plugin_name, str(err)))
+            return
+        if parser.invalid_lines:
+            collectd.error("Plugin Prometheus: skipped %s invalid lines in metrics of %s"
+                           % (parser.invalid_lines, self.plugin_name))
 
         collectd.info("Successfully converted the metrics collected \
                         for plugin %s to dictionary format" % (self.plugin_name))
-        return prometheus_json
+        return {doc_type: families}
 
-    def generate_es_mapping(self, es_host, es_port, es_index):
-
-        url = "http://{}:{}/metrics".format(self.host, self.port)
+    def get_mapped_families(self, es_host, es_port, es_index):
+        """Returns set of the metric families already mapped in the index, None
+        if elasticsearch could not be reached."""
+        es_url = "http://{}:{}/{}/_mapping".format(es_host, es_port, es_index + "_read")
         headers = {'content-type': 'application/json'}
-        index_avail_check = 0
-        try:
-            resp = requests.get(url, headers=headers, timeout=60)
-        except Exception as err:
-            collectd.error("Error in Retrieving metrics from prometheus server for generating mapping of nested datatypes")
-        if resp.status_code == 200:
-            collectd.info("Successfully polled metrics for host %s for generating mapping of nested type" % (self.host))
-        response = resp.content
-        es_url = "http://{}:{}/{}/_mapping".format(es_host, es_port, es_index+ "_read")
         try:
             es_resp = requests.get(es_url, headers=headers, timeout=60)
         except Exception as err:
-            collectd.error("Error in Retrieving es index info")
-        custommap = {}
-        prevmetrickey = ""
-        check = 0
-
-        for line in response.splitlines():
-            if not line.startswith("#"):
-                if "{" in line:
-                    metrickey = line.split('{', 1)[0]
-                else:
-                    metrickey = line.split(" ")[0]
-
-                tempmap = {metrickey: {"properties": {"metrics": {"type": "nested"}}}}
-                if check == 0:
-                    custommap["properties"] = tempmap
-                    check = 1
-                if(prevmetrickey != metrickey):
-                    custommap["properties"].update(tempmap)
-                prevmetrickey = metrickey
-                test_metric = metrickey
-        if es_resp.status_code == 200:
-            es_response = json.loads(es_resp.content)
-            try:
-                for res_metrics in es_response[es_index]["mappings"]["_doc"]["properties"]:
-                    if res_metrics == test_metric:
-                        index_avail_check = 1
-                        collectd.info("Nested Index Already Mapped")
+            collectd.error("Error in Retrieving es index info: %s" % str(err))
+            return None
+        if es_resp.status_code != 200:
+            # index not created yet, every family is new
+            return set()
+        families = set()
+        for index_info in json.loads(es_resp.content).values():
+            mappings = index_info.get("mappings", {})
+            families.update(mappings.get("_doc", mappings).get("properties", {}))
+        return families
+
+    def generate_es_mapping(self, es_host, es_port, es_index, families):
+        """Maps the metrics of the families not mapped yet as nested, the mapped
+        families are read from elasticsearch once and kept in memory."""
+        if self.mapped_families is None:
+            self.mapped_families = self.get_mapped_families(es_host, es_port, es_index)
+            if self.mapped_families is None:
+                return
+        new_families = sorted(set(families) - self.mapped_families)
+        if not new_families:
+            return
 
-            except KeyError as error:
-                index_avail_check = 0
+        headers = {'content-type': 'application/json'}
+        target_setting_url = "http://{}:{}/{}/_settings".format(es_host, es_port, es_index)
+        sett_data = {"index.mapping.nested_fields.limit": "5000", "index.mapping.total_fields.limit": "8000"}
+        requests.put(target_setting_url, data=json.dumps(sett_data), headers=headers, timeout=60)
+
+        custommap = {"properties": {}}
+        for family in new_families:
+            custommap["properties"][family] = {"properties": {"metrics": {"type": "nested"}}}
+        es_url_doc = "http://{}:{}/{}/_mappings/_doc".format(es_host, es_port, es_index + "_write")
+        resp = requests.post(es_url_doc, data=json.dumps(custommap), headers=headers, timeout=60)
+        if resp.status_code == 200:
+            self.mapped_families.update(new_families)
+            collectd.info("Nested Datatype Mapped to ES for %s new metric families" % len(new_families))
         else:
-            index_avail_check = 0
-
-        if index_avail_check == 0:
-            headers = {'content-type': 'application/json'}
-            es_url_doc = "http://{}:{}/{}/_mappings/_doc".format(es_host, es_port,es_index+ "_write")
-            resp = requests.post(es_url_doc, data=json.dumps(custommap), headers=headers, timeout=60)
-            collectd.info("Nested Datatype Mapped to ES")
+            collectd.error("Error in mapping nested datatype to ES, response code %s" % resp.status_code)
 
     def collect_data(self):
-        """
+        """Scrapes all targets concurrently, returns list of the converted
+        metrics of the targets which answered."""
+        exporter_metrics = []
+        families = set()
+        for target, metrics in self.executor.run(self.scrape, self.targets, float(self.interval)):
+            if not metrics:
+                continue
+            for details in metrics.values():
+                families.update(details)
+            self.add_common_params(metrics, target)
+            exporter_metrics.append(metrics)
+        if not exporter_metrics:
+            collectd.error("Plugin prometheus: Unable to fetch data for Prometheus.")
+            return exporter_metrics
 
-        :return:
-        """
         try:
-
-            prometheus_metrics = self.poll_metrics()
-            if not prometheus_metrics:
-                collectd.error("Plugin prometheus: Unable to fetch data for Prometheus.")
-                return
-
-            self.exporter_metrics = self.convert_metrics(prometheus_metrics)
-            self.add_common_params(self.exporter_metrics)
             es_host, es_port, es_index = self.get_elastic_search_details()
-            self.generate_es_mapping(es_host, es_port, es_index)
-            target_setting_url = "http://{}:{}/{}/_settings".format(es_host, es_port, es_index)
-            sett_data = {"index.mapping.nested_fields.limit": "5000", "index.mapping.total_fields.limit": "8000"}
-            headers = {'content-type': 'application/json'}
-            sett_resp = requests.put(target_setting_url, data=json.dumps(sett_data), headers=headers, timeout=60)
-            return self.exporter_metrics
+            self.generate_es_mapping(es_host, es_port, es_index, families)
         except Exception as err:
-            collectd.error("Plugin Prometheus: Error in collecting stats : %s" % (str(err)))
-
+            collectd.error("Plugin Prometheus: Error in mapping metrics to ES : %s" % (str(err)))
+        return exporter_metrics
 
     def read(self):
-        """Collects stats and spawns process for each pids."""
-        dict_prometheus = {}
+        """Scrapes the targets and dispatches their metrics, a target which
+        does not answer is skipped."""
         try:
-            if self.connection_available():
-                dict_prometheus = self.collect_data()
-            if dict_prometheus:
-                self.dispatch_data(deepcopy(dict_prometheus))
+            for metrics in self.collect_data():
+                self.dispatch_data(metrics)
+            for stats in self.executor.get_stats():
+                utils.dispatch(stats)
         except Exception as err:
             collectd.error("Error in collecting stats for prometheus %s due to %s" %(str(err), traceback.format_exc()))
 
+    def shutdown(self):
+        """Stops the scrape workers and closes the connections to the exporters."""
+        # nothing was started if the plugin was never configured
+        if not hasattr(self, "executor"):
+            return
+        self.executor.shutdown()
+        for session in self.sessions.values():
+            session.close()
+
     def dispatch_data(self, result):
         for details_type, details in result.items():
             utils.dispatch(details)
@@ -26,6 +26,10 @@ class PrometheusMysql(prometheus_poller.PrometheusStat):
                 self.interval = children.values[0]
             if children.key == PORT:
                 self.port = children.values[0]
+            if children.key in (TARGETS, INCLUDE_METRICS, EXCLUDE_METRICS, LABEL_FILTER):
+                self.conf.setdefault(children.key, []).extend(children.values)
+            if children.key in (SCRAPE_TIMEOUT, SUPPRESS_UNCHANGED):
+                self.conf[children.key] = children.values[0]
         self.conf.update({'interval': self.interval, 'port': self.port, 'name': 'prometheusmysql'})
         super(PrometheusMysql, self).__init__(self.conf)
 
@@ -41,3 +45,4 @@ OBJ = PrometheusMysql()
 collectd.register_init(init)
 collectd.register_config(OBJ.config)
 collectd.register_read(OBJ.read_temp)
+collectd.register_shutdown(OBJ.shutdown)
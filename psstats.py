@@ -4,7 +4,7 @@
 *
 ********************
 """
-"""Python plugin for collectd to get CPU/Memory usage for processes using ps command"""
+"""Python plugin for collectd to get CPU/Memory usage for processes from /proc or using ps command"""
 
 # !/usr/bin/python
 import signal
@@ -16,12 +16,16 @@ import re
 
 # user imports
 import utils
+import libproctable
 from utils import PlatformOS, PlatformVersion
 from constants import *
 
 
 
 SORT_BY = {'CPU': 'pcpu', 'MEM': 'pmem'}
+# collectors of the process table
+PROC_COLLECTOR = "proc"
+PS_COLLECTOR = "ps"
 
 
 class PSStats(object):
@@ -31,16 +35,23 @@ class PSStats(object):
     def __init__(self, interval=1, num_processes='*', sort_by='CPU'):
         """Initializes interval."""
         self.interval = DEFAULT_INTERVAL
+        self.columnar = False
         self.num_processes = num_processes
         self.sort_by = sort_by
+        self.collector = PROC_COLLECTOR
+        self.proc_table = None
 
     def config(self, cfg):
         """Initializes variables from conf files."""
         for children in cfg.children:
             if children.key == INTERVAL:
                 self.interval = children.values[0]
+            if children.key == COLUMNAR:
+                self.columnar = str(children.values[0]).lower() == "true"
             if children.key == "num_processes":
                 self.num_processes = children.values[0]
+            if children.key == "collector":
+                self.collector = children.values[0]
 
     def bytesConv(self, data):
         """
@@ -108,6 +119,35 @@ class PSStats(object):
                 break
         return result
 
+    def proc_command(self):
+        """
+        Returns dictionary with values of CPU and memory usage summary of the processes read from /proc.
+        """
+        if self.proc_table is None:
+            self.proc_table = libproctable.ProcessTable()
+        samples = self.proc_table.poll()
+        count = None if self.num_processes == '*' else int(self.num_processes)
+        result = []
+        process_order = 1
+        for sample in self.proc_table.top(samples, count, self.sort_by):
+            ps_stats_res = {}
+            ps_stats_res['order'] = process_order
+            ps_stats_res['pid'] = long(sample.pid)
+            ps_stats_res['process_user'] = self.proc_table.get_user(sample.uid)
+            ps_stats_res['virt_memory'] = float(sample.vsize_kb)
+            ps_stats_res['res_memory'] = float(sample.rss_kb)
+            ps_stats_res['processor'] = str(sample.processor)
+            ps_stats_res['controlling_terminal'] = libproctable.tty_name(sample.tty_nr)
+            ps_stats_res['status_code'] = sample.state
+            ps_stats_res['cpu_percent'] = round(sample.cpu_percent, 1)
+            ps_stats_res['cpu_time'] = libproctable.format_time(float(sample.jiffies) / libproctable.CLK_TCK)
+            ps_stats_res['memory_percent'] = round(sample.memory_percent, 1)
+            ps_stats_res['process_command'] = self.proc_table.command_line(sample).strip("[]{}()")
+            ps_stats_res['elapsed_time'] = libproctable.format_time(sample.elapsed, hours=False)
+            process_order += 1
+            result.append(ps_stats_res)
+        return result
+
     def add_common_params(self, ps_stats_res):
         """Adds TIMESTAMP, PLUGIN, PLUGIN_INS to dictionary."""
         timestamp = int(round(time.time() * 1000))
@@ -121,7 +161,10 @@ class PSStats(object):
 
     def collect_data(self):
         """Validates if dictionary is not null.If null then returns None."""
-        ps_stats_res = self.ps_command()
+        if self.collector == PS_COLLECTOR:
+            ps_stats_res = self.ps_command()
+        else:
+            ps_stats_res = self.proc_command()
         if not ps_stats_res:
             collectd.error("Plugin ps_stats: Unable to fetch process Usage Summary")
             return None
@@ -134,10 +177,11 @@ class PSStats(object):
     def dispatch_data(self, ps_stats_res):
         """Dispatches dictionary to collectd."""
         collectd.info("Plugin ps_stats: Successfully sent to collectd.")
-        collectd.debug("Plugin ps_stats: Values dispatched = " +
-                       json.dumps(ps_stats_res))
-        for result in ps_stats_res:
-            utils.dispatch(result)
+        collectd.debug("Plugin ps_stats: Documents dispatched = %d" % len(ps_stats_res))
+        if self.columnar:
+            utils.dispatch_columnar(ps_stats_res)
+        else:
+            utils.dispatch_batch(ps_stats_res)
 
     def read(self):
         """Collects all data."""
@@ -4,7 +4,7 @@
 *
 ********************
 """
-"""Python plugin for collectd to get socket connection info using netstat command"""
+"""Python plugin for collectd to get socket connection info from /proc/net, sock_diag or netstat command"""
 
 # !/usr/bin/python
 import signal
@@ -14,8 +14,13 @@ import collectd
 
 # user imports
 import utils
+import libsockets
 from constants import *
 
+# collectors of socket tables
+PROC_COLLECTOR = "proc"
+NETSTAT_COLLECTOR = "netstat"
+
 
 class SocketStats(object):
     """Plugin object will be created only once and collects utils
@@ -24,13 +29,25 @@ class SocketStats(object):
     def __init__(self):
         """Initializes interval and previous dictionary variable."""
         self.interval = DEFAULT_INTERVAL
+        self.columnar = False
         self.prev_data = {}
+        self.collector = PROC_COLLECTOR
+        self.use_netlink = False
+        self.aggregate = False
 
     def config(self, cfg):
         """Initializes variables from conf files."""
         for children in cfg.children:
             if children.key == INTERVAL:
                 self.interval = children.values[0]
+            if children.key == COLUMNAR:
+                self.columnar = str(children.values[0]).lower() == "true"
+            if children.key == "collector":
+                self.collector = children.values[0]
+            if children.key == "use_netlink":
+                self.use_netlink = str(children.values[0]).lower() == "true"
+            if children.key == AGGREGATE:
+                self.aggregate = str(children.values[0]).lower() == "true"
 
     def netstats_command(self):
         """
@@ -69,6 +86,67 @@ class SocketStats(object):
                 break
         return result
 
+    def proc_command(self):
+        """
+        Returns dictionary with values of available socket connections read from the kernel socket tables.
+        """
+        result = []
+        for entry in libsockets.read_sockets(self.use_netlink):
+            netstats_res = {}
+            if entry.protocol.startswith('udp'):
+                netstats_res['connState'] = "STATELESS"
+            else:
+                netstats_res['connState'] = entry.state
+            netstats_res['connProtocol'] = entry.protocol
+            netstats_res['recvQ'] = str(entry.recv_q)
+            netstats_res['sendQ'] = str(entry.send_q)
+            netstats_res['localAddress'] = entry.local_address
+            netstats_res['localPort'] = str(entry.local_port)
+            netstats_res['foreignAddress'] = entry.foreign_address
+            netstats_res['foreignPort'] = str(entry.foreign_port) if entry.foreign_port else "*"
+            netstats_res[PLUGINTYPE] = "netstats"
+            result.append(netstats_res)
+        return result
+
+    def aggregate_command(self):
+        """
+        Returns dictionary with number of socket connections per protocol, state and port.
+        Connections to a local listening port are counted per local port (inbound),
+        other connections per foreign port (outbound).
+        """
+        entries = libsockets.read_sockets(self.use_netlink)
+        listening = set((entry.protocol, entry.local_port) for entry in entries
+                        if entry.state == "LISTEN" or entry.protocol.startswith('udp'))
+        groups = {}
+        for entry in entries:
+            if entry.protocol.startswith('udp'):
+                state = "STATELESS"
+            else:
+                state = entry.state
+            if (entry.protocol, entry.local_port) in listening:
+                key = (entry.protocol, state, "inbound", entry.local_port)
+            else:
+                key = (entry.protocol, state, "outbound", entry.foreign_port)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0, 0]
+            group[0] += 1
+            group[1] += entry.recv_q
+            group[2] += entry.send_q
+        result = []
+        for (protocol, state, direction, port), (count, recv_q, send_q) in groups.items():
+            netstats_res = {}
+            netstats_res['connState'] = state
+            netstats_res['connProtocol'] = protocol
+            netstats_res['direction'] = direction
+            netstats_res['port'] = str(port)
+            netstats_res['numConnections'] = count
+            netstats_res['recvQ'] = recv_q
+            netstats_res['sendQ'] = send_q
+            netstats_res[PLUGINTYPE] = "netstatsSummary"
+            result.append(netstats_res)
+        return result
+
     def add_common_params(self, netstats_res):
         """Adds TIMESTAMP, PLUGIN, PLUGIN_INS to dictionary."""
         timestamp = int(round(time.time() * 1000))
@@ -81,7 +159,12 @@ class SocketStats(object):
 
     def collect_data(self):
         """Validates if dictionary is not null.If null then returns None."""
-        netstats_res = self.netstats_command()
+        if self.collector == NETSTAT_COLLECTOR:
+            netstats_res = self.netstats_command()
+        elif self.aggregate:
+            netstats_res = self.aggregate_command()
+        else:
+            netstats_res = self.proc_command()
         if not netstats_res:
             collectd.error("Plugin socketstats: Unable to fetch Socket Summary")
             return None
@@ -94,10 +177,11 @@ class SocketStats(object):
     def dispatch_data(self, netstats_res):
         """Dispatches dictionary to collectd."""
         collectd.info("Plugin socketstats: Successfully sent to collectd.")
-        collectd.debug("Plugin socketstats: Values dispatched = " +
-                       json.dumps(netstats_res))
-        for result in netstats_res:
-            utils.dispatch(result)
+        collectd.debug("Plugin socketstats: Documents dispatched = %d" % len(netstats_res))
+        if self.columnar:
+            utils.dispatch_columnar(netstats_res)
+        else:
+            utils.dispatch_batch(netstats_res)
 
     def read(self):
         """Collects all data."""
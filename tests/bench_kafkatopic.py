@@ -0,0 +1,229 @@
+"""
+benchmark of the topicStats and partitionStats reads of kafkatopic against a
+local fake Jolokia HTTP server exposing the BrokerTopicMetrics and Log MBeans
+of a broker. collectd, kafka, psutil, requests and pyjolokia are replaced by
+stand-ins when they are not installed, the stand-in of pyjolokia posts its
+requests to the fake server over HTTP like pyjolokia does.
+
+    python tests/bench_kafkatopic.py [topics] [partitions] [kafkatopic.py]
+
+Prints the seconds, HTTP posts and MBean reads of each document and a digest
+of the documents, equal digests mean identical documents. The optional module
+path benchmarks another revision of the plugin, e.g. the one reading every
+topic and partition MBean on its own:
+
+    git show 7843f61^:kafkatopic.py > /tmp/kafkatopic_old.py
+    python tests/bench_kafkatopic.py 200 3000 /tmp/kafkatopic_old.py
+"""
+
+import os
+import sys
+import imp
+import json
+import time
+import types
+import hashlib
+import httplib
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+TOPIC_METRICS = ['MessagesInPerSec', 'BytesOutPerSec', 'BytesInPerSec', 'TotalFetchRequestsPerSec',
+                 'TotalProduceRequestsPerSec', 'ProduceMessageConversionsPerSec', 'FailedProduceRequestsPerSec',
+                 'FetchMessageConversionsPerSec', 'FailedFetchRequestsPerSec', 'BytesRejectedPerSec']
+LOG_METRICS = [('NumLogSegments', 1), ('Size', 1048576), ('LogEndOffset', 5)]
+
+
+def canonical(mbean):
+    """Returns MBean name with its key properties sorted, as jolokia lists them."""
+    domain, _, properties = mbean.partition(':')
+    return domain + ':' + ','.join(sorted(properties.split(',')))
+
+
+class Broker(object):
+    """MBeans of a broker with partitions spread evenly over topics."""
+
+    def __init__(self, topics, partitions):
+        self.topics = ['topic%d' % topic for topic in range(topics)]
+        self.partitions_per_topic = max(partitions // topics, 1)
+        self.topic_mbeans = {}
+        self.log_mbeans = {}
+        for index, topic in enumerate(self.topics):
+            for name in TOPIC_METRICS:
+                self.topic_mbeans[canonical('kafka.server:type=BrokerTopicMetrics,name=%s,topic=%s' %
+                                            (name, topic))] = {'Count': index}
+            for partition in range(self.partitions_per_topic):
+                for name, value in LOG_METRICS:
+                    self.log_mbeans[canonical('kafka.log:type=Log,name=%s,topic=%s,partition=%d' %
+                                              (name, topic, partition))] = {'Value': value * partition}
+        self.posts = 0
+        self.reads = 0
+
+    def read(self, request):
+        self.reads += 1
+        mbean, attribute = request['mbean'], request.get('attribute')
+        if mbean.endswith('topic=*'):
+            return {'status': 200, 'value': self.topic_mbeans, 'request': request}
+        if mbean.endswith('partition=*'):
+            return {'status': 200, 'value': self.log_mbeans, 'request': request}
+        attributes = self.topic_mbeans.get(canonical(mbean)) or self.log_mbeans.get(canonical(mbean))
+        if attributes is None or attribute not in attributes:
+            return {'status': 404, 'error_type': 'javax.management.InstanceNotFoundException',
+                    'request': request}
+        return {'status': 200, 'value': attributes[attribute], 'request': request}
+
+
+class JolokiaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        broker = self.server.broker
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        broker.posts += 1
+        if isinstance(body, list):
+            data = json.dumps([broker.read(request) for request in body])
+        else:
+            data = json.dumps(broker.read(body))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class JolokiaServer(ThreadingMixIn, HTTPServer):
+    pass
+
+
+class Jolokia(object):
+    """Stand-in of pyjolokia.Jolokia posting to the fake server."""
+
+    def __init__(self, url):
+        host_port = url.split('/')[2]
+        self.connection = httplib.HTTPConnection(host_port)
+        self.requests = []
+
+    def post(self, body):
+        self.connection.request('POST', '/jolokia/', json.dumps(body), {'Content-Type': 'application/json'})
+        return json.loads(self.connection.getresponse().read())
+
+    def request(self, type, mbean, attribute=None):
+        return self.post({'type': type, 'mbean': mbean, 'attribute': attribute})
+
+    def add_request(self, **request):
+        self.requests.append(request)
+
+    def getRequests(self):
+        requests, self.requests = self.requests, []
+        return self.post(requests)
+
+
+class AnyAttribute(types.ModuleType):
+    """Module whose missing attributes are no-op callables, for the modules
+    the benchmark does not use such as collectd."""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+
+def stub(name, module=None, **attributes):
+    """Installs a stand-in for a module which can not be imported."""
+    try:
+        __import__(name)
+        return
+    except ImportError:
+        pass
+    module = module or types.ModuleType(name)
+    for attribute, value in attributes.items():
+        setattr(module, attribute, value)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+
+
+def stub_modules(broker):
+    class KafkaConsumer(object):
+        def __init__(self, **config):
+            pass
+
+        def topics(self):
+            return set(broker.topics)
+
+        def partitions_for_topic(self, topic):
+            return set(range(broker.partitions_per_topic))
+
+        def close(self):
+            pass
+
+    class KafkaClient(object):
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def get_partition_ids_for_topic(self, topic):
+            return range(broker.partitions_per_topic)
+
+    for name in ('collectd', 'psutil', 'requests'):
+        stub(name, AnyAttribute(name))
+    stub('pyjolokia', Jolokia=Jolokia)
+    stub('kafka', KafkaConsumer=KafkaConsumer, KafkaClient=KafkaClient)
+    for name in ('kafka.client_async', 'kafka.structs', 'kafka.protocol', 'kafka.protocol.admin',
+                 'kafka.protocol.commit', 'kafka.protocol.offset', 'kafka.coordinator',
+                 'kafka.coordinator.protocol'):
+        stub(name, KafkaClient=KafkaClient, TopicPartition=tuple, ListGroupsRequest=[],
+             DescribeGroupsRequest=[], OffsetFetchRequest=[], OffsetRequest=[],
+             ConsumerProtocolMemberAssignment=object)
+
+
+def digest(docs):
+    """Returns digest of documents, the order of the partitionStats rows does
+    not matter."""
+    rows = docs.get('partitionStats')
+    if rows is not None:
+        docs = dict(docs, partitionStats=sorted(rows, key=lambda row: (row['_topicName'], row['_partitionNum'])))
+    return hashlib.md5(json.dumps(docs, sort_keys=True)).hexdigest()[:12]
+
+
+def main():
+    topics = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    partitions = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    module_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(REPO, 'kafkatopic.py')
+
+    broker = Broker(topics, partitions)
+    server = JolokiaServer(('127.0.0.1', 0), JolokiaHandler)
+    server.broker = broker
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    stub_modules(broker)
+    plugin = imp.load_source('kafkatopic_bench', module_path).OBJ
+    plugin.listenerip = '127.0.0.1'
+    plugin.port = '9092'
+    client = Jolokia('http://127.0.0.1:%d/jolokia/' % server.server_address[1])
+
+    print "%s: %d topics, %d partitions" % (os.path.basename(module_path), topics,
+                                           topics * broker.partitions_per_topic)
+    for flag in ('topic', 'partition'):
+        broker.posts = broker.reads = 0
+        start = time.time()
+        dict_jmx = {}
+        plugin.add_topic_parameters(client, dict_jmx, flag)
+        print "%-9s %8.2f s %7d posts %7d reads  digest %s" % (flag, time.time() - start, broker.posts,
+                                                                broker.reads, digest(dict_jmx))
+    # the handler of the keep-alive connection returns once it is closed
+    client.connection.close()
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
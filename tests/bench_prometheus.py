@@ -0,0 +1,106 @@
+"""
+benchmark of the conversion of prometheus exporter responses by
+prometheus_poller over the sample node_exporter payload in
+tests/data/node_exporter.prom. The payload is repeated with renamed families
+until it has the requested number of samples. collectd and requests are
+replaced by stand-ins when they are not installed.
+
+    python tests/bench_prometheus.py [samples ...] [--module prometheus_poller.py]
+
+Prints the seconds and samples per second of every payload size and a digest
+of the converted metrics without the suffix field, equal digests mean the
+same families and samples. The module option benchmarks another revision of
+the poller, e.g. the one before the single pass parser:
+
+    git show cdedaab^:prometheus_poller.py > /tmp/prometheus_poller_old.py
+    python tests/bench_prometheus.py 5000 20000 --module /tmp/prometheus_poller_old.py
+
+The digests of these two revisions differ only because the old parser strips
+spaces and '#' from label values, the mountpoint "/mnt/backup 2024" and the
+version label of node_uname_info of the payload.
+"""
+
+import os
+import re
+import sys
+import imp
+import json
+import time
+import types
+import hashlib
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(TESTS)
+sys.path.insert(0, REPO)
+
+PAYLOAD = os.path.join(TESTS, "data", "node_exporter.prom")
+# metric name of a HELP, TYPE or sample line
+NAME_PATTERN = re.compile(r'^(# (?:HELP|TYPE) )?([a-zA-Z_:])', re.M)
+CONF = {"interval": 10, "name": "prometheuslinux", "port": 9100}
+
+
+class AnyAttribute(types.ModuleType):
+    """Module whose missing attributes are no-op callables, for the modules
+    the benchmark does not use such as collectd."""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+
+def stub_modules():
+    for name in ("collectd", "requests"):
+        try:
+            __import__(name)
+        except ImportError:
+            sys.modules[name] = AnyAttribute(name)
+
+
+def scale(payload, samples):
+    """Returns payload repeated with the families of every copy renamed, with
+    at least samples samples."""
+    per_copy = len([line for line in payload.splitlines() if line and not line.startswith("#")])
+    copies = max((samples + per_copy - 1) // per_copy, 1)
+    copies_text = []
+    for copy in range(copies):
+        prefix = "c%d_" % copy
+        copies_text.append(NAME_PATTERN.sub(lambda match: (match.group(1) or "") + prefix + match.group(2), payload))
+    return "".join(copies_text), copies * per_copy
+
+
+def digest(metrics):
+    for families in metrics.values():
+        for family in families.values():
+            for sample in family["metrics"]:
+                sample.pop("suffix", None)
+    return hashlib.md5(json.dumps(metrics, sort_keys=True)).hexdigest()[:12]
+
+
+def main():
+    args = sys.argv[1:]
+    module_path = os.path.join(REPO, "prometheus_poller.py")
+    if "--module" in args:
+        index = args.index("--module")
+        module_path = args[index + 1]
+        del args[index:index + 2]
+    sizes = [int(arg) for arg in args] or [5000, 20000, 50000]
+
+    stub_modules()
+    poller = imp.load_source("prometheus_poller_bench", module_path)
+    with open(PAYLOAD) as payload_file:
+        payload = payload_file.read()
+
+    print "%s" % os.path.basename(module_path)
+    for size in sizes:
+        data, samples = scale(payload, size)
+        stat = poller.PrometheusStat(dict(CONF))
+        start = time.time()
+        metrics = stat.convert_metrics(data)
+        elapsed = time.time() - start
+        print "%7d samples %8.3f s %10.0f samples/s  digest %s" % (samples, elapsed, samples / max(elapsed, 1e-9),
+                                                                   digest(metrics))
+
+
+if __name__ == "__main__":
+    main()
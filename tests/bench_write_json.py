@@ -0,0 +1,85 @@
+"""
+benchmark of the documents per second written by write_json for one read
+cycle of lsofstats documents, into a temporary directory (TMPDIR selects
+its filesystem, e.g. a tmpfs). collectd is replaced by a stand-in when it is
+not installed.
+
+    python tests/bench_write_json.py [documents] [--module write_json.py]
+
+A write_json with write_batch writes the cycle with it, the way
+utils.dispatch_batch does, otherwise every document is written with write()
+like utils.dispatch. The module option benchmarks another revision, e.g. the
+one writing every document on its own:
+
+    git show ffcdd78^:write_json.py > /tmp/write_json_old.py
+    python tests/bench_write_json.py 20000 --module /tmp/write_json_old.py
+"""
+
+import os
+import sys
+import imp
+import time
+import types
+import shutil
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+class AnyAttribute(types.ModuleType):
+    """Module whose missing attributes are no-op callables, for collectd."""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+
+def lsof_documents(count):
+    return [{"_plugin": "lsofstats", "_documentType": "lsof_stats", "_actual_collectd_plugin_type": "lsofstats",
+             "pid": index, "name": "/var/lib/file%d" % index, "fileType": "REG", "size": 4, "time": 1}
+            for index in range(count)]
+
+
+def main():
+    args = sys.argv[1:]
+    module_path = os.path.join(REPO, "write_json.py")
+    if "--module" in args:
+        index = args.index("--module")
+        module_path = args[index + 1]
+        del args[index:index + 2]
+    count = int(args[0]) if args else 20000
+
+    try:
+        import collectd
+    except ImportError:
+        sys.modules["collectd"] = AnyAttribute("collectd")
+    write_json = imp.load_source("write_json_bench", module_path)
+    path = tempfile.mkdtemp()
+    docs = lsof_documents(count)
+    try:
+        start = time.time()
+        if hasattr(write_json, "write_batch"):
+            mode = "write_batch"
+            write_json.WRITER.path = path
+            write_json.write_batch(docs)
+        else:
+            mode = "write"
+            init = write_json.WriteJson.__init__
+
+            def init_path(self):
+                init(self)
+                self.path = path
+            write_json.WriteJson.__init__ = init_path
+            for doc in docs:
+                write_json.write(doc)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(path)
+    print "%s (%s): %d documents in %.3f s, %.0f docs/sec" % (os.path.basename(module_path), mode, count,
+                                                              elapsed, count / elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+tests of the JVM doc collector of libjmxplan shared by the pool threads of
+several plugins, collectd is replaced by a stub module.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import types
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.modules.setdefault("collectd", types.ModuleType("collectd"))
+import libjmxplan
+
+NOT_FOUND = {'status': 404, 'error_type': libjmxplan.INSTANCE_NOT_FOUND}
+
+
+class FakeJolokia(object):
+    """pyjolokia client of one JVM. Counts the bulk requests in flight per
+    pid, every named MBean read fails with InstanceNotFoundException every
+    third request so that the names are forgotten and rediscovered."""
+
+    in_flight = {}
+    overlaps = []
+    counter_lock = threading.Lock()
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.requests = []
+        self.bulk_reads = 0
+
+    def add_request(self, **request):
+        self.requests.append(request)
+
+    def getRequests(self):
+        requests, self.requests = self.requests, []
+        with self.counter_lock:
+            self.in_flight[self.pid] = self.in_flight.get(self.pid, 0) + 1
+            if self.in_flight[self.pid] > 1:
+                self.overlaps.append(self.pid)
+        time.sleep(0.001)
+        self.bulk_reads += 1
+        responses = []
+        for request in requests:
+            mbean = request['mbean']
+            if mbean.endswith(',*'):
+                responses.append({'status': 200, 'value': {mbean[:-1] + 'name=A': {'Name': 'A'}}})
+            elif 'name=' in mbean and self.bulk_reads % 3 == 0:
+                responses.append(NOT_FOUND)
+            else:
+                responses.append({'status': 200, 'value': {'Count': 1, 'MemoryUsed': 1, 'TotalCapacity': 1}})
+        with self.counter_lock:
+            self.in_flight[self.pid] -= 1
+        return responses
+
+
+class JvmDocCollectorThreadsTest(unittest.TestCase):
+
+    def test_concurrent_fetch_and_subscribe(self):
+        collector = libjmxplan.JvmDocCollector(result_age=0)
+        docs = ["nioStats", "threadStats"]
+        pids = ["1", "2", "3"]
+        errors = []
+        stop = time.time() + 1
+
+        def poll(pid):
+            client = FakeJolokia(pid)
+            try:
+                while time.time() < stop:
+                    results = collector.fetch(client, pid, docs)
+                    self.assertEqual(sorted(results), docs)
+            except Exception as err:
+                errors.append(err)
+
+        def churn():
+            # a plugin whose JVMs come and go
+            try:
+                while time.time() < stop:
+                    collector.subscribe("churn", pids[:int(time.time() * 100) % 4], docs)
+                    collector.subscribe("churn", [], docs)
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=poll, args=(pid,)) for pid in pids * 2]
+        threads.append(threading.Thread(target=churn))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(FakeJolokia.overlaps, [])
+
+    def test_unsubscribed_pid_is_dropped(self):
+        collector = libjmxplan.JvmDocCollector()
+        collector.subscribe("plugin", ["1"], ["nioStats"])
+        collector.fetch(FakeJolokia("1"), "1", ["nioStats"])
+        self.assertIn("1", collector.results)
+        collector.subscribe("plugin", [], ["nioStats"])
+        self.assertEqual((collector.results, collector.plans, collector.names, collector.pid_locks),
+                         ({}, {}, {}, {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+tests of the consumer group lag of libkafka against canned kafka protocol
+responses, collectd and kafka are replaced by stub modules.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeRequest(object):
+    def __init__(self, *args):
+        self.args = args
+
+
+def fake_request(name):
+    """Returns list of request versions like kafka.protocol, the version
+    classes are subclasses of FakeRequest named after the request."""
+    return [type("%s_v%d" % (name, version), (FakeRequest,), {}) for version in range(3)]
+
+
+class FakeAssignment(object):
+    def __init__(self, assignment):
+        self.assignment = assignment
+
+    @staticmethod
+    def decode(data):
+        # member assignments of the tests are already decoded
+        return FakeAssignment(data)
+
+
+def stub_modules():
+    modules = {
+        "collectd": {},
+        "kafka": {"KafkaConsumer": object},
+        "kafka.client_async": {"KafkaClient": object},
+        "kafka.structs": {"TopicPartition": tuple},
+        "kafka.protocol": {},
+        "kafka.protocol.admin": {"ListGroupsRequest": fake_request("ListGroups"),
+                                 "DescribeGroupsRequest": fake_request("DescribeGroups")},
+        "kafka.protocol.commit": {"OffsetFetchRequest": fake_request("OffsetFetch")},
+        "kafka.protocol.offset": {"OffsetRequest": fake_request("ListOffsets")},
+        "kafka.coordinator": {},
+        "kafka.coordinator.protocol": {"ConsumerProtocolMemberAssignment": FakeAssignment},
+    }
+    for name, attributes in modules.items():
+        module = sys.modules.get(name) or types.ModuleType(name)
+        for attribute, value in attributes.items():
+            setattr(module, attribute, value)
+        sys.modules[name] = module
+
+
+stub_modules()
+import libkafka
+
+
+class Response(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeProto(object):
+    """KafkaProtocolClient of a cluster of brokers 1 and 2. Broker 1
+    coordinates group g1, broker 2 group g2. Partitions of topic t are led by
+    broker 1, except t/2 which has no leader."""
+
+    def __init__(self):
+        self.sent = []
+        self.metadata_refreshed = False
+        self.leaders = {("t", 0): 1, ("t", 1): 1, ("t", 2): -1, ("u", 0): 2}
+        # (group, topic, partition) -> committed offset, -1 if none
+        self.committed = {("g1", "t", 0): 100, ("g1", "t", 1): 500, ("g1", "t", 2): 5,
+                          ("g2", "u", 0): -1}
+        # (topic, partition) -> log end offset
+        self.end_offsets = {("t", 0): 150, ("t", 1): 400, ("t", 2): 10, ("u", 0): 7}
+
+    def refresh_metadata(self):
+        self.metadata_refreshed = True
+
+    def brokers(self):
+        return [1, 2]
+
+    def leader(self, topic, partition):
+        return self.leaders.get((topic, partition))
+
+    def send_all(self, requests):
+        self.sent.extend(requests)
+        return [self.respond(node_id, request) for node_id, request in requests]
+
+    def respond(self, node_id, request):
+        kind = type(request).__name__
+        if kind == "ListGroups_v0":
+            groups = {1: [("g1", "consumer"), ("connect", "connect")], 2: [("g2", "consumer")]}
+            return Response(error_code=0, groups=groups[node_id])
+        if kind == "DescribeGroups_v0":
+            members = {"g1": [("m1", "c1", "/10.0.0.1", "", [("t", [0, 1, 2])])],
+                       "g2": [("m2", "c2", "/10.0.0.2", "", [("u", [0])])]}
+            return Response(groups=[(0, group, "Stable", "consumer", "range", members[group])
+                                    for group in request.args[0]])
+        if kind == "OffsetFetch_v1":
+            group, topics = request.args
+            return Response(topics=[(topic, [(partition, self.committed[(group, topic, partition)], "", 0)
+                                             for partition in partitions])
+                                    for topic, partitions in topics])
+        if kind == "ListOffsets_v1":
+            _, topics = request.args
+            return Response(topics=[(topic, [(partition, 0, -1, self.end_offsets[(topic, partition)])
+                                             for partition, _ in partitions])
+                                    for topic, partitions in topics])
+        raise AssertionError("unexpected request %s" % kind)
+
+
+class ConsumerGroupLagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.proto = FakeProto()
+        self.rows = libkafka.consumer_group_lag(self.proto)
+
+    def row(self, group, topic, partition):
+        for row in self.rows:
+            if (row["_groupName"], row["_topicName"], row["partition"]) == (group, topic, partition):
+                return row
+        return None
+
+    def test_offsets_and_lag(self):
+        self.assertTrue(self.proto.metadata_refreshed)
+        self.assertEqual(self.row("g1", "t", 0), {
+            "_groupName": "g1", "_topicName": "t", "partition": 0, "currentOffset": 100,
+            "logEndOffset": 150, "lag": 50, "custId": "m1", "clientId": "c1"})
+
+    def test_lag_is_not_negative(self):
+        row = self.row("g1", "t", 1)
+        self.assertEqual((row["currentOffset"], row["logEndOffset"], row["lag"]), (500, 400, 0))
+
+    def test_partition_without_leader_is_skipped(self):
+        self.assertIsNone(self.row("g1", "t", 2))
+        for node_id, request in self.proto.sent:
+            if type(request).__name__ == "ListOffsets_v1":
+                self.assertNotIn(("t", [(2, libkafka.LATEST_OFFSET)]), request.args[1])
+
+    def test_partition_without_commit_is_skipped(self):
+        self.assertIsNone(self.row("g2", "u", 0))
+        self.assertEqual(len(self.rows), 2)
+
+    def test_requests_go_to_coordinator_and_leader(self):
+        sent = [(node_id, type(request).__name__, request.args) for node_id, request in self.proto.sent]
+        self.assertIn((1, "DescribeGroups_v0", (["g1"],)), sent)
+        self.assertIn((2, "DescribeGroups_v0", (["g2"],)), sent)
+        self.assertIn((1, "OffsetFetch_v1", ("g1", [("t", [0, 1, 2])])), sent)
+        list_offsets = [args for node_id, kind, args in sent if (node_id, kind) == (1, "ListOffsets_v1")]
+        self.assertEqual(len(list_offsets), 1)
+        replica_id, topics = list_offsets[0]
+        self.assertEqual([(topic, sorted(partitions)) for topic, partitions in topics],
+                         [("t", [(0, libkafka.LATEST_OFFSET), (1, libkafka.LATEST_OFFSET)])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+tests of the per pid status and duration kept by PidExecutor and returned as
+collectorStats documents, collectd is replaced by a stub module.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+collectd = sys.modules.setdefault("collectd", types.ModuleType("collectd"))
+for name in ("debug", "info", "warning", "error"):
+    setattr(collectd, name, lambda message: None)
+import libpidexecutor
+from constants import *
+
+
+def collect(pid, delays):
+    if delays[pid] is None:
+        raise ValueError("no jolokia agent")
+    time.sleep(delays[pid])
+    return pid
+
+
+class PidExecutorStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = libpidexecutor.PidExecutor("kafkajmx", pid_timeout=0.2)
+
+    def tearDown(self):
+        # let the workers finish the cancelled tasks before they are stopped
+        while any(task.is_running() for task in self.executor.last_tasks.values()):
+            time.sleep(0.05)
+        workers = self.executor.workers
+        self.executor.shutdown()
+        for worker in workers:
+            worker.join(1)
+
+    def stats(self):
+        return dict((stats["pid"], stats) for stats in self.executor.get_stats())
+
+    def test_status_and_duration_per_pid(self):
+        delays = {1: 0, 2: None, 3: 0.5}
+        output = self.executor.run(collect, [1, 2, 3], 2, delays)
+        self.assertEqual(output, [(1, 1)])
+        stats = self.stats()
+        self.assertEqual(dict((pid, stats[pid]["status"]) for pid in stats),
+                         {1: libpidexecutor.OK, 2: libpidexecutor.ERROR, 3: libpidexecutor.TIMEOUT})
+        self.assertTrue(0.2 <= stats[3]["duration"] < 0.5)
+        self.assertEqual((stats[1][PLUGIN], stats[1][PLUGINTYPE], stats[1][ACTUALPLUGINTYPE]),
+                         ("kafkajmx", COLLECTOR_STATS, "kafkajmx"))
+
+    def test_pid_still_running_is_skipped(self):
+        delays = {1: 0.5}
+        self.executor.run(collect, [1], 0.2, delays)
+        self.executor.run(collect, [1], 0.2, delays)
+        self.assertEqual(self.stats()[1]["status"], libpidexecutor.SKIPPED)
+
+    def test_gone_pid_is_dropped(self):
+        delays = {1: 0, 2: 0}
+        self.executor.run(collect, [1, 2], 1, delays)
+        self.executor.run(collect, [1], 1, delays)
+        self.assertEqual(sorted(self.stats()), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -14,8 +14,6 @@ import json
 import time
 import collectd
 import traceback
-import Queue
-import multiprocessing
 from copy import deepcopy
 import psutil
 import socket
@@ -25,9 +23,14 @@ from pyjolokia import Jolokia
 import utils
 from constants import *
 from libtomcatjolokia import JolokiaClient
+from libjmxplan import JvmDocs, to_mb
+from libpidexecutor import PidExecutor
 
 TOMCAT_DOCS = ["contextStats", "tomcatStats", "requestProcessorStats", "jvmStats"]
 DEFAULT_GC = ['PS MarkSweep', 'MarkSweepCompact']
+# generic docs jvmStats is built from, read through the JVM collector shared
+# with the other jolokia based plugins
+GENERIC_DOCS = ["classLoadingStats", "memoryStats", "gcStats"]
 
 
 class TomcatStat(object):
@@ -44,6 +47,8 @@ class TomcatStat(object):
         self.java_path = ''
         self.documentsTypes = []
         self.jclient = None
+        self.jvm_docs = JvmDocs(TOMCAT, GENERIC_DOCS, DEFAULT_GC, [])
+        self.executor = PidExecutor(TOMCAT)
 
     def config(self, cfg):
         """Initializes variables from conf files."""
@@ -67,14 +72,14 @@ class TomcatStat(object):
 
         self.jclient = JolokiaClient(os.path.basename(__file__)[:-3], self.process, self.java_path)
 
-    def get_jmx_parameters(self, jolokiaclient, doc, dict_jmx):
+    def get_jmx_parameters(self, jolokiaclient, pid, doc, dict_jmx):
         """Fetch stats based on doc_type"""
         if doc == "tomcatStats":
             self.add_tomcat_parameters(jolokiaclient, dict_jmx)
         elif doc == "requestProcessorStats":
             self.add_request_proc_parameters(jolokiaclient, dict_jmx)
         elif doc == "jvmStats":
-            self.add_jvm_parameters(jolokiaclient, dict_jmx)
+            self.add_jvm_parameters(jolokiaclient, pid, dict_jmx)
         elif doc == "contextStats":
             contexts = self.add_context_parameters(jolokiaclient, dict_jmx)
 
@@ -199,26 +204,26 @@ class TomcatStat(object):
             dict_jmx[cont_name] = {}
             dict_jmx[cont_name].update(dict_context)
 
-    def add_jvm_parameters(self, jolokiaclient, dict_jmx):
+    def add_jvm_parameters(self, jolokiaclient, pid, dict_jmx):
         """Add jmx stats specific to tomcat metrics"""
-        jolokiaclient.add_request(type='read', mbean='java.lang:type=ClassLoading', attribute='LoadedClassCount')
-        jolokiaclient.add_request(type='read', mbean='java.lang:type=ClassLoading', attribute='UnLoadedClassCount')
-
-        bulkdata = jolokiaclient.getRequests()
-        dict_jmx['loadedClassCount'] = bulkdata[0].get('value', 0)
-        dict_jmx['unloadedClassCount'] = bulkdata[1].get('value', 0)
-
-        heap = jolokiaclient.request(type='read', mbean='java.lang:type=Memory', attribute='HeapMemoryUsage')
-        non_heap = jolokiaclient.request(type='read', mbean='java.lang:type=Memory', attribute='NonHeapMemoryUsage')
-
-        dict_jmx['heapMemUsed'] =  round(heap['value']['used'] / 1024.0/ 1024.0, 2)
-        dict_jmx['heapMemCommitted'] = round(heap['value']['committed'] / 1024.0 /1024.0, 2)
-        dict_jmx['nonHeapMemUsed'] = round(non_heap['value']['used'] / 1024.0/ 1024.0, 2)
-        dict_jmx['nonHeapMemCommitted'] = round(non_heap['value']['committed'] / 1024.0/ 1024.0, 2)
-
-        self.add_gc_parameters(jolokiaclient, dict_jmx)
-
-    def add_gc_parameters(self, jolokiaclient, dict_jmx):
+        results = self.jvm_docs.fetch(jolokiaclient, pid)
+        classloading = results["classLoadingStats"].get('classloading')
+        if classloading:
+            dict_jmx['loadedClassCount'] = classloading['LoadedClassCount']
+            dict_jmx['unloadedClassCount'] = classloading['UnloadedClassCount']
+
+        memory = results["memoryStats"].get('memory')
+        if memory:
+            heap = memory['HeapMemoryUsage']
+            non_heap = memory['NonHeapMemoryUsage']
+            dict_jmx['heapMemUsed'] = to_mb(heap['used'])
+            dict_jmx['heapMemCommitted'] = to_mb(heap['committed'])
+            dict_jmx['nonHeapMemUsed'] = to_mb(non_heap['used'])
+            dict_jmx['nonHeapMemCommitted'] = to_mb(non_heap['committed'])
+
+        self.add_gc_parameters(results["gcStats"], dict_jmx)
+
+    def add_gc_parameters(self, gc_results, dict_jmx):
         """Add garbage collector related jmx stats"""
 
         def memory_gc_usage(self, mempool_gc, key, gc_name, dict_jmx):
@@ -245,39 +250,23 @@ class TomcatStat(object):
 
                 # self.handle_neg_bytes(values['init'], gc_name+key+mp_name+'Init', dict_jmx)
                 # self.handle_neg_bytes(values['max'], gc_name+key+mp_name+'Max', dict_jmx)
-                dict_jmx[key + mp_name + 'Used'] = round(values['used'] / 1024.0 / 1024.0, 2)
-                dict_jmx[key + mp_name + 'Committed'] = round(values['committed'] / 1024.0 / 1024.0, 2)
-
-        gc_names = self.get_gc_names(jolokiaclient)
-        for gc_name in gc_names:
-            str_mbean = 'java.lang:type=GarbageCollector,name=' + gc_name
-            if_valid = jolokiaclient.request(type='read', mbean=str_mbean, attribute='Valid')
-
-            if if_valid['status'] == 200 and if_valid['value'] == True:
-                str_attribute = 'LastGcInfo'
-                gc_values = jolokiaclient.request(type='read', mbean=str_mbean, attribute=str_attribute)
-                gc_name_no_spaces = ''.join(gc_name.split())
-                if gc_values['status'] == 200 and gc_values['value']:
-                    # dict_jmx[gc_name_no_spaces+'StartTime'] = gc_values['value']['startTime']
-                    # dict_jmx[gc_name_no_spaces+'EndTime'] = gc_values['value']['endTime']
-                    dict_jmx['gcDuration'] = gc_values['value']['duration']
-                    dict_jmx['gcThreadCount'] = gc_values['value']['GcThreadCount']
-                    mem_aftergc = gc_values['value']['memoryUsageAfterGc']
-                    memory_gc_usage(self, mem_aftergc, 'afGc', gc_name_no_spaces, dict_jmx)
-                    mem_beforegc = gc_values['value']['memoryUsageBeforeGc']
-                    memory_gc_usage(self, mem_beforegc, 'bfGc', gc_name_no_spaces, dict_jmx)
-
-    def get_gc_names(self, jolokiaclient):
-        """Return list of garbage collector names"""
-        gc_json = jolokiaclient.request(type='read', mbean='java.lang:type=GarbageCollector,*', attribute='Name')
-        gc_names = []
-        if gc_json['status'] == 200:
-            for _, value in gc_json['value'].items():
-                if value['Name'] in DEFAULT_GC:
-                    gc_names.append(value['Name'])
-                else:
-                    collectd.error("Plugin tomcat: not supported for GC %s" % value['Name'])
-        return gc_names
+                dict_jmx[key + mp_name + 'Used'] = to_mb(values['used'])
+                dict_jmx[key + mp_name + 'Committed'] = to_mb(values['committed'])
+
+        for gc_name, gc_values in sorted(gc_results.items()):
+            if not self.jvm_docs.is_supported("GC", gc_name) or gc_values.get('Valid') is not True:
+                continue
+            last_gc = gc_values.get('LastGcInfo')
+            gc_name_no_spaces = ''.join(gc_name.split())
+            if last_gc:
+                # dict_jmx[gc_name_no_spaces+'StartTime'] = last_gc['startTime']
+                # dict_jmx[gc_name_no_spaces+'EndTime'] = last_gc['endTime']
+                dict_jmx['gcDuration'] = last_gc['duration']
+                dict_jmx['gcThreadCount'] = last_gc['GcThreadCount']
+                mem_aftergc = last_gc['memoryUsageAfterGc']
+                memory_gc_usage(self, mem_aftergc, 'afGc', gc_name_no_spaces, dict_jmx)
+                mem_beforegc = last_gc['memoryUsageBeforeGc']
+                memory_gc_usage(self, mem_beforegc, 'bfGc', gc_name_no_spaces, dict_jmx)
 
     def get_connector_name(self, jolokiaclient):
         """Return name of the nio connector"""
@@ -344,7 +333,7 @@ class TomcatStat(object):
         for doc in TOMCAT_DOCS:
             try:
                 dict_jmx = {}
-                self.get_jmx_parameters(jolokiaclient, doc, dict_jmx)
+                self.get_jmx_parameters(jolokiaclient, pid, doc, dict_jmx)
 
                 if doc == 'contextStats':
                     if not dict_jmx:
@@ -352,7 +341,7 @@ class TomcatStat(object):
 
                     for context in dict_jmx.keys():
                         self.add_common_params(doc, dict_jmx[context])
-                    output.put((pid, doc, dict_jmx))
+                    output.append((pid, doc, dict_jmx))
 
                     continue
 
@@ -361,31 +350,29 @@ class TomcatStat(object):
 
                 collectd.info("Plugin tomcat: Added %s doctype information successfully for pid %s" % (doc, pid))
                 # if doc in ["tomcatStats", "jvmStats", "requestProcessorStats"]:
-                #    output.put((pid, doc, dict_jmx))
+                #    output.append((pid, doc, dict_jmx))
                 #    continue
 
                 self.add_common_params(doc, dict_jmx)
-                output.put((pid, doc, dict_jmx))
+                output.append((pid, doc, dict_jmx))
             except Exception as err:
                 collectd.error("Plugin tomcat: Error in collecting stats of %s doctype: %s" % (doc, str(err)))
                 collectd.error("Plugin tomcat: %s" % traceback.format_exc())
 
+    def collect_pid(self, pid):
+        """Returns list of the documents of a pid, empty if its jolokia agent is not available."""
+        output = []
+        port = self.jclient.get_jolokia_port(pid)
+        if port and self.jclient.connection_available(port):
+            self.get_pid_jmx_stats(pid, port, output)
+        return output
+
     def run_pid_process(self, list_pid):
-        """Spawn process for each pid"""
-        procs = []
-        output = multiprocessing.Queue()
-        for pid in list_pid:
-            port = self.jclient.get_jolokia_port(pid)
-            if port and self.jclient.connection_available(port):
-                proc = multiprocessing.Process(target=self.get_pid_jmx_stats, args=(pid, port, output))
-                procs.append(proc)
-                proc.start()
-
-        for proc in procs:
-            proc.join()
-        # for p in procs:
-        #          collectd.debug("%s, %s" % (p, p.is_alive()))
-        return procs, output
+        """Collect pids concurrently, pids late for the deadline are dropped"""
+        output = []
+        for _, pid_output in self.executor.run(self.collect_pid, list_pid, float(self.interval)):
+            output.extend(pid_output)
+        return output
 
     def collect_jmx_data(self):
         """Collects stats and spawns process for each pids."""
@@ -394,26 +381,21 @@ class TomcatStat(object):
             collectd.error("Plugin tomcat: No %s processes are running" % self.process)
             return
 
-        procs, output = self.run_pid_process(list_pid)
-        for _ in procs:
-            for _ in TOMCAT_DOCS:
-                try:
-                    pid, doc_name, doc_result = output.get_nowait()
-                except Queue.Empty:
-                    collectd.error("Failed to send one or more doctype document to collectd")
-                    continue
-                # Dispatching documentsTypes which are requetsed alone
-                self.documentsTypes = ["contextStats", "tomcatStats", "requestProcessorStats", "jvmStats"]
-
-                if doc_name in self.documentsTypes:
-                    # self.add_common_params(doc_name, doc_result)
-                    # self.dispatch_data(doc_name, doc_result)
-
-                    if doc_name in ["contextStats", "requestProcessorStats"]:
-                        self.add_dispatch_tomcat(pid, doc_name, doc_result)
-                    else:
-                        self.dispatch_data(doc_name, doc_result)
-        output.close()
+        self.jvm_docs.retain(list_pid)
+        output = self.run_pid_process(list_pid)
+        # Dispatching documentsTypes which are requetsed alone
+        self.documentsTypes = ["contextStats", "tomcatStats", "requestProcessorStats", "jvmStats"]
+        for pid, doc_name, doc_result in output:
+            if doc_name in self.documentsTypes:
+                # self.add_common_params(doc_name, doc_result)
+                # self.dispatch_data(doc_name, doc_result)
+
+                if doc_name in ["contextStats", "requestProcessorStats"]:
+                    self.add_dispatch_tomcat(pid, doc_name, doc_result)
+                else:
+                    self.dispatch_data(doc_name, doc_result)
+        for stats in self.executor.get_stats():
+            utils.dispatch(stats)
 
     def dispatch_data(self, doc_name, result):
         """Dispatch data to collectd."""
@@ -439,4 +421,5 @@ OBJ = TomcatStat()
 collectd.register_init(init)
 collectd.register_config(OBJ.config)
 collectd.register_read(OBJ.read_temp)
+collectd.register_shutdown(OBJ.executor.shutdown)
 
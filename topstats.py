@@ -4,7 +4,7 @@
 *
 ********************
 """
-"""Python plugin for collectd to get highest CPU/Memory usage process using top command"""
+"""Python plugin for collectd to get highest CPU/Memory usage process from /proc or using top command"""
 
 
 #!/usr/bin/python
@@ -17,9 +17,14 @@ import re
 
 # user imports
 import utils
+import libproctable
 from utils import PlatformOS, PlatformVersion
 from constants import *
 
+# collectors of the process table
+PROC_COLLECTOR = "proc"
+TOP_COLLECTOR = "top"
+
 
 class TopStats(object):
     """Plugin object will be created only once and collects utils
@@ -28,21 +33,28 @@ class TopStats(object):
     def __init__(self, interval=1, utilize_type="CPU", maximum_grep=5, process_name='*'):
         """Initializes interval."""
         self.interval = DEFAULT_INTERVAL
+        self.columnar = False
         self.utilize_type = utilize_type
         self.maximum_grep = maximum_grep
         self.process = process_name
+        self.collector = PROC_COLLECTOR
+        self.proc_table = None
 
     def config(self, cfg):
         """Initializes variables from conf files."""
         for children in cfg.children:
             if children.key == INTERVAL:
                 self.interval = children.values[0]
+            if children.key == COLUMNAR:
+                self.columnar = str(children.values[0]).lower() == "true"
             if children.key == 'utilize_type':
                 self.utilize_type = children.values[0]
             if children.key == "process":
                 self.process = children.values[0]
             if children.key == "maximum_grep":
                 self.maximum_grep = children.values[0]
+            if children.key == "collector":
+                self.collector = children.values[0]
 
     def bytesConv(self, data):
         """
@@ -127,6 +139,41 @@ class TopStats(object):
                 break
         return result
 
+    def proc_command(self):
+        """
+        Returns dictionary with values of top CPU and memory usage summary of the processes read from /proc.
+        """
+        if self.proc_table is None:
+            self.proc_table = libproctable.ProcessTable()
+        samples = self.proc_table.poll()
+        sort_by = "CPU"
+        if self.utilize_type == 'process':
+            if self.process != 'None' and self.process != '*':
+                proc = re.compile('|'.join(self.process.split(',')))
+                samples = [sample for sample in samples if proc.search(sample.name)]
+        elif self.utilize_type == "CPU" or self.utilize_type == "MEM":
+            sort_by = self.utilize_type
+            self.process = "*"
+
+        result = []
+        process_order = 1
+        for sample in self.proc_table.top(samples, int(self.maximum_grep), sort_by):
+            top_stats_res = {}
+            top_stats_res['order'] = process_order
+            top_stats_res['pid'] = long(sample.pid)
+            top_stats_res['user'] = self.proc_table.get_user(sample.uid)
+            top_stats_res['virtual_memory'] = float(sample.vsize_kb)
+            top_stats_res['resident_memory'] = float(sample.rss_kb)
+            top_stats_res['shared_memory'] = float(self.proc_table.shared_kb(sample))
+            top_stats_res['cpu'] = round(sample.cpu_percent, 1)
+            top_stats_res['memory'] = round(sample.memory_percent, 1)
+            top_stats_res[PROCESSNAME] = sample.name
+            top_stats_res['process_group'] = self.process
+            top_stats_res['resource_type'] = self.utilize_type
+            process_order += 1
+            result.append(top_stats_res)
+        return result
+
     def add_common_params(self, top_stats_res):
         """Adds TIMESTAMP, PLUGIN, PLUGIN_INS to dictionary."""
         timestamp = int(round(time.time() * 1000))
@@ -140,7 +187,10 @@ class TopStats(object):
 
     def collect_data(self):
         """Validates if dictionary is not null.If null then returns None."""
-        top_stats_res = self.top_command()
+        if self.collector == TOP_COLLECTOR:
+            top_stats_res = self.top_command()
+        else:
+            top_stats_res = self.proc_command()
         if not top_stats_res:
             collectd.error("Plugin topstats: Unable to fetch Top Usage Summary")
             return None
@@ -153,10 +203,11 @@ class TopStats(object):
     def dispatch_data(self, top_stats_res):
         """Dispatches dictionary to collectd."""
         collectd.info("Plugin topstats: Successfully sent to collectd.")
-        collectd.debug("Plugin topstats: Values dispatched = " +
-                       json.dumps(top_stats_res))
-        for result in top_stats_res:
-            utils.dispatch(result)
+        collectd.debug("Plugin topstats: Documents dispatched = %d" % len(top_stats_res))
+        if self.columnar:
+            utils.dispatch_columnar(top_stats_res)
+        else:
+            utils.dispatch_batch(top_stats_res)
 
     def read(self):
         """Collects all data."""
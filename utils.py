@@ -11,6 +11,7 @@
 import subprocess
 import sys
 import os
+import json
 import platform
 import write_json
 import collectd
@@ -53,7 +54,58 @@ def dispatch(data_dict):
     #
     write_json.write(data_dict)
 
-    # dispatch to other write functions
+    dispatch_values(data_dict, internal_plugin_name)
+
+
+def dispatch_batch(data_list):
+    """Dispatches all documents of one read cycle to collectd.
+       Documents are written by write_json in a single pass per directory."""
+    if not data_list:
+        return
+    hostname = gethostname()
+    plugin_names = []
+    for data_dict in data_list:
+        data_dict[HOSTNAME] = hostname
+        plugin_names.append(data_dict[ACTUALPLUGINTYPE])
+
+    write_json.write_batch(data_list)
+
+    for data_dict, internal_plugin_name in zip(data_list, plugin_names):
+        dispatch_values(data_dict, internal_plugin_name)
+
+
+def dispatch_columnar(data_list):
+    """Dispatches all rows of one read cycle to collectd as a single columnar
+       batch document. Fields common to all rows are stored once, the other
+       fields as parallel arrays serialized in BATCH_COLUMNS."""
+    if not data_list:
+        return
+    first = data_list[0]
+    data_dict = {}
+    for key in BATCH_COMMON_FIELDS:
+        if key in first:
+            data_dict[key] = first[key]
+    names = set()
+    for row in data_list:
+        names.update(row)
+    columns = {}
+    for name in names:
+        if name not in data_dict:
+            columns[name] = [row.get(name) for row in data_list]
+
+    data_dict[HOSTNAME] = gethostname()
+    data_dict[BATCH_TYPE] = COLUMNAR
+    data_dict[BATCH_ROWS] = len(data_list)
+    data_dict[BATCH_COLUMNS] = json.dumps(columns)
+    internal_plugin_name = data_dict[ACTUALPLUGINTYPE]
+
+    write_json.write(data_dict)
+
+    dispatch_values(data_dict, internal_plugin_name)
+
+
+def dispatch_values(data_dict, internal_plugin_name):
+    """Dispatches data to other collectd write functions."""
     metric = collectd.Values()
     metric.plugin = internal_plugin_name
 
@@ -6,22 +6,54 @@
 """
 
 import os
+import errno
 import json
+import time
+import socket
+import threading
 import collectd
+import libsegment
+from threading import Thread
+from Queue import Queue, Empty, Full
 
 # user imports
 from constants import *
 
+# queue entry asking the AsyncWriter to stop after the entries before it
+STOP = object()
+
 
 class WriteJson:
     def __init__(self):
         self.max_entries = 10
         self.path = PATH
+        # ring index per directory, kept in memory after the first read of index.txt
+        self.indexes = {}
+        # serialized documents waiting for the next flush, grouped per directory
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.async_write = WRITE_JSON_ASYNC
+        self.queue_size = WRITE_JSON_QUEUE_SIZE
+        self.queue_policy = WRITE_JSON_QUEUE_POLICY
+        self.storage_mode = WRITE_JSON_STORAGE_MODE
+        self.segment_size = WRITE_JSON_SEGMENT_SIZE
+        # open segment logs per directory when storage mode is segment
+        self.segments = {}
 
     def read_config(self, cfg):
         for children in cfg.children:
             if children.key == MAX_LOG_ENTRIES:
                 self.max_entries = int(children.values[0])
+            elif children.key == ASYNC_WRITE:
+                self.async_write = str(children.values[0]).lower() == "true"
+            elif children.key == QUEUE_SIZE:
+                self.queue_size = int(children.values[0])
+            elif children.key == QUEUE_POLICY:
+                self.queue_policy = children.values[0]
+            elif children.key == STORAGE_MODE:
+                self.storage_mode = children.values[0]
+            elif children.key == SEGMENT_SIZE:
+                self.segment_size = int(children.values[0])
 
     def datadict_to_dirname(self, data):
         if PLUGIN not in data:
@@ -42,6 +74,16 @@ class WriteJson:
             path = os.path.join(path, data[PLUGIN_INS])
         return path
 
+    # returns the cached ring index of the directory, falling back to
+    # index.txt on disk the first time the directory is seen
+    def get_cached_index(self, dirname):
+        if dirname not in self.indexes:
+            index = self.get_index(dirname)
+            if index == ERRNO:
+                return index
+            self.indexes[dirname] = index
+        return self.indexes[dirname]
+
     # creates index file in the required directory if it doesn't exits
     # otherwise just returns index
     def get_index(self, dirname):
@@ -74,26 +116,51 @@ class WriteJson:
         return filename, new_index
 
     def write(self, data, dirname):
-        index = self.get_index(dirname)
+        self.write_lines([json.dumps(data)], dirname)
+
+    def write_segment(self, lines, dirname):
+        """Appends serialized documents to the segment log of dirname."""
+        try:
+            segment = self.segments.get(dirname)
+            if segment is None:
+                segment = libsegment.open_segment(dirname, self.segment_size)
+                self.segments[dirname] = segment
+            segment.append(lines)
+        except (EnvironmentError, ValueError) as e:
+            collectd.error("write_json: writing segment in %s failed: %s" % (dirname, str(e)))
+            segment = self.segments.pop(dirname, None)
+            if segment is not None:
+                segment.close()
+            return False
+        return True
+
+    def write_lines(self, lines, dirname):
+        """Writes serialized documents into the next ring slot of dirname
+        and moves the index forward once for the whole group."""
+        if self.storage_mode == SEGMENT:
+            return self.write_segment(lines, dirname)
+        index = self.get_cached_index(dirname)
         if index == ERRNO:
-            return
+            return False
         (filename, new_index) = self.get_filename_from_index(index)
         fpath_log = os.path.join(dirname, filename)
         fpath_index = os.path.join(dirname, INDEX_FILE)
         try:
-            fh = open(fpath_log, "w")
-            data = json.dumps(data)
-            fh.write(data)
-            fh.write("\n")
-            fh.close()
-            fh = open(fpath_index, "w")
-            fh.write(str(new_index))
-            fh.write("\n")
-            fh.write(str(self.max_entries))
-            fh.write("\n")
-            fh.close()
-        except:
-            fh.close()
+            with open(fpath_log, "w") as fh:
+                fh.write("\n".join(lines))
+                fh.write("\n")
+            with open(fpath_index, "w") as fh:
+                fh.write(str(new_index))
+                fh.write("\n")
+                fh.write(str(self.max_entries))
+                fh.write("\n")
+            self.indexes[dirname] = new_index
+        except (IOError, OSError) as e:
+            collectd.error("write_json: writing to %s failed: %s" % (dirname, str(e)))
+            # re-read index.txt on the next write, the directory may be gone
+            self.indexes.pop(dirname, None)
+            return False
+        return True
 
     def format_json(self, data):
         delete_list = []
@@ -112,17 +179,205 @@ class WriteJson:
         return data
 
     def write_json(self, ds):
+        entry = self.serialize(ds)
+        if entry is None:
+            return
+        self.write_lines([entry[1]], entry[0])
+
+    def serialize(self, ds):
+        """Returns directory and JSON line of a document, None if it has no plugin."""
         data_dict = self.format_json(ds)
         dirname = self.datadict_to_dirname(data_dict)
         if dirname is None:
+            return None
+        columns = data_dict.get(BATCH_COLUMNS)
+        if isinstance(columns, str):
+            # columns of a batch document are already serialized for the
+            # collectd meta, splice them in instead of decoding them again
+            common = dict((key, value) for key, value in data_dict.items() if key != BATCH_COLUMNS)
+            return dirname, '%s, "%s": %s}' % (json.dumps(common)[:-1], BATCH_COLUMNS, columns)
+        return dirname, json.dumps(data_dict)
+
+    def buffer_json(self, ds):
+        """Queues a document for the next flush instead of writing it."""
+        entry = self.serialize(ds)
+        if entry is None:
             return
-        self.write(data_dict, dirname)
+        self.pending.setdefault(entry[0], []).append(entry[1])
+
+    def flush(self):
+        """Writes all buffered documents, one ring slot per directory."""
+        pending = self.pending
+        self.pending = {}
+        for dirname, lines in pending.items():
+            self.write_lines(lines, dirname)
+
+
+class AsyncWriter(Thread):
+    """Thread draining queued documents into the ring files of a WriteJson,
+       so that disk latency does not delay the read callbacks."""
+
+    def __init__(self, writer):
+        Thread.__init__(self)
+        self.daemon = True
+        self.writer = writer
+        self.policy = writer.queue_policy
+        self.queue = Queue(maxsize=writer.queue_size)
+        self.counter_lock = threading.Lock()
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.last_stats = time.time()
+
+    def count(self, queued=0, dropped=0, written=0):
+        with self.counter_lock:
+            self.queued += queued
+            self.dropped += dropped
+            self.written += written
+
+    def put(self, entry):
+        """Enqueues a (dirname, line) entry according to the queue policy."""
+        if self.policy == BLOCK:
+            self.queue.put(entry)
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(entry)
+                    break
+                except Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.count(dropped=1)
+                    except Empty:
+                        pass
+        self.count(queued=1)
+
+    def run(self):
+        """Main thread entrypoint"""
+        stopping = False
+        while not stopping:
+            try:
+                entry = self.queue.get(timeout=WRITE_JSON_STATS_INTERVAL)
+            except Empty:
+                entry = None
+            pending = {}
+            while entry is not None:
+                if entry is STOP:
+                    stopping = True
+                else:
+                    pending.setdefault(entry[0], []).append(entry[1])
+                try:
+                    entry = self.queue.get_nowait()
+                except Empty:
+                    entry = None
+            for dirname, lines in pending.items():
+                with self.writer.lock:
+                    success = self.writer.write_lines(lines, dirname)
+                if success:
+                    self.count(written=len(lines))
+                else:
+                    self.count(dropped=len(lines))
+            if stopping or time.time() - self.last_stats >= WRITE_JSON_STATS_INTERVAL:
+                self.write_stats()
+
+    def stop(self, timeout=WRITE_JSON_SHUTDOWN_TIMEOUT):
+        """Enqueues STOP behind the queued documents and waits at most timeout
+        seconds for them to be written."""
+        deadline = time.time() + timeout
+        try:
+            self.queue.put(STOP, timeout=timeout)
+        except Full:
+            collectd.error("write_json: queue still full at shutdown, %d documents not written" %
+                           self.queue.qsize())
+            return
+        self.join(max(deadline - time.time(), 0))
+        if self.is_alive():
+            collectd.error("write_json: %d documents not written at shutdown" % self.queue.qsize())
+
+    def get_stats(self):
+        """Returns the self-metrics document of the writer."""
+        with self.counter_lock:
+            stats = {"queued": self.queued,
+                     "dropped": self.dropped,
+                     "written": self.written}
+        stats["queueLength"] = self.queue.qsize()
+        stats["queueSize"] = self.queue.maxsize
+        stats["queuePolicy"] = self.policy
+        stats[TIMESTAMP] = int(round(time.time() * 1000))
+        stats[PLUGIN] = WRITE_JSON
+        stats[PLUGINTYPE] = WRITER_STATS
+        try:
+            stats[HOSTNAME] = socket.gethostname()
+        except Exception:
+            stats[HOSTNAME] = HOSTNAMEFAILURE
+        return stats
+
+    def write_stats(self):
+        self.last_stats = time.time()
+        entry = self.writer.serialize(self.get_stats())
+        if entry is None:
+            return
+        with self.writer.lock:
+            self.writer.write_lines([entry[1]], entry[0])
+
+
+# single writer shared by all plugins of the python interpreter, so that ring
+# indexes are read from disk only once
+WRITER = WriteJson()
+ASYNC_WRITER = None
+ASYNC_WRITER_LOCK = threading.Lock()
+
+
+def get_async_writer():
+    """Returns the background writer, starting it on first use."""
+    global ASYNC_WRITER
+    if ASYNC_WRITER is None:
+        with ASYNC_WRITER_LOCK:
+            if ASYNC_WRITER is None:
+                writer = AsyncWriter(WRITER)
+                writer.start()
+                ASYNC_WRITER = writer
+    return ASYNC_WRITER
 
 
 def write(data):
     if not WRITE_JSON_ENABLED:
         return
 
-    collectd.info("write_json invoked")
-    obj = WriteJson()
-    obj.write_json(data)
+    collectd.debug("write_json invoked")
+    if WRITER.async_write:
+        entry = WRITER.serialize(data)
+        if entry is not None:
+            get_async_writer().put(entry)
+        return
+    with WRITER.lock:
+        WRITER.write_json(data)
+
+
+def write_batch(data_list):
+    """Writes all documents of one read cycle, grouping them per directory."""
+    if not WRITE_JSON_ENABLED:
+        return
+
+    collectd.debug("write_json invoked for %d documents" % len(data_list))
+    if WRITER.async_write:
+        async_writer = get_async_writer()
+        for data in data_list:
+            entry = WRITER.serialize(data)
+            if entry is not None:
+                async_writer.put(entry)
+        return
+    with WRITER.lock:
+        for data in data_list:
+            WRITER.buffer_json(data)
+        WRITER.flush()
+
+
+def shutdown():
+    """Writes the documents still queued for the background writer."""
+    if ASYNC_WRITER is not None:
+        ASYNC_WRITER.stop()
+
+
+collectd.register_config(WRITER.read_config)
+collectd.register_shutdown(shutdown)